@@ -1,6 +1,7 @@
 from fastapi import APIRouter
-from .endpoints import podcasts
+from .endpoints import admin, podcasts
 
 api_router = APIRouter()
 
 api_router.include_router(podcasts.api_router, prefix='/v1')
+api_router.include_router(admin.api_router, prefix='/v1/admin')
@@ -0,0 +1,143 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from custom_logger.log_handler import shipping_stats
+from services.admission import get_admission_controller
+from services.api_services import get_api_service
+from services.authentication import verify_admin_key
+from services.catalog_cache import get_catalog_cache, CHANNELS, CHANNEL_ITEMS, PODCAST
+from services.catalog_mirror import get_catalog_mirror
+from services.django_httpx_client import get_django_client
+from services.interaction_buffer import get_interaction_buffer
+from services.token_cache import get_token_cache
+from services.user_index import get_user_index
+from utils.profiling import get_profiler
+from utils.worker import get_worker_state
+
+api_router = APIRouter(dependencies=[Depends(verify_admin_key)])
+
+
+@api_router.get('/worker')
+async def worker_stats(worker_state=Depends(get_worker_state)):
+    return worker_state.stats()
+
+
+@api_router.get('/upstream/pool')
+async def upstream_pool_stats(django_client=Depends(get_django_client)):
+    return django_client.pool_stats()
+
+
+@api_router.get('/upstream/resilience')
+async def upstream_resilience_stats(django_client=Depends(get_django_client)):
+    return django_client.resilience_stats()
+
+
+@api_router.get('/admission/stats')
+async def admission_stats(admission_controller=Depends(get_admission_controller)):
+    return admission_controller.stats()
+
+
+@api_router.get('/auth/token-cache')
+async def token_cache_stats(token_cache=Depends(get_token_cache)):
+    return token_cache.stats()
+
+
+@api_router.get('/interactions/write-behind')
+async def write_behind_stats(interaction_buffer=Depends(get_interaction_buffer)):
+    return interaction_buffer.stats()
+
+
+@api_router.get('/user-index/stats')
+async def user_index_stats(user_index=Depends(get_user_index)):
+    return user_index.stats()
+
+
+@api_router.post('/user-index/{user_id}/rebuild')
+async def rebuild_user_index(user_id: str, user_index=Depends(get_user_index)):
+    rebuilt = await user_index.rebuild(user_id)
+    return {'status': 'success' if rebuilt else 'failure'}
+
+
+@api_router.delete('/user-index')
+async def purge_user_index(user_index=Depends(get_user_index)):
+    deleted = await user_index.purge()
+    return {'status': 'success', 'deleted': deleted}
+
+
+@api_router.get('/logging/stats')
+async def log_shipping_stats():
+    return shipping_stats()
+
+
+@api_router.get('/single-flight/stats')
+async def single_flight_stats(api_service=Depends(get_api_service)):
+    return api_service.single_flight.stats()
+
+
+@api_router.get('/cache/stats')
+async def catalog_cache_stats(catalog_cache=Depends(get_catalog_cache)):
+    return catalog_cache.stats()
+
+
+@api_router.delete('/cache')
+async def purge_catalog_cache(catalog_cache=Depends(get_catalog_cache)):
+    deleted = await catalog_cache.purge()
+    return {'status': 'success', 'deleted': deleted}
+
+
+@api_router.delete('/cache/channels')
+async def purge_channels_list(catalog_cache=Depends(get_catalog_cache)):
+    deleted = await catalog_cache.purge(CHANNELS, '')
+    return {'status': 'success', 'deleted': deleted}
+
+
+@api_router.delete('/cache/channels/{channel_id}')
+async def purge_channel_items(channel_id: int, catalog_cache=Depends(get_catalog_cache)):
+    deleted = await catalog_cache.purge(CHANNEL_ITEMS, channel_id)
+    return {'status': 'success', 'deleted': deleted}
+
+
+@api_router.delete('/cache/podcasts/{podcast_id}')
+async def purge_podcast(podcast_id: int, catalog_cache=Depends(get_catalog_cache)):
+    deleted = await catalog_cache.purge(PODCAST, podcast_id)
+    return {'status': 'success', 'deleted': deleted}
+
+
+@api_router.get('/catalog-mirror/stats')
+async def catalog_mirror_stats(catalog_mirror=Depends(get_catalog_mirror)):
+    return catalog_mirror.stats()
+
+
+@api_router.post('/catalog-mirror/sync')
+async def sync_catalog_mirror(full: Optional[bool] = None, catalog_mirror=Depends(get_catalog_mirror)):
+    return await catalog_mirror.sync_once(full=full)
+
+
+def _stored_profile(profiler, profile_id: str):
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found (it may have been "
+                                                                          "evicted, or stored by another worker)")
+    return profile
+
+
+@api_router.get('/profiles')
+async def list_profiles(profiler=Depends(get_profiler)):
+    return {'stats': profiler.stats(), 'profiles': [profile.summary() for profile in reversed(profiler.profiles)]}
+
+
+@api_router.get('/profiles/{profile_id}')
+async def get_profile(profile_id: str, profiler=Depends(get_profiler)):
+    return _stored_profile(profiler, profile_id).to_dict()
+
+
+@api_router.get('/profiles/{profile_id}/collapsed', response_class=PlainTextResponse)
+async def get_profile_stacks(profile_id: str, profiler=Depends(get_profiler)):
+    return PlainTextResponse(_stored_profile(profiler, profile_id).collapsed())
+
+
+@api_router.delete('/profiles')
+async def clear_profiles(profiler=Depends(get_profiler)):
+    return {'status': 'success', 'deleted': profiler.clear()}
@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Depends, Request, HTTPException, status
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Request, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer
 
-from schemas.interaction import InteractionSchema, BaseInteractionSchema
+from config.config import settings
+from schemas.interaction import ActionTypeEnum, InteractionSchema, BaseInteractionSchema, BulkInteractionSchema
 from services.api_services import get_api_service
 from services.authentication import get_access_jwt_aut
 
@@ -10,28 +14,88 @@ api_router = APIRouter()
 
 @api_router.get("/channels")
 async def channels_list(request: Request, api_service=Depends(get_api_service)):
-    response = await api_service.channels_list(request=request)
+    response = await api_service.channels_list(request=request, if_none_match=request.headers.get('if-none-match'))
     return response
 
 
-@api_router.get("/channels/{channel_id}")
+@api_router.get("/channels/{channel_id}", response_class=ORJSONResponse)
 async def channels_items(channel_id: int, request: Request, api_service=Depends(get_api_service),
-                         payload: HTTPBearer = Depends(get_access_jwt_aut())):
+                         payload: HTTPBearer = Depends(get_access_jwt_aut()),
+                         comments_preview: int = Query(0, ge=0, le=settings.COMMENTS_PREVIEW_MAX)):
     user_id = payload.get('user_id')
     if not user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
 
-    response = await api_service.get_channels_items(request=request, channel_id=channel_id, user_id=user_id)
+    response = await api_service.get_channels_items(request=request, channel_id=channel_id, user_id=user_id,
+                                                    comments_preview=comments_preview,
+                                                    if_none_match=request.headers.get('if-none-match'))
     return response
 
 
-@api_router.get('/podcasts/{podcast_id}')
+@api_router.get('/podcasts', response_class=ORJSONResponse)
+async def multiple_items(request: Request, ids: str = Query(..., description="Comma-separated podcast ids"),
+                         api_service=Depends(get_api_service),
+                         payload: HTTPBearer = Depends(get_access_jwt_aut())):
+    user_id = payload.get('user_id')
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
+    try:
+        podcast_ids = [int(podcast_id) for podcast_id in ids.split(',') if podcast_id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma-separated integers")
+    if not podcast_ids or len(podcast_ids) > settings.PODCAST_BATCH_MAX_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Between 1 and {settings.PODCAST_BATCH_MAX_IDS} ids are allowed")
+    response = await api_service.get_items(request=request, podcast_ids=podcast_ids, user_id=user_id)
+    return ORJSONResponse(response)
+
+
+@api_router.get('/podcasts/{podcast_id}', response_class=ORJSONResponse)
 async def single_item(podcast_id: int, request: Request, api_service=Depends(get_api_service),
-                      payload: HTTPBearer = Depends(get_access_jwt_aut())):
+                      payload: HTTPBearer = Depends(get_access_jwt_aut()),
+                      comments_preview: int = Query(0, ge=0, le=settings.COMMENTS_PREVIEW_MAX)):
+    user_id = payload.get('user_id')
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
+    response = await api_service.get_single_item(request=request, podcast_id=podcast_id, user_id=user_id,
+                                                 comments_preview=comments_preview,
+                                                 if_none_match=request.headers.get('if-none-match'))
+    return response
+
+
+@api_router.get('/podcasts/{podcast_id}/comments')
+async def podcast_comments(podcast_id: int, api_service=Depends(get_api_service),
+                           payload: HTTPBearer = Depends(get_access_jwt_aut()),
+                           cursor: Optional[str] = None,
+                           limit: int = Query(settings.COMMENTS_PAGE_SIZE, ge=1, le=settings.COMMENTS_PAGE_MAX)):
+    user_id = payload.get('user_id')
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
+    response = await api_service.get_comments(podcast_id=podcast_id, limit=limit, cursor=cursor)
+    return response
+
+
+@api_router.get('/me/likes')
+async def my_likes(api_service=Depends(get_api_service), payload: HTTPBearer = Depends(get_access_jwt_aut()),
+                   cursor: Optional[str] = None,
+                   limit: int = Query(settings.USER_INDEX_PAGE_SIZE, ge=1, le=settings.USER_INDEX_PAGE_MAX)):
+    user_id = payload.get('user_id')
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
+    response = await api_service.get_user_actions(user_id=user_id, action_type=ActionTypeEnum.like, limit=limit,
+                                                  cursor=cursor)
+    return response
+
+
+@api_router.get('/me/bookmarks')
+async def my_bookmarks(api_service=Depends(get_api_service), payload: HTTPBearer = Depends(get_access_jwt_aut()),
+                       cursor: Optional[str] = None,
+                       limit: int = Query(settings.USER_INDEX_PAGE_SIZE, ge=1, le=settings.USER_INDEX_PAGE_MAX)):
     user_id = payload.get('user_id')
     if not user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
-    response = await api_service.get_single_item(request=request, podcast_id=podcast_id, user_id=user_id)
+    response = await api_service.get_user_actions(user_id=user_id, action_type=ActionTypeEnum.book_mark,
+                                                  limit=limit, cursor=cursor)
     return response
 
 
@@ -54,3 +118,13 @@ async def remove_interaction(interaction: BaseInteractionSchema, api_service=Dep
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
     response = await api_service.remove_interaction(user_id=user_id, interaction=interaction)
     return response
+
+
+@api_router.post('/interactions/bulk')
+async def bulk_interactions(bulk: BulkInteractionSchema, api_service=Depends(get_api_service),
+                            payload: HTTPBearer = Depends(get_access_jwt_aut())):
+    user_id = payload.get('user_id')
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authentication required for this API")
+    response = await api_service.bulk_interactions(user_id=user_id, bulk=bulk)
+    return response
@@ -0,0 +1,115 @@
+"""
+Before/after benchmark of the per-user annotation of a channel listing.
+
+"before" is the legacy path: load the whole one-document-per-channel interaction document and scan every
+user entry in Python. "after" is InteractionStore.annotations, which computes the flags inside Mongo for the
+requested page only and reads the counts from podcast_counters. Both layouts, and the counters the write
+paths would have kept, are seeded into a throwaway database next to MONGO_DATABASE_NAME and dropped at the
+end. Before timing, the run checks that both paths give the page the same flags and comment counts.
+
+Usage:
+    python -m benchmarks.annotation --interactions 100000 --page-size 20 --rounds 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import motor.motor_asyncio
+
+from config.config import settings
+from services.interaction_store import InteractionStore, LEGACY_COLLECTION
+
+CHANNEL_ID = 1
+
+
+async def seed(database, interactions: int, podcasts: int):
+    store = InteractionStore(database)
+    await store.create_indexes()
+    legacy_doc = {'_id': CHANNEL_ID}
+    action_docs, comment_docs = [], []
+    counter_docs = {}
+    for index in range(interactions):
+        podcast_id = index % podcasts
+        user_id = f'user-{index}'
+        action_type = ('like', 'book_mark', 'comment')[index % 3]
+        counters = counter_docs.setdefault(podcast_id, {'_id': podcast_id, 'channel_id': CHANNEL_ID})
+        counters[action_type] = counters.get(action_type, 0) + 1
+        entry = legacy_doc.setdefault(str(podcast_id), {}).setdefault(action_type, [])
+        if action_type == 'comment':
+            entry.append({'user_id': user_id, 'content': 'nice episode'})
+            comment_docs.append({'channel_id': CHANNEL_ID, 'podcast_id': podcast_id, 'user_id': user_id,
+                                 'content': 'nice episode'})
+        else:
+            entry.append({'user_id': user_id})
+            action_docs.append({'channel_id': CHANNEL_ID, **store.action_key(user_id, podcast_id, action_type)})
+    await database[LEGACY_COLLECTION].insert_one(legacy_doc)
+    await store.actions.insert_many(action_docs)
+    await store.comments.insert_many(comment_docs)
+    await store.counters.insert_many(list(counter_docs.values()))
+    return store
+
+
+async def legacy_annotation(database, user_id: str, items: list):
+    doc = await database[LEGACY_COLLECTION].find_one({'_id': CHANNEL_ID})
+    for item in items:
+        item_doc = doc.get(str(item['id']))
+        if item_doc:
+            item['bookmarked'] = any(user_id == user['user_id'] for user in item_doc.get('book_mark', []))
+            item['liked'] = any(user_id == user['user_id'] for user in item_doc.get('like', []))
+            item['comments_count'] = len(item_doc.get('comment', []))
+    return items
+
+
+async def pipeline_annotation(store: InteractionStore, user_id: str, items: list):
+    annotations = await store.annotations(user_id, [item['id'] for item in items])
+    for item in items:
+        item.update(annotations.get(item['id'], {}))
+    return items
+
+
+async def measure(rounds: int, fn):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+    }
+
+
+async def main(interactions: int, podcasts: int, page_size: int, rounds: int):
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGO_URI)
+    database_name = f'{settings.MONGO_DATABASE_NAME}_bench_annotation'
+    database = client[database_name]
+    await client.drop_database(database_name)
+    try:
+        store = await seed(database, interactions, podcasts)
+        user_id = 'user-3'
+        page = list(range(page_size))
+        expected = await legacy_annotation(database, user_id, [{'id': i} for i in page])
+        actual = await pipeline_annotation(store, user_id, [{'id': i} for i in page])
+        for legacy_item, item in zip(expected, actual):
+            assert {key: item.get(key) for key in legacy_item} == legacy_item, (legacy_item, item)
+        before = await measure(rounds, lambda: legacy_annotation(database, user_id, [{'id': i} for i in page]))
+        after = await measure(rounds, lambda: pipeline_annotation(store, user_id, [{'id': i} for i in page]))
+        print(f'interactions={interactions} podcasts={podcasts} page_size={page_size} rounds={rounds}')
+        print(f'before (document scan): {before}')
+        print(f'after  (aggregation):   {after}')
+    finally:
+        await client.drop_database(database_name)
+        client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--interactions', type=int, default=100_000)
+    parser.add_argument('--podcasts', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.interactions, args.podcasts, args.page_size, args.rounds))
@@ -0,0 +1,326 @@
+"""
+Load and latency benchmark of the real FastAPI app, driven in-process over ASGI.
+
+The Django catalog is replaced by an httpx.MockTransport serving generated channels and podcasts, and log
+records go to a null Elasticsearch client; Mongo and Redis are the local servers from the settings, using a
+throwaway ``<MONGO_DATABASE_NAME>_bench_load`` database and the Redis database given by --redis-db, which
+is FLUSHED before and after the run. The run therefore refuses to start when REDIS_HOST is not a loopback
+address, unless --allow-remote-redis says that server is a disposable benchmark instance. Before the
+scenarios run, --interactors users per channel like or bookmark one of its podcasts.
+
+Each scenario sends --requests requests from --concurrency concurrent clients and reports throughput,
+p50/p95/p99 latency and the Redis round-trips per request (a pipeline counts as one; background work such as
+cache refreshes and write-behind flushes is included). The results are saved as JSON (with the git commit) and can be compared to an
+earlier run with --compare.
+
+Usage:
+    python -m benchmarks.load --interactors 10000 --concurrency 50 --requests 2000
+    python -m benchmarks.load --scenarios channel_items podcast --compare load-<commit>.json
+    python -m benchmarks.load --scenarios channel_items podcast --no-token-cache --no-redis-prefetch
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import statistics
+import subprocess
+import time
+import uuid
+
+import httpx
+
+from config.config import settings
+
+SCENARIOS = ('channels', 'channel_items', 'podcast', 'interaction', 'remove_interaction')
+SEED_BATCH_SIZE = 1000
+LOOPBACK_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+class FakeCatalog:
+    """
+    Stand-in for the Django catalog service, served through httpx.MockTransport.
+    Podcast ids are numbered per channel: channel c holds ids (c - 1) * podcasts_per_channel + 1 onwards.
+    """
+
+    def __init__(self, channels: int, podcasts_per_channel: int, latency: float = 0.0):
+        self.channels = channels
+        self.podcasts_per_channel = podcasts_per_channel
+        self.latency = latency
+        self.requests = 0
+
+    def podcast_ids(self, channel_id: int) -> range:
+        first = (channel_id - 1) * self.podcasts_per_channel + 1
+        return range(first, first + self.podcasts_per_channel)
+
+    def channel_of(self, podcast_id: int) -> int:
+        return (podcast_id - 1) // self.podcasts_per_channel + 1
+
+    def podcast(self, podcast_id: int) -> dict:
+        return {'id': podcast_id, 'channel': self.channel_of(podcast_id), 'title': f'Episode {podcast_id}',
+                'description': 'x' * 200, 'audio_url': f'https://cdn.example.com/{podcast_id}.mp3'}
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parts = [part for part in request.url.path.split('/') if part]
+        if parts == ['channels']:
+            return httpx.Response(200, json=[{'id': channel_id, 'title': f'Channel {channel_id}'}
+                                             for channel_id in range(1, self.channels + 1)])
+        if len(parts) == 2 and parts[0] == 'channels':
+            channel_id = int(parts[1])
+            if not 1 <= channel_id <= self.channels:
+                return httpx.Response(404, json={'detail': 'Not found.'})
+            return httpx.Response(200, json={
+                'channel': {'id': channel_id, 'title': f'Channel {channel_id}'},
+                'items': [self.podcast(podcast_id) for podcast_id in self.podcast_ids(channel_id)],
+            })
+        if parts and parts[0] == 'podcasts':
+            if len(parts) == 1:
+                ids = [int(podcast_id) for podcast_id in request.url.params.get('ids', '').split(',') if podcast_id]
+                return httpx.Response(200, json=[self.podcast(podcast_id) for podcast_id in ids])
+            return httpx.Response(200, json=self.podcast(int(parts[1])))
+        return httpx.Response(404, json={'detail': 'Not found.'})
+
+
+class NullElasticsearch:
+    """
+    Elasticsearch client stand-in accepting every bulk request, so ElasticHandler ships without a server.
+    """
+
+    class _Response:
+        def __init__(self, body: dict):
+            self.body = body
+
+    def options(self, **kwargs):
+        return self
+
+    def bulk(self, *args, operations=(), **kwargs):
+        # Every index action is serialized as a header line followed by the document.
+        items = [{'index': {'status': 201}} for _ in range(len(operations) // 2)]
+        return self._Response({'errors': False, 'items': items})
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def summarize(latencies: list, errors: int, elapsed: float, concurrency: int) -> dict:
+    timings = sorted(latency * 1000 for latency in latencies)
+
+    def percentile(fraction: float) -> float:
+        return round(timings[min(len(timings) - 1, int(len(timings) * fraction))], 3)
+
+    return {
+        'requests': len(timings),
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+async def run_scenario(send, requests: int, concurrency: int) -> dict:
+    """
+    The run_scenario function sends requests from concurrency workers sharing one request counter.
+
+    :param send: Coroutine function taking the request index and returning an httpx.Response
+    :param requests: int: Total number of requests of the scenario
+    :param concurrency: int: Number of requests in flight at any time
+    :return: The throughput and latency summary of the scenario
+    """
+    latencies, errors = [], 0
+    indexes = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            start = time.perf_counter()
+            response = await send(index)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start, concurrency)
+
+
+async def seed(interaction_store, catalog: FakeCatalog, interactors: int):
+    """
+    The seed function makes interactors users per channel like or bookmark one of the channel's podcasts.
+    """
+    rng = random.Random(1)
+    changes = []
+    for channel_id in range(1, catalog.channels + 1):
+        podcast_ids = catalog.podcast_ids(channel_id)
+        for index in range(interactors):
+            action_type = 'like' if index % 2 else 'book_mark'
+            changes.append((f'user-{index}', channel_id, rng.choice(podcast_ids), action_type, True))
+            if len(changes) >= SEED_BATCH_SIZE:
+                await interaction_store.apply_actions(changes)
+                changes = []
+    if changes:
+        await interaction_store.apply_actions(changes)
+
+
+async def issue_tokens(redis_db, users: int) -> list:
+    from schemas.token import AccessToken
+    from utils.token import create_access_token
+
+    headers = []
+    expires = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    for index in range(users):
+        user_id, jti = f'user-{index}', uuid.uuid4().hex
+        await redis_db.set(f'user_{user_id} || {jti}', '1', ex=3600)
+        token = create_access_token(AccessToken(user_id=user_id, jti=jti, exp=expires))
+        headers.append({'Authorization': f'Token {token}'})
+    return headers
+
+
+def build_scenarios(client: httpx.AsyncClient, catalog: FakeCatalog, headers: list) -> dict:
+    rng = random.Random(2)
+    podcasts = catalog.channels * catalog.podcasts_per_channel
+
+    def interaction_body() -> dict:
+        podcast_id = rng.randint(1, podcasts)
+        return {'channel_id': catalog.channel_of(podcast_id), 'podcast_id': podcast_id,
+                'action_type': rng.choice(('like', 'book_mark'))}
+
+    return {
+        'channels': lambda index: client.get('/api/v1/channels'),
+        'channel_items': lambda index: client.get(f'/api/v1/channels/{rng.randint(1, catalog.channels)}',
+                                                  headers=rng.choice(headers)),
+        'podcast': lambda index: client.get(f'/api/v1/podcasts/{rng.randint(1, podcasts)}',
+                                            headers=rng.choice(headers)),
+        'interaction': lambda index: client.post('/api/v1/interaction', json=interaction_body(),
+                                                 headers=rng.choice(headers)),
+        'remove_interaction': lambda index: client.post('/api/v1/remove_interaction', json=interaction_body(),
+                                                        headers=rng.choice(headers)),
+    }
+
+
+def redis_round_trips() -> dict:
+    from utils.metrics import redis_command_duration_seconds
+
+    return {command: state[2] for (command, *_), state in redis_command_duration_seconds.snapshot()['values']}
+
+
+def round_trips_per_request(before: dict, after: dict, requests: int) -> dict:
+    commands = {command: (count - before.get(command, 0)) / requests for command, count in after.items()}
+    return {
+        'redis_round_trips': round(sum(commands.values()), 3),
+        'redis_commands': {command: round(per_request, 3) for command, per_request in sorted(commands.items())
+                           if per_request},
+    }
+
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f'compared to {baseline_path} (commit {baseline.get("commit")}):')
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        changes = []
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'redis_round_trips'):
+            if key not in previous:
+                continue
+            delta = (current[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+            changes.append(f'{key} {previous[key]} -> {current[key]} ({delta:+.1f}%)')
+        print(f'  {name}: ' + ', '.join(changes))
+
+
+async def main(args):
+    if settings.REDIS_HOST not in LOOPBACK_HOSTS and not args.allow_remote_redis:
+        raise SystemExit(f'Refusing to flush Redis database {args.redis_db} on {settings.REDIS_HOST}: point REDIS_HOST '
+                         f'at a local server, or pass --allow-remote-redis if that server only serves benchmarks.')
+    # Settings are adjusted before the app's clients and services are created, since they read them then.
+    settings.MONGO_DATABASE_NAME = f'{settings.MONGO_DATABASE_NAME}_bench_load'
+    settings.REDIS_DATABASE_NUMBER = args.redis_db
+    settings.CATALOG_CACHE_ENABLED = not args.no_catalog_cache
+    settings.TOKEN_CACHE_ENABLED = not args.no_token_cache
+    settings.REDIS_PREFETCH_ENABLED = not args.no_redis_prefetch
+
+    from custom_logger.log_handler import _elastic_handlers
+    from db.mongo_db import get_mongo_db
+    from db.redis_db import get_redis_client
+    from main import app
+    from services.django_httpx_client import get_django_client
+    from services.interaction_store import get_interaction_store
+
+    for handler in _elastic_handlers():
+        handler.es = NullElasticsearch()
+    catalog = FakeCatalog(args.channels, args.podcasts_per_channel, latency=args.upstream_latency)
+    get_django_client()._transport = httpx.MockTransport(catalog.handle)
+
+    mongo_db, redis_db = get_mongo_db(), get_redis_client()
+    await mongo_db.client.drop_database(mongo_db.name)
+    await redis_db.flushdb()
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.datetime.utcnow().isoformat(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'scenarios': {},
+    }
+    try:
+        async with app.router.lifespan_context(app):
+            start = time.perf_counter()
+            await seed(get_interaction_store(), catalog, args.interactors)
+            print(f'seeded {args.interactors} interactors x {args.channels} channels '
+                  f'in {time.perf_counter() - start:.1f}s')
+            headers = await issue_tokens(redis_db, args.users)
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+                scenarios = build_scenarios(client, catalog, headers)
+                for name in args.scenarios:
+                    await run_scenario(scenarios[name], min(args.warmup, args.requests), args.concurrency)
+                    before = redis_round_trips()
+                    summary = await run_scenario(scenarios[name], args.requests, args.concurrency)
+                    summary.update(round_trips_per_request(before, redis_round_trips(), args.requests))
+                    results['scenarios'][name] = summary
+                    print(f'{name:<20} {summary}')
+    finally:
+        await mongo_db.client.drop_database(mongo_db.name)
+        await redis_db.flushdb()
+
+    output = args.output or f'load-{results["commit"]}.json'
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'results saved to {output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario')
+    parser.add_argument('--warmup', type=int, default=100, help='Untimed requests before each scenario')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--podcasts-per-channel', type=int, default=50)
+    parser.add_argument('--interactors', type=int, default=10_000, help='Interacting users per channel')
+    parser.add_argument('--users', type=int, default=200, help='Users sending the benchmark requests')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='Fake Django latency in seconds')
+    parser.add_argument('--no-catalog-cache', action='store_true', help='Always call the fake Django catalog')
+    parser.add_argument('--no-token-cache', action='store_true', help='Check every token against Redis')
+    parser.add_argument('--no-redis-prefetch', action='store_true',
+                        help='Send the Redis reads of a request one by one instead of in one pipeline')
+    parser.add_argument('--redis-db', type=int, default=15, help='Redis database used and flushed by the run')
+    parser.add_argument('--allow-remote-redis', action='store_true',
+                        help='Flush --redis-db even though REDIS_HOST is not local (a benchmark-only server)')
+    parser.add_argument('--output', help='Result file; defaults to load-<commit>.json')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    asyncio.run(main(parser.parse_args()))
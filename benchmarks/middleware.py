@@ -0,0 +1,208 @@
+"""
+Before/after benchmark of the request logging middleware.
+
+"before" is the former ``@app.middleware("http")`` logging_middleware (Starlette's BaseHTTPMiddleware)
+awaiting a structlog AsyncBoundLogger; "after" is custom_logger.middleware.RequestLoggingMiddleware with
+the synchronous BoundLogger. Both log into an in-memory handler, and the apps are driven directly through
+the ASGI interface so the numbers only contain the middleware, routing and serialization cost.
+
+For the streaming route the benchmark also reports the time to the first body chunk, which is when a
+client starts receiving data.
+
+Usage:
+    python -m benchmarks.middleware --requests 5000 --chunks 20
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import statistics
+import time
+import uuid
+
+import structlog
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+from custom_logger.middleware import RequestLoggingMiddleware
+
+
+class MemoryHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = collections.deque(maxlen=1000)
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+
+
+def build_logger(wrapper_class):
+    stdlib_logger = logging.getLogger(f'bench_{wrapper_class.__name__}')
+    stdlib_logger.handlers = [MemoryHandler()]
+    stdlib_logger.setLevel(logging.INFO)
+    stdlib_logger.propagate = False
+    return structlog.wrap_logger(
+        stdlib_logger,
+        processors=[
+            structlog.stdlib.add_log_level,
+            structlog.processors.TimeStamper(fmt="%Y-%m-%dT%H:%M:%S.%fZ"),
+            structlog.processors.JSONRenderer(),
+        ],
+        wrapper_class=wrapper_class,
+    )
+
+
+def add_routes(app: FastAPI, chunks: int):
+    @app.get('/json/{item_id}')
+    async def json_route(item_id: int):
+        return {'id': item_id, 'title': 'episode', 'liked': False, 'bookmarked': True}
+
+    @app.get('/stream')
+    async def stream_route():
+        async def body():
+            for index in range(chunks):
+                yield f'{{"chunk": {index}}}\n'.encode()
+                await asyncio.sleep(0)
+        return StreamingResponse(body(), media_type='application/x-ndjson')
+
+
+def build_before_app(chunks: int) -> FastAPI:
+    app = FastAPI()
+    add_routes(app, chunks)
+    logger = build_logger(structlog.stdlib.AsyncBoundLogger)
+
+    @app.middleware("http")
+    async def logging_middleware(request: Request, call_next) -> Response:
+        correlation_id = request.headers.get("correlation-id")
+        if not correlation_id:
+            correlation_id = uuid.uuid4().hex
+        setattr(request.state, 'correlation_id', correlation_id)
+        status_code = None
+        response = None
+        message = "Request processed successfully"
+        has_exception = False
+        event = f"Podcasts/middleware{request.url.path}"
+        start_time = time.perf_counter_ns()
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        except Exception as e:
+            status_code = 500
+            message = f"Internal Server Error: {str(e)}"
+            has_exception = True
+        finally:
+            process_time = time.perf_counter_ns() - start_time
+            log_dict = {
+                "remote_host": request.client.host,
+                "request_method": f"{request.method}",
+                "url": f" {request.url.path}",
+                "status_code": status_code,
+                "referer": request.headers.get("referer", ""),
+                "user_agent": request.headers.get("user-agent", ""),
+                "elapsed_time": process_time,
+                "message": message,
+                'correlation_id': correlation_id,
+            }
+        if has_exception:
+            await logger.error(event=event, **log_dict)
+        else:
+            await logger.info(event=event, **log_dict)
+        return response
+
+    return app
+
+
+def build_after_app(chunks: int) -> FastAPI:
+    app = FastAPI()
+    add_routes(app, chunks)
+    app.add_middleware(RequestLoggingMiddleware, logger=build_logger(structlog.stdlib.BoundLogger))
+    return app
+
+
+async def call(app, path: str):
+    """
+    The call function sends one GET request through the ASGI interface.
+
+    :return: A tuple of (seconds to the first body chunk, seconds to the end of the response)
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'bench'), (b'user-agent', b'bench')],
+        'client': ('127.0.0.1', 50000), 'server': ('bench', 80),
+    }
+    first_chunk = None
+    request_sent = False
+    response_done = asyncio.Event()
+    start = time.perf_counter()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Like a real server: nothing more arrives until the client goes away after the response.
+        await response_done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal first_chunk
+        if message['type'] != 'http.response.body':
+            return
+        if first_chunk is None and message.get('body'):
+            first_chunk = time.perf_counter() - start
+        if not message.get('more_body', False):
+            response_done.set()
+
+    await app(scope, receive, send)
+    return first_chunk, time.perf_counter() - start
+
+
+def summarize(timings: list) -> dict:
+    timings = sorted(timing * 1000 for timing in timings)
+    return {
+        'p50_ms': round(statistics.median(timings), 4),
+        'p99_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 4),
+        'mean_ms': round(statistics.fmean(timings), 4),
+    }
+
+
+async def measure(app, requests: int) -> dict:
+    # Warm up routing and the logger caches before timing.
+    for index in range(50):
+        await call(app, f'/json/{index}')
+        await call(app, '/stream')
+
+    json_total = []
+    for index in range(requests):
+        json_total.append((await call(app, f'/json/{index}'))[1])
+
+    stream_first, stream_total = [], []
+    for _ in range(max(requests // 10, 1)):
+        first_chunk, total = await call(app, '/stream')
+        stream_first.append(first_chunk)
+        stream_total.append(total)
+
+    return {
+        'json': summarize(json_total),
+        'stream_first_chunk': summarize(stream_first),
+        'stream_total': summarize(stream_total),
+    }
+
+
+async def main(requests: int, chunks: int):
+    before = await measure(build_before_app(chunks), requests)
+    after = await measure(build_after_app(chunks), requests)
+    print(f'requests={requests} stream_chunks={chunks}')
+    for name in before:
+        print(f'{name}:')
+        print(f'  before (BaseHTTPMiddleware + AsyncBoundLogger): {before[name]}')
+        print(f'  after  (ASGI middleware + BoundLogger):         {after[name]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--chunks', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.chunks))
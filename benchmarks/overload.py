@@ -0,0 +1,163 @@
+"""
+Overload benchmark of the admission controller.
+
+A small app serves stub handlers at the /api/v1/interaction and /api/v1/channels paths, so the requests fall
+into the same admission classes as the real routes, on top of a simulated backend with a fixed capacity
+(--workers requests served at a time, --service-time seconds each); the real handlers, Mongo and Django are
+not involved. An open-loop
+generator offers --overload times that capacity, --write-share of it as interaction writes and the rest as
+channel polling, and a response only counts towards goodput when it succeeds within --deadline seconds
+(the point where a real client has given up). The run is repeated without and with AdmissionMiddleware.
+
+Usage:
+    python -m benchmarks.overload --workers 10 --service-time 0.02 --overload 2 --duration 10
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from fastapi import FastAPI
+
+from services.admission import AdmissionController, AdmissionMiddleware, CATALOG, READ, RouteClass, WRITE
+
+
+def build_app(workers: int, service_time: float, controller: AdmissionController = None) -> FastAPI:
+    app = FastAPI()
+    backend = asyncio.Semaphore(workers)
+
+    async def serve():
+        async with backend:
+            await asyncio.sleep(service_time)
+
+    @app.post('/api/v1/interaction')
+    async def interaction():
+        await serve()
+        return {'status': 'success', 'message': 'Interaction recorded successfully.'}
+
+    @app.get('/api/v1/channels')
+    async def channels():
+        await serve()
+        return [{'id': 1, 'title': 'Channel 1'}]
+
+    if controller is not None:
+        app.add_middleware(AdmissionMiddleware, controller=controller)
+    return app
+
+
+def build_controller(workers: int, deadline: float) -> AdmissionController:
+    return AdmissionController(
+        [
+            RouteClass(WRITE, priority=0, max_concurrency=workers * 4, max_queue_time=deadline / 2, max_queue=500),
+            RouteClass(READ, priority=1, max_concurrency=workers * 4, max_queue_time=deadline / 4, max_queue=500),
+            RouteClass(CATALOG, priority=2, max_concurrency=workers * 4, max_queue_time=deadline / 10,
+                       max_queue=500),
+        ],
+        initial_limit=workers * 4,
+        min_limit=max(workers // 2, 1),
+        max_limit=workers * 20,
+        latency_target=deadline / 4,
+        backoff_ratio=0.9,
+    )
+
+
+async def call(app, method: str, path: str) -> int:
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'bench'), (b'content-type', b'application/json')],
+        'client': ('127.0.0.1', 50000), 'server': ('bench', 80),
+    }
+    status_code = 0
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await response_done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status_code
+        if message['type'] == 'http.response.start':
+            status_code = message['status']
+        elif not message.get('more_body', False):
+            response_done.set()
+
+    await app(scope, receive, send)
+    return status_code
+
+
+async def offer_load(app, rate: float, duration: float, write_share: float, deadline: float) -> dict:
+    rng = random.Random(3)
+    results = {WRITE: [], CATALOG: []}
+    tasks = []
+
+    async def one(kind: str):
+        start = time.perf_counter()
+        if kind == WRITE:
+            status_code = await call(app, 'POST', '/api/v1/interaction')
+        else:
+            status_code = await call(app, 'GET', '/api/v1/channels')
+        results[kind].append((status_code, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    next_arrival = start
+    while next_arrival - start < duration:
+        # Poisson arrivals: the generator does not slow down when the app does.
+        await asyncio.sleep(max(next_arrival - time.perf_counter(), 0))
+        kind = WRITE if rng.random() < write_share else CATALOG
+        tasks.append(asyncio.create_task(one(kind)))
+        next_arrival += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+
+    summary = {}
+    for kind, outcomes in results.items():
+        good = [latency for status_code, latency in outcomes if status_code == 200 and latency <= deadline]
+        shed = sum(1 for status_code, _ in outcomes if status_code == 503)
+        latencies = sorted(latency * 1000 for status_code, latency in outcomes if status_code == 200)
+        summary[kind] = {
+            'offered_rps': round(len(outcomes) / duration, 1),
+            'goodput_rps': round(len(good) / duration, 1),
+            'shed': shed,
+            'p50_ms': round(statistics.median(latencies), 1) if latencies else None,
+            'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 1) if latencies else None,
+        }
+    return summary
+
+
+async def main(workers: int, service_time: float, overload: float, duration: float, write_share: float,
+               deadline: float):
+    capacity = workers / service_time
+    rate = capacity * overload
+    print(f'capacity={capacity:.0f} rps offered={rate:.0f} rps deadline={deadline}s duration={duration}s')
+
+    without = await offer_load(build_app(workers, service_time), rate, duration, write_share, deadline)
+    controller = build_controller(workers, deadline)
+    with_admission = await offer_load(build_app(workers, service_time, controller), rate, duration, write_share,
+                                      deadline)
+    for kind in (WRITE, CATALOG):
+        print(f'{kind}:')
+        print(f'  without admission control: {without[kind]}')
+        print(f'  with admission control:    {with_admission[kind]}')
+    total = {name: sum(result[kind]['goodput_rps'] for kind in result)
+             for name, result in (('without', without), ('with', with_admission))}
+    print(f'total goodput: without {total["without"]:.1f} rps, with {total["with"]:.1f} rps '
+          f'(capacity {capacity:.0f} rps); final limit {controller.stats()["limit"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=10, help='Requests the backend serves at a time')
+    parser.add_argument('--service-time', type=float, default=0.02, help='Seconds per request')
+    parser.add_argument('--overload', type=float, default=2.0, help='Offered load as a multiple of capacity')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--write-share', type=float, default=0.2)
+    parser.add_argument('--deadline', type=float, default=1.0, help='Client timeout in seconds')
+    args = parser.parse_args()
+    asyncio.run(main(args.workers, args.service_time, args.overload, args.duration, args.write_share,
+                     args.deadline))
@@ -0,0 +1,98 @@
+"""
+Overhead benchmark of the per-request profiler (utils.profiling).
+
+The same app is measured in three variants: without ProfilingMiddleware, with the middleware installed but
+no request picked (the production default), and with every request profiled (sample rate 1). The variants
+take turns every --chunk requests, so machine noise is spread evenly over them. The route goes through the
+instrumented paths a real request takes: span(), add_span() and a @traced coroutine, plus an awaited sleep
+so the sampler thread has something to see. The apps are driven directly through the ASGI interface, so the
+numbers only contain the middleware, routing and serialization cost.
+
+The run fails (exit code 1) when the idle middleware adds more than --max-overhead percent to the median
+request time, so it can guard the "negligible when disabled" promise in CI.
+
+Usage:
+    python -m benchmarks.profiling --requests 10000 --max-overhead 5
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from fastapi import FastAPI
+
+from benchmarks.middleware import call, summarize
+from utils.profiling import Profiler, ProfilingMiddleware, add_span, span, traced
+
+
+@traced('mongo')
+async def load_annotations(item_id: int) -> dict:
+    return {'liked': item_id % 2 == 0, 'bookmarked': False}
+
+
+def build_app(profiler: Profiler = None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/json/{item_id}')
+    async def json_route(item_id: int):
+        with span('auth'):
+            user_id = item_id
+        start = time.perf_counter()
+        await asyncio.sleep(0)
+        add_span('redis', start, time.perf_counter(), 'GET')
+        annotations = await load_annotations(item_id)
+        with span('serialization', 'encode response'):
+            return {'id': item_id, 'user': user_id, 'title': 'episode', **annotations}
+
+    if profiler is not None:
+        app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    return app
+
+
+def new_profiler(sample_rate: float, interval: float) -> Profiler:
+    return Profiler(ring_size=100, sample_rate=sample_rate, interval=interval, max_stacks=2000, max_spans=1000)
+
+
+async def measure(apps: dict, requests: int, chunk: int) -> dict:
+    for app in apps.values():
+        for index in range(200):
+            await call(app, f'/json/{index}')
+    # The apps take turns every `chunk` requests, so a slower stretch of the machine is shared by all of them
+    # instead of landing on one and deciding the comparison.
+    timings = {name: [] for name in apps}
+    for first in range(0, requests, chunk):
+        for name, app in apps.items():
+            for index in range(first, min(first + chunk, requests)):
+                timings[name].append((await call(app, f'/json/{index}'))[1])
+    return {name: summarize(app_timings) for name, app_timings in timings.items()}
+
+
+async def main(args) -> int:
+    idle = new_profiler(0.0, args.interval)
+    profiled = new_profiler(1.0, args.interval)
+    results = await measure({
+        'no middleware': build_app(),
+        'middleware, not triggered': build_app(idle),
+        'every request profiled': build_app(profiled),
+    }, args.requests, args.chunk)
+    print(f'requests={args.requests} chunk={args.chunk} interval={args.interval}s')
+    for name, result in results.items():
+        print(f'  {name:<26} {result}')
+
+    baseline = results['no middleware']['p50_ms']
+    overhead = (results['middleware, not triggered']['p50_ms'] - baseline) / baseline * 100
+    latest = profiled.profiles[-1]
+    print(f'idle overhead: {overhead:+.2f}% of p50 (limit {args.max_overhead}%)')
+    print(f'last profile: {latest.summary()}')
+    assert not idle.profiles, 'an untriggered request was profiled'
+    return 0 if overhead <= args.max_overhead else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--chunk', type=int, default=50, help='Requests each app serves before the next takes over')
+    parser.add_argument('--interval', type=float, default=0.005, help='PROFILING_SAMPLE_INTERVAL of the run')
+    parser.add_argument('--max-overhead', type=float, default=5.0,
+                        help='Largest accepted p50 overhead of the idle middleware, in percent')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,111 @@
+"""
+Startup, memory and drain benchmark of the production server (server.py).
+
+The server is started as a subprocess with --workers workers and the event loop and HTTP parser given by
+--loop and --http, using the Mongo, Redis and Django settings from the environment. The run reports the time
+until every worker is ready (from the worker_startup_seconds gauges, merged over the workers through a
+temporary METRICS_MULTIPROC_DIR) and each worker's resident memory. It then sends SIGTERM while a client keeps
+requesting /api/v1/channels and reports how many requests succeeded and failed during the drain and how long the
+server took to exit.
+
+Usage:
+    python -m benchmarks.startup --workers 4
+    python -m benchmarks.startup --workers 4 --loop asyncio --http h11
+"""
+import argparse
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+METRIC_LINE = re.compile(r'^(worker_\w+)\{pid="(\d+)"\} (\S+)$')
+
+
+def worker_metrics(body: str) -> dict:
+    workers: dict = {}
+    for line in body.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, pid, value = match.groups()
+            workers.setdefault(pid, {})[name] = float(value)
+    return workers
+
+
+async def wait_ready(client: httpx.AsyncClient, workers: int, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get('/metrics')
+            ready = {pid: values for pid, values in worker_metrics(response.text).items()
+                     if 'worker_startup_seconds' in values}
+            if len(ready) >= workers:
+                return ready
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f'{workers} workers were not ready after {timeout}s')
+
+
+async def drain(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float) -> dict:
+    outcomes = {'ok': 0, 'shed': 0, 'failed': 0}
+    stop = asyncio.Event()
+
+    async def keep_requesting():
+        while not stop.is_set():
+            try:
+                response = await client.get('/api/v1/channels')
+                outcomes['ok' if response.status_code < 500 else 'shed'] += 1
+            except httpx.TransportError:
+                outcomes['failed'] += 1
+                await asyncio.sleep(0.01)
+
+    requester = asyncio.create_task(keep_requesting())
+    await asyncio.sleep(0.5)
+    start = time.monotonic()
+    process.send_signal(signal.SIGTERM)
+    while process.poll() is None and time.monotonic() - start < timeout:
+        await asyncio.sleep(0.05)
+    exit_seconds = time.monotonic() - start
+    stop.set()
+    await requester
+    return {**outcomes, 'exit_seconds': round(exit_seconds, 2), 'exit_code': process.poll()}
+
+
+async def main(args):
+    metrics_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    env = {**os.environ, 'SERVER_WORKERS': str(args.workers), 'SERVER_PORT': str(args.port),
+           'SERVER_LOOP': args.loop, 'SERVER_HTTP': args.http, 'SERVER_DRAIN_DELAY': str(args.drain_delay),
+           'METRICS_MULTIPROC_DIR': metrics_dir, 'METRICS_SNAPSHOT_INTERVAL': '0.5'}
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, 'server.py'], env=env)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{args.port}', timeout=5.0) as client:
+            workers = await wait_ready(client, args.workers, args.timeout)
+            print(f'{args.workers} workers ready after {time.monotonic() - start:.2f}s '
+                  f'(loop={args.loop}, http={args.http})')
+            for pid, values in sorted(workers.items()):
+                print(f'  worker {pid}: startup {values["worker_startup_seconds"]:.2f}s, '
+                      f'rss {values.get("worker_resident_memory_bytes", 0) / 2 ** 20:.1f} MiB, '
+                      f'peak {values.get("worker_max_resident_memory_bytes", 0) / 2 ** 20:.1f} MiB')
+            print(f'drain: {await drain(client, process, args.timeout)}')
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--loop', default='auto', help='auto, asyncio or uvloop')
+    parser.add_argument('--http', default='auto', help='auto, h11 or httptools')
+    parser.add_argument('--drain-delay', type=float, default=2.0, help='SERVER_DRAIN_DELAY of the run')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for startup and exit')
+    asyncio.run(main(parser.parse_args()))
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from pydantic_settings import BaseSettings
 
 
@@ -5,6 +7,12 @@ class Settings(BaseSettings):
     REDIS_HOST: str
     REDIS_PORT: int
     REDIS_DATABASE_NUMBER: int
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 1.0
+    REDIS_SOCKET_TIMEOUT: float = 1.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 1.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    REDIS_PREFETCH_ENABLED: bool = True
 
     MONGO_URI: str
     MONGO_DATABASE_NAME: str
@@ -15,16 +23,149 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
 
+    TOKEN_CACHE_ENABLED: bool = True
+    TOKEN_CACHE_MAX_SIZE: int = 10000
+    TOKEN_CACHE_MAX_STALENESS: float = 30.0
+    TOKEN_REVOCATION_CHANNEL: str = 'token_revocations'
+
     CHANNEL_LIST_URL: str
     PODCAST_URL: str
+    PODCAST_BATCH_URL: str = ''
 
     ELASTICSEARCH_HOST: str
     ELASTICSEARCH_PORT: int
 
+    METRICS_MULTIPROC_DIR: str = ''
+    METRICS_SNAPSHOT_INTERVAL: float = 5.0
+
+    LOG_SHIPPER_QUEUE_SIZE: int = 10000
+    LOG_SHIPPER_BATCH_SIZE: int = 500
+    LOG_SHIPPER_FLUSH_INTERVAL: float = 1.0
+    LOG_SHIPPER_OVERFLOW_POLICY: str = 'drop_newest'
+    LOG_SHIPPER_BLOCK_TIMEOUT: float = 0.05
+
+    ADMIN_API_KEY: str = ''
+
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30.0
+    UPSTREAM_HTTP2: bool = False
+    UPSTREAM_CONNECT_TIMEOUT: float = 2.0
+    UPSTREAM_READ_TIMEOUT: float = 5.0
+    UPSTREAM_WRITE_TIMEOUT: float = 5.0
+    UPSTREAM_POOL_TIMEOUT: float = 1.0
+    UPSTREAM_BUDGET: float = 3.0
+    UPSTREAM_BREAKER_FAILURE_THRESHOLD: int = 5
+    UPSTREAM_BREAKER_RECOVERY_TIMEOUT: float = 10.0
+    UPSTREAM_BREAKER_HALF_OPEN_MAX_CALLS: int = 1
+    UPSTREAM_RETRY_MAX_ATTEMPTS: int = 2
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.05
+    UPSTREAM_RETRY_MAX_DELAY: float = 0.5
+    UPSTREAM_RETRY_BUDGET_RATIO: float = 0.1
+    UPSTREAM_RETRY_BUDGET_MIN_PER_SECOND: float = 1.0
+    UPSTREAM_HEDGE_ENABLED: bool = False
+    UPSTREAM_HEDGE_PERCENTILE: float = 0.95
+    UPSTREAM_HEDGE_MIN_SAMPLES: int = 50
+    UPSTREAM_HEDGE_MIN_DELAY: float = 0.01
+    INTERACTION_OVERLAY_BUDGET: float = 0.25
+
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_INITIAL_LIMIT: int = 100
+    ADMISSION_MIN_LIMIT: int = 10
+    ADMISSION_MAX_LIMIT: int = 500
+    ADMISSION_LATENCY_TARGET: float = 0.5
+    ADMISSION_BACKOFF_RATIO: float = 0.9
+    ADMISSION_MAX_QUEUE: int = 200
+    ADMISSION_RETRY_AFTER: float = 1.0
+    ADMISSION_WRITE_MAX_CONCURRENCY: int = 100
+    ADMISSION_WRITE_MAX_QUEUE_TIME: float = 1.0
+    ADMISSION_READ_MAX_CONCURRENCY: int = 200
+    ADMISSION_READ_MAX_QUEUE_TIME: float = 0.5
+    ADMISSION_CATALOG_MAX_CONCURRENCY: int = 50
+    ADMISSION_CATALOG_MAX_QUEUE_TIME: float = 0.1
+
+    CATALOG_CACHE_ENABLED: bool = True
+    CATALOG_CACHE_CHANNELS_TTL: int = 60
+    CATALOG_CACHE_CHANNEL_ITEMS_TTL: int = 30
+    CATALOG_CACHE_PODCAST_TTL: int = 120
+    CATALOG_CACHE_STALE_TTL: int = 600
+    CATALOG_CACHE_FALLBACK_TTL: int = 86400
+
+    CATALOG_MIRROR_ENABLED: bool = False
+    CATALOG_MIRROR_SYNC_INTERVAL: float = 60.0
+    CATALOG_MIRROR_FULL_SWEEP_INTERVAL: float = 3600.0
+    CATALOG_MIRROR_MAX_STALENESS: float = 10800.0
+    CATALOG_MIRROR_SYNC_CONCURRENCY: int = 4
+    CATALOG_MIRROR_MODIFIED_SINCE_PARAM: str = ''
+
+    PODCAST_BATCH_MAX_IDS: int = 50
+    PODCAST_BATCH_CONCURRENCY: int = 8
+
+    COMMENTS_PREVIEW_MAX: int = 5
+    COMMENTS_PAGE_SIZE: int = 20
+    COMMENTS_PAGE_MAX: int = 100
+
+    INTERACTION_BULK_MAX_SIZE: int = 200
+
+    LEGACY_MIGRATION_CHECK_INTERVAL: float = 10.0
+    LEGACY_MIGRATION_CLAIM_TIMEOUT: int = 60
+
+    INTERACTION_VERSION_UNCONFIRMED_TTL: int = 30
+
+    USER_INDEX_ENABLED: bool = True
+    USER_INDEX_TTL: int = 604800
+    USER_INDEX_PAGE_SIZE: int = 20
+    USER_INDEX_PAGE_MAX: int = 100
+
+    INTERACTION_WRITE_BEHIND: bool = False
+    INTERACTION_WRITE_BEHIND_BATCH_SIZE: int = 500
+    INTERACTION_WRITE_BEHIND_MAX_LAG: float = 1.0
+    INTERACTION_WRITE_BEHIND_MAX_PENDING: int = 10000
+
+    PROFILING_ENABLED: bool = True
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_SAMPLE_INTERVAL: float = 0.005
+    PROFILING_RING_SIZE: int = 100
+    PROFILING_MAX_STACKS: int = 2000
+    PROFILING_MAX_SPANS: int = 1000
+
+    SERVER_HOST: str = '0.0.0.0'
+    SERVER_PORT: int = 8003
+    SERVER_WORKERS: int = 1
+    SERVER_LOOP: str = 'auto'
+    SERVER_HTTP: str = 'auto'
+    SERVER_BACKLOG: int = 2048
+    SERVER_TIMEOUT_KEEP_ALIVE: int = 5
+    SERVER_GRACEFUL_TIMEOUT: float = 30.0
+    SERVER_DRAIN_DELAY: float = 5.0
+    SERVER_WARMUP_TIMEOUT: float = 5.0
+    SERVER_WARMUP_REDIS_CONNECTIONS: int = 4
+    SERVER_LOG_LEVEL: str = 'info'
+    SERVER_ACCESS_LOG: bool = False
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
         case_sensitive = False
 
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
+
+
+class LazySettings:
+    """
+    Stands in for the Settings instance, which is only created (and the environment read) on first use.
+    Modules that merely import the settings no longer load them, so the server parent process, which only
+    spawns the workers, does not; each worker loads them once it imports the app.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_settings(), name, value)
+
+
+settings = LazySettings()
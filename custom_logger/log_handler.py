@@ -1,42 +1,200 @@
 import logging
+import os
+import queue
+import threading
 import time
+from typing import Optional
+
 from config.config import settings
 from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
 
 
 class ElasticHandler(logging.Handler):
     """
     Custom logging handler for sending log records to Elasticsearch.
 
-    This handler sends log records to Elasticsearch with a specified index name and timestamp.
+    emit() only puts the record on a bounded in-memory queue; a background thread ships the queued
+    records with the bulk API whenever LOG_SHIPPER_BATCH_SIZE records are waiting or
+    LOG_SHIPPER_FLUSH_INTERVAL seconds have passed, so a slow Elasticsearch never blocks a request.
+    The client and the thread are created by the first record a process emits: threads do not survive a
+    fork, so a handler configured before the server forks its workers starts its own shipper in each.
 
     Attributes:
         es (Elasticsearch): Elasticsearch client instance for log storage.
-        sender (LogSender): Log sender instance for writing log records.
+        overflow_policy (str): What emit() does when the queue is full:
+            'drop_newest' drops the new record, 'drop_oldest' evicts the oldest queued record and
+            'block' waits up to LOG_SHIPPER_BLOCK_TIMEOUT seconds before dropping the new record.
+        stats (dict): Shipped, dropped and failed counters plus bulk request latency.
 
     Methods:
         emit(self, record):
-            Emit a log record to Elasticsearch.
-
-    Example Usage:
-        To use this custom logging handler, add it to your Django logging configuration.
-        It sends log records to Elasticsearch with the specified index name and timestamp.
+            Queue a log record for shipping.
+        flush(self):
+            Ship everything queued so far and wait for it.
+        close(self):
+            Stop the worker after a final flush; logging.shutdown() calls it at exit.
 
     Note:
         - If there is an exception during log emission, it is handled, and the error is logged.
-        - The Elasticsearch host and port are configured from Django settings.
-
-    See the Elasticsearch Python client documentation for more details on usage.
+        - The Elasticsearch host and port are configured from settings.
     """
 
-    def __init__(self):
+    def __init__(self, client=None, queue_size: int = None, batch_size: int = None, flush_interval: float = None,
+                 overflow_policy: str = None):
         super().__init__()
-        self.es = Elasticsearch(f'http://{settings.ELASTICSEARCH_HOST}:{settings.ELASTICSEARCH_PORT}')
+        self._client = client
+        self.es = None
+        self.batch_size = batch_size or settings.LOG_SHIPPER_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.LOG_SHIPPER_FLUSH_INTERVAL
+        self.overflow_policy = overflow_policy or settings.LOG_SHIPPER_OVERFLOW_POLICY
+        self.queue = queue.Queue(maxsize=queue_size or settings.LOG_SHIPPER_QUEUE_SIZE)
+        self.stats = {
+            'queued': 0,
+            'shipped': 0,
+            'dropped': 0,
+            'failed': 0,
+            'bulk_requests': 0,
+            'last_bulk_latency_ms': 0.0,
+            'max_bulk_latency_ms': 0.0,
+            'total_bulk_latency_ms': 0.0,
+        }
+        self._stopping = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker_pid == os.getpid():
+                return
+            if self.es is None:
+                self.es = self._client or Elasticsearch(
+                    f'http://{settings.ELASTICSEARCH_HOST}:{settings.ELASTICSEARCH_PORT}')
+            self._worker = threading.Thread(target=self._run, name='elastic-log-shipper', daemon=True)
+            self._worker.start()
+            self._worker_pid = os.getpid()
 
     def emit(self, record):
         try:
+            self._ensure_worker()
             index_name = f'log_{time.strftime("%Y_%m_%d")}'
-            self.es.index(index=index_name, document=record.msg)
-
+            self._enqueue({'_index': index_name, '_source': record.msg})
         except Exception:
             self.handleError(record)
+
+    def _enqueue(self, action: dict):
+        try:
+            if self.overflow_policy == BLOCK:
+                self.queue.put(action, timeout=settings.LOG_SHIPPER_BLOCK_TIMEOUT)
+            else:
+                self.queue.put_nowait(action)
+            self.stats['queued'] += 1
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == DROP_OLDEST:
+            try:
+                evicted = self.queue.get_nowait()
+                if isinstance(evicted, _FlushRequest):
+                    evicted.done.set()
+                self.stats['dropped'] += 1
+                self.queue.put_nowait(action)
+                self.stats['queued'] += 1
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        self.stats['dropped'] += 1
+
+    def _ship(self, batch: list):
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            shipped, errors = bulk(self.es, batch, raise_on_error=False, stats_only=True)
+            self.stats['shipped'] += shipped
+            self.stats['failed'] += errors
+        except Exception:
+            self.stats['failed'] += len(batch)
+        finally:
+            latency = (time.perf_counter() - start) * 1000
+            self.stats['bulk_requests'] += 1
+            self.stats['last_bulk_latency_ms'] = latency
+            self.stats['total_bulk_latency_ms'] += latency
+            self.stats['max_bulk_latency_ms'] = max(self.stats['max_bulk_latency_ms'], latency)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _FlushRequest):
+                self._ship(batch)
+                batch = []
+                item.done.set()
+            elif item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._ship(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+            if self._stopping.is_set() and self.queue.empty():
+                self._ship(batch)
+                return
+
+    def flush(self, timeout: float = 5.0):
+        if self._worker is None or self._worker_pid != os.getpid() or not self._worker.is_alive():
+            return
+        request = _FlushRequest()
+        try:
+            self.queue.put(request, timeout=timeout)
+        except queue.Full:
+            return
+        request.done.wait(timeout)
+
+    def close(self):
+        if not self._stopping.is_set():
+            self._stopping.set()
+            if self._worker is not None and self._worker_pid == os.getpid():
+                self._worker.join(timeout=10)
+        super().close()
+
+
+def _elastic_handlers() -> list:
+    loggers = [logging.getLogger()] + [log for log in logging.root.manager.loggerDict.values()
+                                       if isinstance(log, logging.Logger)]
+    handlers = {id(handler): handler for log in loggers for handler in log.handlers
+                if isinstance(handler, ElasticHandler)}
+    return list(handlers.values())
+
+
+def shipping_stats() -> list:
+    """
+    The shipping_stats function collects the counters of every ElasticHandler attached to a logger.
+
+    :return: A list with the stats of each handler
+    """
+    return [{**handler.stats, 'queue_size': handler.queue.qsize()} for handler in _elastic_handlers()]
+
+
+def flush_elastic_handlers():
+    for handler in _elastic_handlers():
+        handler.flush()
@@ -0,0 +1,76 @@
+import time
+import uuid
+
+import structlog
+
+from utils.metrics import http_request_duration_seconds, http_requests_in_flight, http_requests_total
+
+
+class RequestLoggingMiddleware:
+    """
+    Raw ASGI middleware that logs every HTTP request and records the HTTP metrics.
+
+    Unlike @app.middleware("http") (Starlette's BaseHTTPMiddleware) it does not wrap the response in extra
+    tasks and memory streams: messages go straight to the server, so streaming responses are forwarded chunk
+    by chunk. The log record is written once the last body chunk has been sent, with a synchronous structlog
+    logger whose ElasticHandler only enqueues the record, so nothing is awaited on the response path.
+    """
+
+    def __init__(self, app, logger=None):
+        self.app = app
+        self.logger = logger or structlog.get_logger("elastic_logger")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        correlation_id = headers.get(b"correlation-id", b"").decode("latin-1") or uuid.uuid4().hex
+        scope.setdefault("state", {})["correlation_id"] = correlation_id
+
+        method = scope["method"]
+        status_code = None
+        message = "Request processed successfully"
+        has_exception = False
+
+        async def send_wrapper(event):
+            nonlocal status_code
+            if event["type"] == "http.response.start":
+                status_code = event["status"]
+            await send(event)
+
+        http_requests_in_flight.inc(method)
+        start_time = time.perf_counter_ns()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            status_code = status_code or 500
+            message = f"Internal Server Error: {str(e)}"
+            has_exception = True
+            raise
+        finally:
+            process_time = time.perf_counter_ns() - start_time
+            # Label by route template, not by raw path, so ids do not blow up the series count.
+            route_path = getattr(scope.get("route"), "path", "unmatched")
+            http_requests_in_flight.dec(method)
+            http_requests_total.inc(method, route_path, str(status_code))
+            http_request_duration_seconds.observe(method, route_path, value=process_time / 1_000_000_000)
+
+            client = scope.get("client")
+            log_dict = {
+                "remote_host": client[0] if client else "",
+                "request_method": f"{method}",
+                "url": f" {scope['path']}",
+                "status_code": status_code,
+                "referer": headers.get(b"referer", b"").decode("latin-1"),
+                "user_agent": headers.get(b"user-agent", b"").decode("latin-1"),
+                "elapsed_time": process_time,
+                "message": message,
+                'correlation_id': correlation_id,
+            }
+            event = f"Podcasts/middleware{scope['path']}"
+            if has_exception:
+                self.logger.error(event=event, **log_dict)
+            else:
+                self.logger.info(event=event, **log_dict)
@@ -0,0 +1,51 @@
+"""
+Online migration of the legacy one-document-per-channel ``interaction`` collection.
+
+Every legacy document is keyed by channel_id and holds ``{"<podcast_id>": {"like": [...], "book_mark": [...],
+"comment": [...]}}``. The migration moves channels in batches into the per-podcast, per-user layout of
+services.interaction_store, bumping podcast_counters for the records it inserts, and deletes each legacy
+document once its records are written.
+
+The API keeps serving meanwhile: every request that touches a channel still in the legacy collection
+migrates that channel first (InteractionStore.migrate_legacy_channel), so no channel ever shows partly
+moved data and a removal always hits the new layout. A channel is claimed before it is copied, so this tool
+and the API never copy the same channel twice; channels an API request is migrating are skipped here.
+Writes are idempotent upserts, so the tool can be stopped and re-run at any time.
+
+Usage:
+    python -m db.migrate_interactions --batch-size 50
+"""
+import argparse
+import asyncio
+
+from db.mongo_db import get_mongo_db
+from services.interaction_store import InteractionStore
+
+
+async def migrate(batch_size: int = 50, limit: int = None):
+    store = InteractionStore(get_mongo_db())
+    await store.create_indexes()
+
+    migrated = skipped = 0
+    last_id = None
+    while limit is None or migrated < limit:
+        size = batch_size if limit is None else min(batch_size, limit - migrated)
+        query = {} if last_id is None else {'_id': {'$gt': last_id}}
+        docs = await store.legacy.find(query, {'_id': 1}).sort('_id', 1).limit(size).to_list(length=size)
+        if not docs:
+            break
+        last_id = docs[-1]['_id']
+
+        results = await asyncio.gather(*(store.migrate_legacy_channel(doc['_id'], wait=False) for doc in docs))
+        migrated += sum(results)
+        skipped += len(results) - sum(results)
+        print(f'migrated {migrated} channels ({skipped} skipped while an API request was migrating them)')
+    return migrated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate legacy channel interaction documents.')
+    parser.add_argument('--batch-size', type=int, default=50, help='Channels converted per batch')
+    parser.add_argument('--limit', type=int, default=None, help='Stop after this many channels')
+    args = parser.parse_args()
+    asyncio.run(migrate(batch_size=args.batch_size, limit=args.limit))
@@ -1,11 +1,62 @@
+import threading
+from functools import lru_cache
+
 import motor.motor_asyncio
+from pymongo import monitoring
+
 from config.config import settings
+from utils.metrics import mongo_command_duration_seconds, mongo_command_failures_total
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Command listener recording the latency of every MongoDB command per command name and collection.
+    pymongo calls it from motor's worker threads, hence the lock around the in-flight map.
+    """
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ''
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _collection(self, event) -> str:
+        with self._lock:
+            return self._collections.pop((event.connection_id, event.request_id), '')
 
-MONGO_URI = settings.MONGO_URI
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
-database = client[settings.MONGO_DATABASE_NAME]
+    def succeeded(self, event):
+        mongo_command_duration_seconds.observe(event.command_name, self._collection(event),
+                                               value=event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        collection = self._collection(event)
+        mongo_command_duration_seconds.observe(event.command_name, collection,
+                                               value=event.duration_micros / 1_000_000)
+        mongo_command_failures_total.inc(event.command_name, collection)
+
+
+@lru_cache
+def get_mongo_client() -> motor.motor_asyncio.AsyncIOMotorClient:
+    """
+    The get_mongo_client function returns the worker's Mongo client, creating it on first use.
+    pymongo starts its monitor threads with the client, so it must not be created before the worker process
+    exists; the app lifespan calls this once the worker is running.
+
+    :return: The motor client
+    """
+    return motor.motor_asyncio.AsyncIOMotorClient(settings.MONGO_URI, event_listeners=[MongoCommandMetrics()])
 
 
 def get_mongo_db():
-    mongo_db = database
+    mongo_db = get_mongo_client()[settings.MONGO_DATABASE_NAME]
     return mongo_db
+
+
+def close_mongo_client():
+    if get_mongo_client.cache_info().currsize:
+        get_mongo_client().close()
@@ -0,0 +1,88 @@
+"""
+Rebuilds podcast_counters from the raw interaction records.
+
+The write paths and the legacy migration keep the counters up to date with $inc, but a crash between a
+write and its $inc can leave them off. The job streams one grouped aggregation over podcast_interactions
+and one over podcast_comments and overwrites the counters in batches. It then zeroes the counters of podcasts
+that no longer have any record. Writes that happen while it runs may be overwritten by a count taken a
+moment earlier, so schedule it at a quiet time or run it twice.
+
+Usage:
+    python -m db.reconcile_counters --batch-size 1000
+"""
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from db.mongo_db import get_mongo_db
+from schemas.interaction import ActionTypeEnum
+from services.interaction_store import InteractionStore
+
+ACTION_TYPES = (ActionTypeEnum.like.value, ActionTypeEnum.book_mark.value)
+COMMENT = ActionTypeEnum.comment.value
+
+
+async def _write(counters, operations: list):
+    if operations:
+        await counters.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+async def _reconcile(source, counters, pipeline: list, fields: tuple, batch_size: int) -> set:
+    seen = set()
+    operations = []
+    written = 0
+    async for doc in source.aggregate(pipeline, allowDiskUse=True):
+        seen.add(doc['_id'])
+        operations.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {field: doc[field] for field in fields}, '$setOnInsert': {'channel_id': doc['channel_id']}},
+            upsert=True,
+        ))
+        if len(operations) >= batch_size:
+            written += await _write(counters, operations)
+            operations = []
+            print(f'{fields}: reconciled {written} podcasts')
+    written += await _write(counters, operations)
+    print(f'{fields}: reconciled {written} podcasts')
+    return seen
+
+
+async def _zero_missing(counters, seen: set, fields: tuple, batch_size: int):
+    operations = []
+    async for doc in counters.find({}, {'_id': 1}):
+        if doc['_id'] not in seen:
+            operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {field: 0 for field in fields}}))
+        if len(operations) >= batch_size:
+            await _write(counters, operations)
+            operations = []
+    await _write(counters, operations)
+
+
+async def reconcile(batch_size: int = 1000):
+    store = InteractionStore(get_mongo_db())
+
+    action_pipeline = [
+        {'$group': {
+            '_id': '$podcast_id',
+            'channel_id': {'$first': '$channel_id'},
+            **{action_type: {'$sum': {'$cond': [{'$eq': ['$action_type', action_type]}, 1, 0]}}
+               for action_type in ACTION_TYPES},
+        }},
+    ]
+    seen = await _reconcile(store.actions, store.counters, action_pipeline, ACTION_TYPES, batch_size)
+    await _zero_missing(store.counters, seen, ACTION_TYPES, batch_size)
+
+    comment_pipeline = [
+        {'$group': {'_id': '$podcast_id', 'channel_id': {'$first': '$channel_id'}, COMMENT: {'$sum': 1}}},
+    ]
+    seen = await _reconcile(store.comments, store.counters, comment_pipeline, (COMMENT,), batch_size)
+    await _zero_missing(store.counters, seen, (COMMENT,), batch_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the per-podcast interaction counters.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Counter documents written per bulk_write')
+    args = parser.parse_args()
+    asyncio.run(reconcile(batch_size=args.batch_size))
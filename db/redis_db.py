@@ -1,17 +1,144 @@
+import time
+from functools import lru_cache
+from typing import Optional
+
 import redis.asyncio as aioredis
+from fastapi import Request
+from redis.asyncio.client import Pipeline
+from redis.exceptions import RedisError
 
 from config.config import settings
+from utils.metrics import redis_command_duration_seconds
+from utils.profiling import add_span
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        commands = len(self.command_stack)
+        try:
+            return await super().execute(raise_on_error=raise_on_error)
+        finally:
+            end = time.perf_counter()
+            redis_command_duration_seconds.observe('PIPELINE', value=end - start)
+            add_span('redis', start, end, f'PIPELINE x{commands}')
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """
+    Redis client that records the latency of every command (and of every pipeline as a whole).
+    """
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            end = time.perf_counter()
+            command = str(args[0]).upper()
+            redis_command_duration_seconds.observe(command, value=end - start)
+            add_span('redis', start, end, command)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+MISSING = object()
+
+
+class RedisPrefetch:
+    """
+    Per-request batch of Redis reads sent in one pipelined round-trip.
+
+    The reads a request is known to need are added up front and executed together; the code that needs a
+    value takes it from here and only goes to Redis itself for a key that was not prefetched, or when the
+    pipeline failed.
+    """
+
+    def __init__(self, redis_db):
+        self.redis_db = redis_db
+        self._commands = {}
+        self._results = {}
+
+    def add(self, command: str, key: str, *args):
+        self._commands[(command.upper(), key) + args] = None
+
+    async def execute(self):
+        pending = [read for read in self._commands if read not in self._results]
+        if not pending:
+            return
+        try:
+            async with self.redis_db.pipeline(transaction=False) as pipe:
+                for read in pending:
+                    pipe.execute_command(*read)
+                values = await pipe.execute()
+        except RedisError:
+            return
+        self._results.update(zip(pending, values))
 
-redis = aioredis.from_url(f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}', encoding='utf-8',
-                          db=settings.REDIS_DATABASE_NUMBER,
-                          decode_responses=True)
+    def get(self, command: str, key: str, *args):
+        """
+        The get function returns the prefetched reply of a read.
 
+        :param self: Represent the instance of the class
+        :param command: str: The Redis command, e.g. GET or HGETALL
+        :param key: str: The key it was sent for
+        :param args: The further arguments of the command
+        :return: The reply, or MISSING when the read was not prefetched
+        """
+        return self._results.get((command.upper(), key) + args, MISSING)
 
+
+def get_request_prefetch(request: Optional[Request]) -> Optional[RedisPrefetch]:
+    if request is None:
+        return None
+    return getattr(request.state, 'redis_prefetch', None)
+
+
+async def prefetched_read(redis_db, request: Optional[Request], command: str, key: str, *args):
+    """
+    The prefetched_read function returns the reply of a read from the request's prefetch, or sends it to Redis.
+
+    :param redis_db: The redis client
+    :param request: Optional[Request]: The request the read belongs to
+    :param command: str: The Redis command, e.g. GET or HGETALL
+    :param key: str: The key to read
+    :param args: The further arguments of the command
+    :return: The reply of the command
+    """
+    prefetch = get_request_prefetch(request)
+    value = prefetch.get(command, key, *args) if prefetch is not None else MISSING
+    if value is MISSING:
+        value = await redis_db.execute_command(command.upper(), key, *args)
+    return value
+
+
+@lru_cache
 def get_redis_client():
     """
-    The get_redis_client function returns a Redis client object.
+    The get_redis_client function returns a Redis client object, creating the worker's connection pool on first use.
+
+    A blocking pool: past REDIS_MAX_CONNECTIONS callers wait up to REDIS_POOL_TIMEOUT for a free connection
+    instead of opening one more, and idle connections are pinged before reuse every REDIS_HEALTH_CHECK_INTERVAL.
 
     :return: The redis object
     :doc-author: Trelent
     """
-    return redis
+    redis_pool = aioredis.BlockingConnectionPool.from_url(
+        f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}',
+        encoding='utf-8',
+        db=settings.REDIS_DATABASE_NUMBER,
+        decode_responses=True,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return InstrumentedRedis(connection_pool=redis_pool)
+
+
+async def close_redis_client():
+    if get_redis_client.cache_info().currsize:
+        await get_redis_client().aclose(close_connection_pool=True)
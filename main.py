@@ -1,15 +1,102 @@
-from fastapi import FastAPI, Request, Response
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from api.api_v1 import api
+from config.config import settings
+from custom_logger.log_handler import flush_elastic_handlers
 from custom_logger.logger import setup_logger
-import time
-import uuid
-import structlog
+from custom_logger.middleware import RequestLoggingMiddleware
+from db.mongo_db import close_mongo_client, get_mongo_client
+from db.redis_db import close_redis_client, get_redis_client
+from services.admission import AdmissionMiddleware
+from services.api_services import get_api_service
+from services.catalog_cache import get_catalog_cache
+from services.catalog_mirror import get_catalog_mirror
+from services.django_httpx_client import get_django_client
+from services.interaction_buffer import get_interaction_buffer
+from services.interaction_store import get_interaction_store
+from services.token_cache import start_revocation_listener
+from services.user_index import get_user_index
+from utils.metrics import get_metrics_registry
+from utils.profiling import ProfilingMiddleware
+from utils.worker import get_worker_state
 import uvicorn
 
 setup_logger()
 
-logger = structlog.get_logger("elastic_logger")
-app = FastAPI()
+
+async def write_metrics_snapshots(registry):
+    while True:
+        await asyncio.sleep(settings.METRICS_SNAPSHOT_INTERVAL)
+        get_worker_state().update_metrics()
+        try:
+            await asyncio.to_thread(registry.write_snapshot)
+        except OSError:
+            pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    The lifespan function creates the worker's clients and services, warms up their connections and only then
+    reports the worker ready; on shutdown it stops the background tasks and closes the clients.
+    Nothing is connected at import time, so every worker process opens its own connections here.
+
+    :param app: FastAPI: The application being started
+    """
+    worker_state = get_worker_state()
+    django_client = get_django_client()
+    await django_client.startup()
+    # Building the API service builds every client and service it depends on.
+    get_api_service()
+    redis_db = get_redis_client()
+    await worker_state.warm_up({
+        'redis': lambda: asyncio.gather(*(redis_db.ping() for _ in range(settings.SERVER_WARMUP_REDIS_CONNECTIONS))),
+        'mongo': lambda: get_mongo_client().admin.command('ping'),
+        'upstream': django_client.warm_up,
+    }, timeout=settings.SERVER_WARMUP_TIMEOUT)
+    await get_interaction_store().create_indexes()
+    revocation_listener = start_revocation_listener()
+    interaction_buffer = get_interaction_buffer()
+    if settings.INTERACTION_WRITE_BEHIND:
+        interaction_buffer.start()
+    catalog_mirror = get_catalog_mirror()
+    if settings.CATALOG_MIRROR_ENABLED:
+        await catalog_mirror.create_indexes()
+        catalog_mirror.start()
+    metrics_registry = get_metrics_registry()
+    metrics_writer = None
+    if metrics_registry.multiprocess_dir:
+        metrics_writer = asyncio.create_task(write_metrics_snapshots(metrics_registry))
+    worker_state.mark_ready()
+    try:
+        yield
+    finally:
+        worker_state.mark_draining()
+        if revocation_listener:
+            revocation_listener.cancel()
+            await asyncio.gather(revocation_listener, return_exceptions=True)
+        if metrics_writer:
+            metrics_writer.cancel()
+        await interaction_buffer.stop()
+        await catalog_mirror.stop()
+        await get_catalog_cache().shutdown()
+        await get_user_index().shutdown()
+        await django_client.shutdown()
+        await close_redis_client()
+        close_mongo_client()
+        await asyncio.to_thread(flush_elastic_handlers)
+        await asyncio.to_thread(metrics_registry.write_snapshot)
+
+
+app = FastAPI(lifespan=lifespan)
+# The last middleware added runs first: requests are profiled (when picked), logged, then admitted or shed.
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(RequestLoggingMiddleware)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
 app.include_router(api.api_router, prefix='/api')
 
 
@@ -23,57 +110,22 @@ async def say_hello(name: str):
     return {"message": f"Hello {name}"}
 
 
-@app.middleware("http")
-async def logging_middleware(request: Request, call_next) -> Response:
-    """
-    The logging_middleware function is a middleware function that logs the request and response of each API call.
-    It also adds a correlation_id to the header of each request, which can be used for tracing purposes.
+@app.get("/health/live", include_in_schema=False)
+async def live():
+    return {"status": "alive"}
 
 
-    :param request: Request: Get the request object
-    :param call_next: Pass the request to the next middleware in line
-    :return: A response object
-    :doc-author: Trelent
-    """
-    correlation_id = request.headers.get("correlation-id")
+@app.get("/health/ready", include_in_schema=False)
+async def ready():
+    worker_state = get_worker_state()
+    return JSONResponse({"status": worker_state.status}, status_code=200 if worker_state.ready else 503)
 
-    if not correlation_id:
-        correlation_id = uuid.uuid4().hex
 
-    setattr(request.state, 'correlation_id', correlation_id)
-    status_code = None
-    response = None
-    message = "Request processed successfully"
-    has_exception = False
-    event = f"Podcasts/middleware{request.url.path}"
-
-    start_time = time.perf_counter_ns()
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-    except Exception as e:
-        status_code = 500
-        message = f"Internal Server Error: {str(e)}"
-        has_exception = True
-    finally:
-        process_time = time.perf_counter_ns() - start_time
-        log_dict = {
-            "remote_host": request.client.host,
-            "request_method": f"{request.method}",
-            "url": f" {request.url.path}",
-            "status_code": status_code,
-            "referer": request.headers.get("referer", ""),
-            "user_agent": request.headers.get("user-agent", ""),
-            "elapsed_time": process_time,
-            "message": message,
-            'correlation_id': correlation_id,
-        }
-    if has_exception:
-        await logger.error(event=event, **log_dict)
-    else:
-        await logger.info(event=event, **log_dict)
-
-    return response
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    get_worker_state().update_metrics()
+    body = await asyncio.to_thread(get_metrics_registry().render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 
 if __name__ == '__main__':
@@ -1,7 +1,9 @@
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from config.config import settings
 
 
 class ActionTypeEnum(str, Enum):
@@ -10,6 +12,11 @@ class ActionTypeEnum(str, Enum):
     book_mark = 'book_mark'
 
 
+class BulkOperationEnum(str, Enum):
+    add = 'add'
+    remove = 'remove'
+
+
 class BaseInteractionSchema(BaseModel):
     channel_id: int
     podcast_id: int
@@ -18,3 +25,13 @@ class BaseInteractionSchema(BaseModel):
 
 class InteractionSchema(BaseInteractionSchema):
     content: Optional[str] = ''
+
+
+class BulkInteractionOperationSchema(InteractionSchema):
+    op: BulkOperationEnum = BulkOperationEnum.add
+
+
+class BulkInteractionSchema(BaseModel):
+    ordered: bool = True
+    operations: List[BulkInteractionOperationSchema] = Field(min_length=1,
+                                                             max_length=settings.INTERACTION_BULK_MAX_SIZE)
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import signal
+import sys
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from config.config import settings
+from utils.worker import get_worker_state
+
+# uvicorn's exit code when the application failed to start.
+STARTUP_FAILURE = 3
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that drains before it stops.
+
+    On the first SIGTERM the worker only turns draining, so /health/ready fails and load balancers stop
+    sending it new requests, and keeps serving for SERVER_DRAIN_DELAY seconds. Then the usual uvicorn
+    shutdown runs: stop accepting connections, wait up to SERVER_GRACEFUL_TIMEOUT for the requests in flight,
+    and run the lifespan shutdown, which flushes the write-behind buffer and closes the clients.
+    SIGINT, or a second SIGTERM, skips the delay.
+    """
+
+    def handle_exit(self, sig, frame):
+        worker_state = get_worker_state()
+        if sig == signal.SIGTERM and not worker_state.draining and settings.SERVER_DRAIN_DELAY > 0:
+            worker_state.mark_draining()
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                loop.call_later(settings.SERVER_DRAIN_DELAY, super().handle_exit, sig, frame)
+                return
+        worker_state.mark_draining()
+        super().handle_exit(sig, frame)
+
+
+def build_config() -> uvicorn.Config:
+    """
+    The build_config function builds the production uvicorn configuration from the settings.
+    With SERVER_LOOP and SERVER_HTTP left on auto, uvicorn picks uvloop and httptools when they are installed.
+
+    :return: The uvicorn configuration
+    """
+    return uvicorn.Config(
+        'main:app',
+        host=settings.SERVER_HOST,
+        port=settings.SERVER_PORT,
+        workers=settings.SERVER_WORKERS or os.cpu_count() or 1,
+        loop=settings.SERVER_LOOP,
+        http=settings.SERVER_HTTP,
+        lifespan='on',
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_TIMEOUT_KEEP_ALIVE,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+        log_level=settings.SERVER_LOG_LEVEL,
+        access_log=settings.SERVER_ACCESS_LOG,
+    )
+
+
+def run():
+    """
+    The run function starts the server: one process when SERVER_WORKERS is 1, otherwise a parent process that
+    binds the socket and spawns that many workers (0 means one per CPU). The parent does not import the app;
+    each worker imports it and creates its own clients in the lifespan, after the process exists.
+    """
+    config = build_config()
+    server = DrainingServer(config=config)
+    if config.workers > 1:
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+        if not server.started:
+            sys.exit(STARTUP_FAILURE)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from functools import lru_cache
+from typing import Optional
+
+from config.config import settings
+from utils.metrics import (admission_in_flight, admission_limit, admission_queue_seconds,
+                           admission_rejections_total)
+
+WRITE = 'write'
+READ = 'read'
+CATALOG = 'catalog'
+
+WRITE_PATHS = ('/api/v1/interaction', '/api/v1/remove_interaction', '/api/v1/interactions/bulk')
+CATALOG_PATHS = ('/api/v1/channels',)
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """
+    The route_class function sorts a request into the admission class it is limited by.
+
+    :param method: str: The HTTP method
+    :param path: str: The request path
+    :return: write, read or catalog, or None for routes that are never shed (admin, metrics, docs)
+    """
+    path = path.rstrip('/') or '/'
+    if method == 'POST' and path in WRITE_PATHS:
+        return WRITE
+    if method == 'GET' and path in CATALOG_PATHS:
+        return CATALOG
+    if method == 'GET' and path.startswith(('/api/v1/channels/', '/api/v1/podcasts', '/api/v1/me/')):
+        return READ
+    return None
+
+
+class RouteClass:
+    def __init__(self, name: str, priority: int, max_concurrency: int, max_queue_time: float, max_queue: int):
+        self.name = name
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.max_queue_time = max_queue_time
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self.counters = {'admitted': 0, 'queued_total': 0, 'rejected_queue_full': 0, 'rejected_queue_time': 0}
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Concurrency limiter in front of the routes, with an adaptive global limit and per-class caps.
+
+    A request runs right away when fewer than `limit` requests are in flight overall and its class is below
+    its own max_concurrency; otherwise it waits in a priority queue (writes before authenticated reads
+    before catalog polling) for at most the class's max_queue_time and is then shed. A waiter only holds back
+    new requests of its priority or lower while it could run itself, so a class at its own cap never keeps
+    the other classes out of idle capacity. The global limit
+    follows the observed latency AIMD-style: it grows by about one per `limit` fast completions while the
+    limit is in use and shrinks by backoff_ratio (at most once per latency_target) when completions are
+    slower than latency_target, so queueing moves from inside the app to this cheap, bounded queue.
+    """
+
+    def __init__(self, classes: list, initial_limit: int, min_limit: int, max_limit: int, latency_target: float,
+                 backoff_ratio: float):
+        self.classes = {route.name: route for route in classes}
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._decreased_at = 0.0
+        admission_limit.set(value=int(self.limit))
+
+    def _has_room(self, route: RouteClass) -> bool:
+        return self.in_flight < int(self.limit) and route.in_flight < route.max_concurrency
+
+    def _admit(self, route: RouteClass):
+        self.in_flight += 1
+        route.in_flight += 1
+        route.counters['admitted'] += 1
+        admission_in_flight.set(route.name, value=route.in_flight)
+
+    def _wake_waiters(self):
+        skipped = []
+        while self._waiters and self.in_flight < int(self.limit):
+            entry = heapq.heappop(self._waiters)
+            _, _, future, route = entry
+            if future.done():
+                continue
+            if route.in_flight >= route.max_concurrency:
+                skipped.append(entry)
+                continue
+            self._admit(route)
+            future.set_result(True)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    async def acquire(self, name: str):
+        """
+        The acquire function admits a request of the given class, waiting in the queue if needed.
+
+        :param self: Represent the instance of the class
+        :param name: str: The route class of the request
+        :raises Rejected: When the class queue is full or the request waited longer than max_queue_time
+        """
+        route = self.classes[name]
+        # Only defer to waiters that could run now: one held back by its own class cap does not block others.
+        blocked = any(not future.done() and priority <= route.priority and self._has_room(waiting_route)
+                      for priority, _, future, waiting_route in self._waiters)
+        if not blocked and self._has_room(route):
+            self._admit(route)
+            return
+
+        if route.queued >= route.max_queue:
+            route.counters['rejected_queue_full'] += 1
+            admission_rejections_total.inc(name, 'queue_full')
+            raise Rejected('queue_full')
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (route.priority, next(self._sequence), future, route))
+        route.queued += 1
+        route.counters['queued_total'] += 1
+        self._wake_waiters()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=route.max_queue_time)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Admitted right as the deadline passed: keep the slot.
+                return
+            future.cancel()
+            route.counters['rejected_queue_time'] += 1
+            admission_rejections_total.inc(name, 'queue_time')
+            raise Rejected('queue_time')
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(name, None)
+            future.cancel()
+            raise
+        finally:
+            route.queued -= 1
+            admission_queue_seconds.observe(name, value=time.monotonic() - start)
+
+    def release(self, name: str, latency: Optional[float]):
+        """
+        The release function frees the slot of a finished request and adapts the limit to its latency.
+
+        :param self: Represent the instance of the class
+        :param name: str: The route class of the request
+        :param latency: Optional[float]: Seconds the request took once admitted; None when it did not run
+        """
+        route = self.classes[name]
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        route.in_flight -= 1
+        admission_in_flight.set(route.name, value=route.in_flight)
+
+        if latency is not None:
+            now = time.monotonic()
+            if latency > self.latency_target:
+                if now - self._decreased_at >= self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self._decreased_at = now
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            admission_limit.set(value=int(self.limit))
+        self._wake_waiters()
+
+    def stats(self) -> dict:
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'queued': sum(1 for waiter in self._waiters if not waiter[2].done()),
+            'classes': {name: {'in_flight': route.in_flight, 'queued': route.queued,
+                               'max_concurrency': route.max_concurrency, **route.counters}
+                        for name, route in self.classes.items()},
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Raw ASGI middleware applying the AdmissionController; shed requests get a 503 with Retry-After.
+    """
+
+    def __init__(self, app, controller: 'AdmissionController' = None):
+        self.app = app
+        self.controller = controller or get_admission_controller()
+
+    async def __call__(self, scope, receive, send):
+        name = route_class(scope['method'], scope['path']) if scope['type'] == 'http' else None
+        if name is None or not settings.ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire(name)
+        except Rejected:
+            await send({
+                'type': 'http.response.start',
+                'status': 503,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'retry-after', str(math.ceil(settings.ADMISSION_RETRY_AFTER)).encode())],
+            })
+            await send({'type': 'http.response.body', 'body': b'{"detail":"Server overloaded, retry later"}'})
+            return
+
+        start = time.monotonic()
+        latency = None
+        try:
+            await self.app(scope, receive, send)
+            latency = time.monotonic() - start
+        finally:
+            self.controller.release(name, latency)
+
+
+@lru_cache
+def get_admission_controller():
+    return AdmissionController(
+        [
+            RouteClass(WRITE, priority=0, max_concurrency=settings.ADMISSION_WRITE_MAX_CONCURRENCY,
+                       max_queue_time=settings.ADMISSION_WRITE_MAX_QUEUE_TIME,
+                       max_queue=settings.ADMISSION_MAX_QUEUE),
+            RouteClass(READ, priority=1, max_concurrency=settings.ADMISSION_READ_MAX_CONCURRENCY,
+                       max_queue_time=settings.ADMISSION_READ_MAX_QUEUE_TIME,
+                       max_queue=settings.ADMISSION_MAX_QUEUE),
+            RouteClass(CATALOG, priority=2, max_concurrency=settings.ADMISSION_CATALOG_MAX_CONCURRENCY,
+                       max_queue_time=settings.ADMISSION_CATALOG_MAX_QUEUE_TIME,
+                       max_queue=settings.ADMISSION_MAX_QUEUE),
+        ],
+        initial_limit=settings.ADMISSION_INITIAL_LIMIT,
+        min_limit=settings.ADMISSION_MIN_LIMIT,
+        max_limit=settings.ADMISSION_MAX_LIMIT,
+        latency_target=settings.ADMISSION_LATENCY_TARGET,
+        backoff_ratio=settings.ADMISSION_BACKOFF_RATIO,
+    )
@@ -1,12 +1,42 @@
-from fastapi import Request
+import asyncio
+from functools import lru_cache
+from typing import Optional
+
+import orjson
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
+from fastapi import Request, HTTPException, Response, status
+from config.config import settings
 from db.mongo_db import get_mongo_db
 from db.redis_db import get_redis_client
-from schemas.interaction import InteractionSchema, ActionTypeEnum, BaseInteractionSchema
-from services.django_httpx_client import get_django_client
+from schemas.interaction import InteractionSchema, ActionTypeEnum, BaseInteractionSchema, BulkInteractionSchema, \
+    BulkOperationEnum
+from fastapi.responses import ORJSONResponse
+from services.catalog_cache import get_catalog_cache, catalog_version, CHANNELS, CHANNEL_ITEMS, PODCAST
+from services.catalog_mirror import get_catalog_mirror
+from services.interaction_buffer import get_interaction_buffer
+from services.interaction_store import get_interaction_store, RECORDED, EXISTS, REMOVED, NOT_FOUND, FAILED, SKIPPED
+from services.interaction_versions import get_interaction_versions
+from services.user_index import get_user_index
+from utils.etag import build_etag, etag_matches
+from utils.single_flight import SingleFlight
+from utils.profiling import span
+
+BULK_OUTCOME_MESSAGES = {
+    RECORDED: ('success', 'Interaction recorded successfully.'),
+    EXISTS: ('failure', 'Interaction already exists.'),
+    REMOVED: ('success', 'Interaction removed successfully.'),
+    NOT_FOUND: ('failure', 'Interaction not found.'),
+    FAILED: ('failure', 'Failed to record interaction.'),
+    SKIPPED: ('skipped', 'Not applied because an earlier operation failed.'),
+}
 
 
 class APIService:
-    def __init__(self, redis_db, mongo_db, django_client):
+    def __init__(self, redis_db, mongo_db, django_client, interaction_store, interaction_buffer=None,
+                 interaction_versions=None, user_index=None):
         """
         The __init__ function is called when the class is instantiated.
         It sets up the redis_db and account_client attributes for use in other functions.
@@ -14,117 +44,408 @@ class APIService:
         :param self: Represent the instance of the class
         :param redis_db: Create a connection to the redis database
         :param account_client: Create a client object that can be used to call the account service
+        :param interaction_store: Read and write the users' likes, bookmarks and comments
+        :param interaction_buffer: Write-behind buffer used for likes and bookmarks when INTERACTION_WRITE_BEHIND is on
+        :param interaction_versions: Per channel and podcast write counters the ETags are built from
+        :param user_index: Redis index of each user's likes and bookmarks, used for the liked/bookmarked flags
         :return: A new instance of the class
         :doc-author: Trelent
         """
         self.redis_db = redis_db
         self.mongo_db = mongo_db
         self.django_client = django_client
+        self.interaction_store = interaction_store
+        self.interaction_buffer = interaction_buffer
+        self.interaction_versions = interaction_versions
+        self.user_index = user_index
+        self.single_flight = SingleFlight()
 
-    async def channels_list(self, request: Request):
-        response = await self.django_client.get_channels(request=request)
-        return response.json()
+    async def _fetch_with_overlay(self, upstream, overlay):
+        """
+        The _fetch_with_overlay function runs the upstream call and the interaction overlay concurrently,
+        each within its own budget. Running out of UPSTREAM_BUDGET fails the request with 504; an overlay
+        that misses INTERACTION_OVERLAY_BUDGET (or fails) is dropped and the response is served without it.
 
-    async def get_channels_items(self, user_id: str, channel_id: int, request: Request):
-        response = await self.django_client.get_channels_items(request=request, channel_id=channel_id)
-        data = response.json()
+        :param self: Represent the instance of the class
+        :param upstream: The coroutine fetching the catalog data
+        :param overlay: The coroutine fetching the interaction annotations
+        :return: A tuple of (upstream response, annotations or None when degraded)
+        """
+        loop = asyncio.get_running_loop()
+        overlay_deadline = loop.time() + settings.INTERACTION_OVERLAY_BUDGET
+        upstream_task = asyncio.ensure_future(upstream)
+        overlay_task = asyncio.ensure_future(overlay)
+        try:
+            response = await asyncio.wait_for(upstream_task, timeout=settings.UPSTREAM_BUDGET)
+        except asyncio.TimeoutError:
+            overlay_task.cancel()
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Upstream service timed out")
+        except BaseException:
+            overlay_task.cancel()
+            raise
+
+        try:
+            annotations = await asyncio.wait_for(overlay_task, timeout=max(overlay_deadline - loop.time(), 0))
+        except (asyncio.TimeoutError, PyMongoError):
+            annotations = None
+        return response, annotations
+
+    async def _comments_previews(self, podcast_ids: tuple, comments_preview: int) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(
+                self.single_flight.do(('comments_preview', podcast_ids, comments_preview),
+                                      lambda: self.interaction_store.latest_comments(podcast_ids, comments_preview)),
+                timeout=settings.INTERACTION_OVERLAY_BUDGET)
+        except (asyncio.TimeoutError, PyMongoError):
+            return None
+
+    async def _annotate_items(self, user_id: str, items: list, podcast_ids: tuple, annotations: dict,
+                              comments_preview: int = 0) -> bool:
+        """
+        The _annotate_items function adds the user's flags, the counters and the optional comments preview
+        to the items.
+
+        :return: True when some of the data could not be loaded in time and the items are incomplete
+        """
+        previews = {}
+        if comments_preview and podcast_ids:
+            previews = await self._comments_previews(podcast_ids, comments_preview)
+
+        for item, podcast_id in zip(items, podcast_ids):
+            if annotations is not None:
+                annotation = annotations.get(podcast_id, {})
+                item['liked'] = annotation.get('liked', False)
+                item['bookmarked'] = annotation.get('bookmarked', False)
+                if self.interaction_buffer is not None:
+                    self._overlay_pending(user_id, podcast_id, item)
+                item['likes_count'] = annotation.get('likes_count', 0)
+                item['bookmarks_count'] = annotation.get('bookmarks_count', 0)
+                item['comments_count'] = annotation.get('comments_count', 0)
+            if comments_preview and previews is not None:
+                item['comments_preview'] = previews.get(podcast_id, [])
+        return annotations is None or previews is None
+
+    def _overlay_pending(self, user_id: str, podcast_id: int, item: dict):
+        for action_type, flag in ((ActionTypeEnum.like, 'liked'), (ActionTypeEnum.book_mark, 'bookmarked')):
+            pending = self.interaction_buffer.pending_state(user_id, podcast_id, action_type.value)
+            if pending is not None:
+                item[flag] = pending
+
+    def _use_write_behind(self, interaction: BaseInteractionSchema) -> bool:
+        return (settings.INTERACTION_WRITE_BEHIND and self.interaction_buffer is not None
+                and interaction.action_type != ActionTypeEnum.comment)
+
+    async def _use_user_index(self, user_id: str, request: Request = None) -> bool:
+        return (settings.USER_INDEX_ENABLED and self.user_index is not None
+                and await self.user_index.ready(user_id, request))
+
+    def _overlay(self, user_id: str, indexed: bool, podcast_ids: tuple = None, channel_id: int = None):
+        """
+        The _overlay function returns the Mongo lookup to run next to the upstream call: only the shared
+        counters when the user's flags come from the user index, else the full per-user annotations.
+        """
+        scope = ('channel', channel_id) if channel_id is not None else ('podcasts', podcast_ids)
+        if indexed:
+            return self.single_flight.do(
+                ('counts',) + scope,
+                lambda: self.interaction_store.counts(podcast_ids=podcast_ids, channel_id=channel_id))
+        return self.single_flight.do(
+            ('annotations', user_id) + scope,
+            lambda: self.interaction_store.annotations(user_id, podcast_ids=podcast_ids, channel_id=channel_id))
+
+    async def _add_user_flags(self, user_id: str, podcast_ids: tuple, counts: Optional[dict],
+                              request: Request = None) -> Optional[dict]:
+        """
+        The _add_user_flags function merges the user's liked and bookmarked flags from the user index into
+        the counters, giving the same annotations the Mongo lookup returns.
+
+        :return: The annotations, or None when the counters or the flags could not be loaded
+        """
+        if counts is None:
+            return None
+        flags = await self.user_index.flags(user_id, podcast_ids, request)
+        if flags is None:
+            return None
+        return {podcast_id: {**counts.get(podcast_id, {}), **flags[podcast_id]} for podcast_id in podcast_ids}
+
+    async def _index_changes(self, user_id: str, changes: list):
+        if settings.USER_INDEX_ENABLED and self.user_index is not None:
+            await self.user_index.apply((user_id, podcast_id, action_type, add)
+                                        for podcast_id, action_type, add in changes)
+
+    @staticmethod
+    def _not_modified(etag: str, cache_control: str) -> Response:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers={'etag': etag, 'cache-control': cache_control})
+
+    async def _user_etag(self, request: Request, route: str, ident: int, interaction_version: Optional[str],
+                         user_id: str, comments_preview: int, if_none_match: Optional[str]) -> Optional[str]:
+        """
+        The _user_etag function builds the ETag of a per-user response from a fresh cache entry, before
+        anything is fetched, so a matching If-None-Match can be answered right away.
+
+        :return: The ETag, or None when it cannot be known without fetching the catalog data
+        """
+        if not if_none_match or interaction_version is None:
+            return None
+        cached = await self.django_client.cached_version(route, ident, request)
+        if cached is None:
+            return None
+        return build_etag(cached, interaction_version, user_id, comments_preview)
+
+    async def channels_list(self, request: Request, if_none_match: Optional[str] = None):
+        if if_none_match:
+            cached = await self.django_client.cached_version(CHANNELS, request=request)
+            if cached is not None and etag_matches(if_none_match, build_etag(cached)):
+                return self._not_modified(build_etag(cached), 'no-cache')
+
+        response = await self.single_flight.do(
+            ('channels',), lambda: self.django_client.get_channels(request=request))
+        etag = build_etag(catalog_version(response))
+        if etag_matches(if_none_match, etag):
+            return self._not_modified(etag, 'no-cache')
+        # The channel list is not enriched, so the upstream bytes are passed through without parsing.
+        headers = {'etag': etag, 'cache-control': 'no-cache'}
+        if 'x-cache' in response.headers:
+            headers['x-cache'] = response.headers['x-cache']
+        return Response(content=response.content, headers=headers,
+                        media_type=response.headers.get('content-type', 'application/json'))
+
+    async def get_channels_items(self, user_id: str, channel_id: int, request: Request, comments_preview: int = 0,
+                                 if_none_match: Optional[str] = None):
+        # Read the version before the data: a write in between then only makes the ETag older than the body.
+        interaction_version = await self.interaction_versions.channel(channel_id, request)
+        etag = await self._user_etag(request, CHANNEL_ITEMS, channel_id, interaction_version, user_id,
+                                     comments_preview, if_none_match)
+        if etag and etag_matches(if_none_match, etag):
+            return self._not_modified(etag, 'private, no-cache')
+
+        indexed = await self._use_user_index(user_id, request)
+        response, annotations = await self._fetch_with_overlay(
+            self.single_flight.do(
+                ('channel_items', channel_id),
+                lambda: self.django_client.get_channels_items(request=request, channel_id=channel_id)),
+            self._overlay(user_id, indexed, channel_id=channel_id),
+        )
+        with span('serialization', 'decode upstream'):
+            data = orjson.loads(response.content)
         channel_info = data.get('channel')
-        items = data.get('items')
-        collection = self.mongo_db['interaction']
-        doc = await collection.find_one({'_id': channel_id})
-
-        if doc:
-            for item in items:
-                item_id = item['id']
-                item_doc = doc.get(str(item_id))
-                if item_doc:
-                    interactions = {key: value for key, value in item_doc.items()}
-                    item['bookmarked'] = any(user_id == user['user_id'] for user in interactions.get('bookmark', []))
-                    item['liked'] = any(user_id == user['user_id'] for user in interactions.get('like', []))
-                    item['comments'] = interactions.get('comment', 'no comment yet')
-
-        return {'channel_info': channel_info, 'items': items}
-
-    async def get_single_item(self, user_id: str, podcast_id: int, request: Request):
-        response = await self.django_client.get_single_item(request=request, podcast_id=podcast_id)
-        data = response.json()
-        channel_id = data.get('channel')
-        collection = self.mongo_db['interaction']
-        doc = await collection.find_one({'_id': channel_id})
-        item = {}
-
-        if doc:
-            item_doc = doc.get(str(podcast_id))
-            if item_doc:
-                item = {key: value for key, value in item_doc.items()}
-                for key, value in item_doc.items():
-                    item[f'{key}ed'] = any(user_id == user['user_id'] for user in value)
-        data['liked'] = item.get('likeed', '')
-        data['bookmarked'] = item.get('bookmarked', '')
-        data['comments'] = item.get('comment', 'no comment yet')
-
-        return data
+        items = data.get('items') or []
+        podcast_ids = tuple(item['id'] for item in items)
+        if indexed:
+            annotations = await self._add_user_flags(user_id, podcast_ids, annotations, request)
+        degraded = await self._annotate_items(user_id, items, podcast_ids, annotations, comments_preview)
 
-    async def interaction_with_item(self, user_id, interaction: InteractionSchema):
-        collection_name = "interaction"
-        item_collection = self.mongo_db[collection_name]
-
-        filter_query = {'_id': interaction.channel_id}
-        update_query = {}
-
-        if interaction.action_type == ActionTypeEnum.comment:
-            update_query['$push'] = {
-                f"{interaction.podcast_id}.comment": {
-                    'user_id': user_id,
-                    'content': interaction.content
-                }
-            }
-        else:
-            update_query['$addToSet'] = {
-                f"{interaction.podcast_id}.{interaction.action_type.value}": {
-                    'user_id': user_id}
-            }
-
-        result = await item_collection.update_one(
-            filter_query,
-            update_query,
-            upsert=True
+        result = {'channel_info': channel_info, 'items': items}
+        if degraded:
+            result['degraded'] = True
+        return self._conditional_response(result, degraded, response, interaction_version, user_id,
+                                          comments_preview, if_none_match)
+
+    def _conditional_response(self, result: dict, degraded: bool, response, interaction_version: Optional[str],
+                              user_id: str, comments_preview: int, if_none_match: Optional[str]) -> Response:
+        headers = {'cache-control': 'private, no-cache'}
+        # A degraded body is incomplete and must not be revalidated as if it were the real one.
+        if not degraded and interaction_version is not None:
+            etag = build_etag(catalog_version(response), interaction_version, user_id, comments_preview)
+            if etag_matches(if_none_match, etag):
+                return self._not_modified(etag, headers['cache-control'])
+            headers['etag'] = etag
+        with span('serialization', 'encode response'):
+            return ORJSONResponse(result, headers=headers)
+
+    async def get_single_item(self, user_id: str, podcast_id: int, request: Request, comments_preview: int = 0,
+                              if_none_match: Optional[str] = None):
+        interaction_version = await self.interaction_versions.podcast(podcast_id, request)
+        etag = await self._user_etag(request, PODCAST, podcast_id, interaction_version, user_id,
+                                     comments_preview, if_none_match)
+        if etag and etag_matches(if_none_match, etag):
+            return self._not_modified(etag, 'private, no-cache')
+
+        indexed = await self._use_user_index(user_id, request)
+        response, annotations = await self._fetch_with_overlay(
+            self.single_flight.do(
+                ('podcast', podcast_id),
+                lambda: self.django_client.get_single_item(request=request, podcast_id=podcast_id)),
+            self._overlay(user_id, indexed, podcast_ids=(podcast_id,)),
+        )
+        if indexed:
+            annotations = await self._add_user_flags(user_id, (podcast_id,), annotations, request)
+        with span('serialization', 'decode upstream'):
+            data = orjson.loads(response.content)
+        degraded = await self._annotate_items(user_id, [data], (podcast_id,), annotations, comments_preview)
+        if degraded:
+            data['degraded'] = True
+
+        return self._conditional_response(data, degraded, response, interaction_version, user_id,
+                                          comments_preview, if_none_match)
+
+    async def _fetch_items(self, request: Request, podcast_ids: list) -> dict:
+        """
+        The _fetch_items function loads the catalog data of several podcasts, through the upstream batch
+        endpoint when PODCAST_BATCH_URL is configured, otherwise with at most PODCAST_BATCH_CONCURRENCY
+        single-item calls in flight.
+
+        :return: A dictionary mapping podcast_id to its data or to the HTTPException raised for it
+        """
+        if settings.PODCAST_BATCH_URL:
+            response = await self.django_client.get_items(request=request, podcast_ids=podcast_ids)
+            found = {item['id']: item for item in orjson.loads(response.content)}
+            not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found.")
+            return {podcast_id: found.get(podcast_id, not_found) for podcast_id in podcast_ids}
+
+        semaphore = asyncio.Semaphore(settings.PODCAST_BATCH_CONCURRENCY)
+
+        async def fetch(podcast_id):
+            async with semaphore:
+                try:
+                    response = await self.single_flight.do(
+                        ('podcast', podcast_id),
+                        lambda: self.django_client.get_single_item(request=request, podcast_id=podcast_id))
+                    return orjson.loads(response.content)
+                except HTTPException as exc:
+                    return exc
+
+        results = await asyncio.gather(*(fetch(podcast_id) for podcast_id in podcast_ids))
+        return dict(zip(podcast_ids, results))
+
+    async def get_items(self, user_id: str, podcast_ids: list, request: Request):
+        unique_ids = tuple(dict.fromkeys(podcast_ids))
+        indexed = await self._use_user_index(user_id, request)
+        fetched, annotations = await self._fetch_with_overlay(
+            self._fetch_items(request, list(unique_ids)),
+            self._overlay(user_id, indexed, podcast_ids=unique_ids),
         )
+        if indexed:
+            annotations = await self._add_user_flags(user_id, unique_ids, annotations, request)
+        found_ids = tuple(podcast_id for podcast_id in unique_ids if not isinstance(fetched[podcast_id], Exception))
+        found_items = [fetched[podcast_id] for podcast_id in found_ids]
+        degraded = await self._annotate_items(user_id, found_items, found_ids, annotations)
+
+        items = []
+        for podcast_id in podcast_ids:
+            item = fetched[podcast_id]
+            if isinstance(item, HTTPException):
+                items.append({'id': podcast_id, 'error': {'status_code': item.status_code, 'detail': item.detail}})
+            else:
+                items.append(item)
+        result = {'items': items}
+        if degraded:
+            result['degraded'] = True
+        return result
 
-        if result.modified_count > 0 or result.upserted_id is not None:
+    async def get_comments(self, podcast_id: int, limit: int, cursor: Optional[str] = None):
+        before = None
+        if cursor:
+            try:
+                before = ObjectId(cursor)
+            except InvalidId:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        comments, next_cursor = await self.interaction_store.list_comments(podcast_id, limit, before)
+        return {'podcast_id': podcast_id, 'comments': comments, 'next_cursor': next_cursor}
+
+    async def get_user_actions(self, user_id: str, action_type: ActionTypeEnum, limit: int,
+                               cursor: Optional[str] = None):
+        """
+        The get_user_actions function lists the podcasts the user liked or bookmarked, newest first,
+        from the user index (rebuilt from Mongo first when needed).
+
+        :param self: Represent the instance of the class
+        :param user_id: str: The calling user
+        :param action_type: ActionTypeEnum: like or book_mark
+        :param limit: int: The page size
+        :param cursor: Optional[str]: The next_cursor of the previous page
+        :return: The page of podcast ids with the time of the action, and the cursor of the next page
+        """
+        if not settings.USER_INDEX_ENABLED or self.user_index is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found.")
+        if not await self.user_index.ensure_built(user_id):
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Interaction index unavailable, retry later")
+        try:
+            items, next_cursor = await self.user_index.page(user_id, action_type.value, limit, cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        except RedisError:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Interaction index unavailable, retry later")
+        return {'action_type': action_type.value, 'items': items, 'next_cursor': next_cursor}
+
+    async def interaction_with_item(self, user_id, interaction: InteractionSchema):
+        if self._use_write_behind(interaction):
+            await self.interaction_buffer.submit(user_id, interaction, add=True)
+            await self._index_changes(user_id, [(interaction.podcast_id, interaction.action_type.value, True)])
+            await self.interaction_versions.bump([(interaction.channel_id, interaction.podcast_id)])
+            return {'status': 'accepted', 'message': 'Interaction queued.'}
+
+        recorded = await self.interaction_store.add(user_id, interaction)
+
+        if recorded:
+            await self._index_changes(user_id, [(interaction.podcast_id, interaction.action_type.value, True)])
+            await self.interaction_versions.bump([(interaction.channel_id, interaction.podcast_id)])
             return {'status': 'success', 'message': 'Interaction recorded successfully.'}
-        elif result.matched_count > 0 and interaction.action_type != ActionTypeEnum.comment:
-            return {'status': 'failure', 'message': 'Interaction already exists.'}
         else:
-            return {'status': 'failure', 'message': 'Failed to record interaction.'}
+            return {'status': 'failure', 'message': 'Interaction already exists.'}
 
     async def remove_interaction(self, user_id, interaction: BaseInteractionSchema):
-        collection_name = "interaction"
-        item_collection = self.mongo_db[collection_name]
-
-        interaction_type = interaction.action_type.value
-
-        update_query = {
-            '$pull': {
-                f"{interaction.podcast_id}.{interaction_type}": {
-                    'user_id': user_id
-                }
-            }
-        }
-
-        result = await item_collection.update_one(
-            {'_id': interaction.channel_id},
-            update_query
-        )
+        if self._use_write_behind(interaction):
+            await self.interaction_buffer.submit(user_id, interaction, add=False)
+            await self._index_changes(user_id, [(interaction.podcast_id, interaction.action_type.value, False)])
+            await self.interaction_versions.bump([(interaction.channel_id, interaction.podcast_id)])
+            return {'status': 'accepted', 'message': 'Interaction removal queued.'}
 
-        if result.modified_count > 0:
+        removed = await self.interaction_store.remove(user_id, interaction)
+
+        if removed:
+            await self._index_changes(user_id, [(interaction.podcast_id, interaction.action_type.value, False)])
+            await self.interaction_versions.bump([(interaction.channel_id, interaction.podcast_id)])
             return {'status': 'success', 'message': 'Interaction removed successfully.'}
         else:
             return {'status': 'failure', 'message': 'Interaction not found.'}
 
+    async def bulk_interactions(self, user_id, bulk: BulkInteractionSchema):
+        results = [None] * len(bulk.operations)
+        direct = []
+        # Queued changes are applied no matter what happens to the others, so an ordered bulk only uses the
+        # write-behind buffer when every operation can; otherwise all of it is written directly, in order,
+        # after the changes already queued so they cannot overtake it.
+        buffered = [self._use_write_behind(operation) for operation in bulk.operations]
+        if bulk.ordered and not all(buffered):
+            if any(buffered):
+                await self.interaction_buffer.flush()
+            buffered = [False] * len(buffered)
+        for index, operation in enumerate(bulk.operations):
+            if buffered[index]:
+                await self.interaction_buffer.submit(user_id, operation, add=operation.op == BulkOperationEnum.add)
+                results[index] = {'index': index, 'status': 'accepted', 'message': 'Interaction queued.'}
+            else:
+                direct.append(index)
+
+        outcomes = await self.interaction_store.bulk(user_id, [bulk.operations[index] for index in direct],
+                                                     ordered=bulk.ordered)
+        for index, outcome in zip(direct, outcomes):
+            status_name, message = BULK_OUTCOME_MESSAGES[outcome]
+            results[index] = {'index': index, 'status': status_name, 'message': message}
 
-api_service = APIService(get_redis_client(), get_mongo_db(), get_django_client())
+        applied = [bulk.operations[result['index']] for result in results
+                   if result['status'] in ('success', 'accepted')]
+        await self._index_changes(user_id, [(operation.podcast_id, operation.action_type.value,
+                                             operation.op == BulkOperationEnum.add) for operation in applied])
+        await self.interaction_versions.bump((operation.channel_id, operation.podcast_id) for operation in applied)
+
+        succeeded = sum(1 for result in results if result['status'] in ('success', 'accepted'))
+        if succeeded == len(results):
+            overall = 'success'
+        elif succeeded:
+            overall = 'partial'
+        else:
+            overall = 'failure'
+        return {'status': overall, 'results': results}
 
 
+@lru_cache
 def get_api_service():
-    return api_service
+    return APIService(get_redis_client(), get_mongo_db(),
+                      get_catalog_mirror() if settings.CATALOG_MIRROR_ENABLED else get_catalog_cache(),
+                      get_interaction_store(), get_interaction_buffer(), get_interaction_versions(),
+                      get_user_index())
@@ -1,13 +1,16 @@
 from typing import Any
+import hmac
 import jwt
 
 from fastapi import Request, HTTPException, status
 from fastapi.security import HTTPBearer
 
+from config.config import settings
 from utils.token import decode_token
-from db.redis_db import get_redis_client
-
-redis = get_redis_client()
+from db.redis_db import get_redis_client, prefetched_read
+from services.redis_prefetch import prepare_prefetch
+from services.token_cache import get_token_cache
+from utils.profiling import span
 
 
 async def get_payload_from_access_token(token):
@@ -55,18 +58,21 @@ async def get_payload_from_refresh_token(token):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
-async def validate_token(payload: dict) -> Any:
+def token_key(payload: dict) -> str:
+    return f"user_{payload.get('user_id')} || {payload.get('jti')}"
+
+
+async def validate_token(payload: dict, request: Request = None) -> Any:
     """
     The validate_token function is a callback function that will be called by FastAPI to validate the token.
     It takes in the payload of the JWT and returns an object if it's valid, or raises an exception if it's not.
 
     :param payload: dict: Get the jti and user_id from the token
+    :param request: Request: The request whose prefetched reads may already hold the token key
     :return: The user_id and jti
     :doc-author: Trelent
     """
-    jti = payload.get('jti')
-    user_id = payload.get('user_id')
-    result = await redis.get(f"user_{user_id} || {jti}")
+    result = await prefetched_read(get_redis_client(), request, 'GET', token_key(payload))
     if not result:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Invalid token, please login again.')
 
@@ -116,14 +122,29 @@ class JWTAuthentication(HTTPBearer):
         :return: The payload of the access token
         :doc-author: Trelent
         """
-        authorization_header = await self.get_authorization_header(request)
-        if not authorization_header:
-            return None
-
-        self.check_prefix(authorization_header)
-        payload = await get_payload_from_access_token(authorization_header)
-        await validate_token(payload)
-        return payload
+        with span('auth'):
+            authorization_header = await self.get_authorization_header(request)
+            if not authorization_header:
+                return None
+
+            self.check_prefix(authorization_header)
+            token_cache = get_token_cache() if settings.TOKEN_CACHE_ENABLED else None
+            payload = token_cache.get(authorization_header) if token_cache else None
+            cached = payload is not None
+            if not cached:
+                payload = await get_payload_from_access_token(authorization_header)
+
+            # The token key goes in the same pipelined round-trip as the reads the route will make.
+            prefetch = prepare_prefetch(request, get_redis_client(), payload.get('user_id'))
+            if prefetch is not None:
+                if not cached:
+                    prefetch.add('GET', token_key(payload))
+                await prefetch.execute()
+            if not cached:
+                await validate_token(payload, request)
+                if token_cache:
+                    token_cache.put(authorization_header, payload)
+            return payload
 
     async def get_authorization_header(self, request):
 
@@ -171,3 +192,18 @@ def get_access_jwt_aut():
     :doc-author: Trelent
     """
     return access_jwt_auth
+
+
+async def verify_admin_key(request: Request):
+    """
+    The verify_admin_key function guards the operational endpoints (pool stats, cache purge, ...).
+    The caller must send the configured ADMIN_API_KEY in the X-Admin-Key header; when no key is
+    configured the admin endpoints are disabled altogether.
+
+    :param request: Request: Get the X-Admin-Key header from the request
+    :return: None if the key matches
+    """
+    admin_key = request.headers.get('X-Admin-Key', '')
+    # compare_digest only accepts ASCII strings, and a header may carry any latin-1 character: compare bytes.
+    if not settings.ADMIN_API_KEY or not hmac.compare_digest(admin_key.encode(), settings.ADMIN_API_KEY.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin key required for this API")
@@ -0,0 +1,222 @@
+import asyncio
+import time
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException, Request
+from redis.exceptions import RedisError
+
+from config.config import settings
+from db.redis_db import get_redis_client, get_request_prefetch, prefetched_read, MISSING
+from services.django_httpx_client import get_django_client
+from utils.etag import content_version
+
+CHANNELS = 'channels'
+CHANNEL_ITEMS = 'channel_items'
+PODCAST = 'podcast'
+
+KEY_PREFIX = 'catalog'
+VERSION_HEADER = 'x-catalog-version'
+
+
+def catalog_version(response: httpx.Response) -> str:
+    """
+    The catalog_version function identifies the catalog data in an upstream or cached response:
+    the version stored with the cache entry, the upstream ETag, or else a hash of the body.
+
+    :param response: httpx.Response: The catalog response
+    :return: A string that changes whenever the catalog data changes
+    """
+    return (response.headers.get(VERSION_HEADER) or response.headers.get('etag')
+            or content_version(response.content))
+
+
+class CatalogCache:
+    """
+    Read-through cache of the Django catalog responses kept in Redis.
+
+    Each entry is a Redis hash holding the upstream body, its content type and the time it was stored.
+    An entry younger than the route TTL is served as a hit; an older one is still served (stale) while a
+    background task refreshes it from upstream, for another CATALOG_CACHE_STALE_TTL seconds. Past that the
+    entry is only kept (for CATALOG_CACHE_FALLBACK_TTL) as a fallback when upstream fails or its circuit is open.
+    The class exposes the same read methods as DjangoClient so APIService can use either one.
+    """
+
+    def __init__(self, redis_db, django_client):
+        self.redis_db = redis_db
+        self.django_client = django_client
+        self.ttls = {
+            CHANNELS: settings.CATALOG_CACHE_CHANNELS_TTL,
+            CHANNEL_ITEMS: settings.CATALOG_CACHE_CHANNEL_ITEMS_TTL,
+            PODCAST: settings.CATALOG_CACHE_PODCAST_TTL,
+        }
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'fallbacks': 0, 'refreshes': 0, 'refresh_errors': 0,
+                         'errors': 0}
+        self._refreshing = set()
+        self._tasks = set()
+
+    @staticmethod
+    def cache_key(route: str, ident='') -> str:
+        return f'{KEY_PREFIX}:{route}:{ident}'
+
+    @staticmethod
+    def _build_response(entry: dict, cache_status: str) -> httpx.Response:
+        return httpx.Response(
+            status_code=200,
+            content=entry['body'].encode(),
+            headers={'content-type': entry.get('content_type', 'application/json'), 'x-cache': cache_status,
+                     VERSION_HEADER: entry.get('version') or content_version(entry['body'].encode())},
+        )
+
+    async def _store(self, key: str, route: str, response: httpx.Response):
+        entry = {
+            'body': response.text,
+            'content_type': response.headers.get('content-type', 'application/json'),
+            'version': catalog_version(response),
+            'stored_at': time.time(),
+        }
+        try:
+            async with self.redis_db.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=entry)
+                pipe.expire(key, self.ttls[route] + max(settings.CATALOG_CACHE_STALE_TTL,
+                                                        settings.CATALOG_CACHE_FALLBACK_TTL))
+                await pipe.execute()
+        except RedisError:
+            self.counters['errors'] += 1
+
+    async def _refresh(self, key: str, route: str, fetch):
+        try:
+            response = await fetch()
+            await self._store(key, route, response)
+            self.counters['refreshes'] += 1
+        except Exception:
+            self.counters['refresh_errors'] += 1
+        finally:
+            self._refreshing.discard(key)
+
+    def _schedule_refresh(self, key: str, route: str, fetch):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._refresh(key, route, fetch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _get(self, route: str, ident, fetch, request: Request = None):
+        if not settings.CATALOG_CACHE_ENABLED:
+            return await fetch()
+
+        key = self.cache_key(route, ident)
+        try:
+            entry = await prefetched_read(self.redis_db, request, 'HGETALL', key)
+        except RedisError:
+            self.counters['errors'] += 1
+            entry = None
+
+        if entry:
+            age = time.time() - float(entry.get('stored_at', 0))
+            if age <= self.ttls[route]:
+                self.counters['hits'] += 1
+                return self._build_response(entry, 'hit')
+            if age <= self.ttls[route] + settings.CATALOG_CACHE_STALE_TTL:
+                self.counters['stale'] += 1
+                self._schedule_refresh(key, route, fetch)
+                return self._build_response(entry, 'stale')
+
+        self.counters['misses'] += 1
+        try:
+            response = await fetch()
+        except HTTPException as exc:
+            # Upstream is down or its circuit is open: the last known response beats an error.
+            if not entry or exc.status_code < 500:
+                raise
+            self.counters['fallbacks'] += 1
+            return self._build_response(entry, 'fallback')
+        await self._store(key, route, response)
+        return response
+
+    async def cached_version(self, route: str, ident='', request: Request = None) -> Optional[str]:
+        """
+        The cached_version function returns the catalog version of a fresh cache entry without loading its body
+        (unless the request already prefetched it), so a conditional request can be answered before the
+        response is built.
+
+        :param self: Represent the instance of the class
+        :param route: str: One of the route names
+        :param ident: The channel or podcast id
+        :param request: Request: The request whose prefetched reads may hold the entry
+        :return: The version, or None when there is no fresh entry
+        """
+        if not settings.CATALOG_CACHE_ENABLED:
+            return None
+        key = self.cache_key(route, ident)
+        prefetch = get_request_prefetch(request)
+        entry = prefetch.get('HGETALL', key) if prefetch is not None else MISSING
+        if entry is not MISSING:
+            version, stored_at = entry.get('version'), entry.get('stored_at')
+        else:
+            try:
+                version, stored_at = await self.redis_db.hmget(key, 'version', 'stored_at')
+            except RedisError:
+                return None
+        if version is None or stored_at is None or time.time() - float(stored_at) > self.ttls[route]:
+            return None
+        return version
+
+    async def get_channels(self, request: Request):
+        return await self._get(CHANNELS, '', lambda: self.django_client.get_channels(request=request), request)
+
+    async def get_channels_items(self, request: Request, channel_id: int):
+        return await self._get(
+            CHANNEL_ITEMS, channel_id,
+            lambda: self.django_client.get_channels_items(request=request, channel_id=channel_id), request)
+
+    async def get_single_item(self, request: Request, podcast_id: int):
+        return await self._get(
+            PODCAST, podcast_id,
+            lambda: self.django_client.get_single_item(request=request, podcast_id=podcast_id), request)
+
+    async def get_items(self, request: Request, podcast_ids: list):
+        # Batch responses depend on the exact id set, so they are not cached.
+        return await self.django_client.get_items(request=request, podcast_ids=podcast_ids)
+
+    async def purge(self, route: str = None, ident=None) -> int:
+        """
+        The purge function drops cached catalog entries so the next read goes to upstream.
+
+        :param self: Represent the instance of the class
+        :param route: str: One of the route names; all routes are purged when omitted
+        :param ident: The channel or podcast id; every entry of the route is purged when omitted
+        :return: The number of deleted keys
+        """
+        if route is not None and ident is not None:
+            return await self.redis_db.delete(self.cache_key(route, ident))
+
+        pattern = f'{KEY_PREFIX}:{route}:*' if route else f'{KEY_PREFIX}:*'
+        deleted = 0
+        batch = []
+        async for key in self.redis_db.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                deleted += await self.redis_db.delete(*batch)
+                batch = []
+        if batch:
+            deleted += await self.redis_db.delete(*batch)
+        return deleted
+
+    def stats(self) -> dict:
+        lookups = self.counters['hits'] + self.counters['misses'] + self.counters['stale']
+        served_from_cache = self.counters['hits'] + self.counters['stale']
+        return {**self.counters, 'hit_ratio': served_from_cache / lookups if lookups else 0.0}
+
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+@lru_cache
+def get_catalog_cache():
+    return CatalogCache(get_redis_client(), get_django_client())
@@ -0,0 +1,362 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import time
+import uuid
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+import orjson
+from fastapi import HTTPException, Request, status
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from config.config import settings
+from db.mongo_db import get_mongo_db
+from services.catalog_cache import get_catalog_cache, catalog_version, CHANNELS, CHANNEL_ITEMS, PODCAST, VERSION_HEADER
+from services.django_httpx_client import get_django_client
+
+MIRROR_COLLECTION = 'catalog_mirror'
+STATE_ID = 'sync:state'
+LEASE_ID = 'sync:lease'
+# Look back a little further than the previous pass started, for clock skew between us and upstream.
+CURSOR_OVERLAP = 60
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class CatalogMirror:
+    """
+    Local copy of the Django catalog in Mongo, kept current by a background sync task.
+
+    Every mirrored upstream response (the channel list, each channel's items, each podcast) is one document
+    holding its body, content type, catalog version and the upstream validators. The read methods match
+    DjangoClient and CatalogCache: a request is answered from the mirror and only goes to `upstream` for
+    entries the mirror does not have (storing the answer) or has not synced for CATALOG_MIRROR_MAX_STALENESS,
+    in which case the old entry is still served if upstream fails.
+
+    A sync pass revalidates the entries with conditional GETs, so unchanged ones cost a 304 and no write.
+    When CATALOG_MIRROR_MODIFIED_SINCE_PARAM is set, incremental passes ask upstream which channels changed
+    since the previous pass and only sync those (and their podcasts); every CATALOG_MIRROR_FULL_SWEEP_INTERVAL,
+    or whenever the modified-since query fails, a full sweep syncs everything and drops the entries upstream
+    no longer lists. Paginated list responses ({"results": [...], "next": url}) are followed to the end.
+    Only the worker holding the Mongo lease syncs, so several workers do not multiply the upstream load.
+    Incremental passes do not refresh the entries they skip, so CATALOG_MIRROR_MAX_STALENESS has to exceed
+    the full sweep interval plus the time a sweep takes, or reads go upstream before each sweep.
+    """
+
+    def __init__(self, mongo_db, django_client, upstream):
+        self.collection = mongo_db[MIRROR_COLLECTION]
+        self.django_client = django_client
+        self.upstream = upstream
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'stale_served': 0, 'errors': 0, 'passes': 0,
+                         'pass_errors': 0}
+        self.last_pass: dict = {}
+        self._task: Optional[asyncio.Task] = None
+        self._sync_lock = asyncio.Lock()
+
+    @staticmethod
+    def entry_id(route: str, ident='') -> str:
+        return f'{route}:{ident}'
+
+    async def create_indexes(self):
+        await self.collection.create_indexes([
+            IndexModel([('route', ASCENDING), ('synced_at', ASCENDING)], name='route_synced_at'),
+        ])
+
+    @staticmethod
+    def _build_response(doc: dict, cache_status: str) -> httpx.Response:
+        return httpx.Response(
+            status_code=200,
+            content=doc['body'].encode(),
+            headers={'content-type': doc.get('content_type', 'application/json'), 'x-cache': cache_status,
+                     VERSION_HEADER: doc['version']},
+        )
+
+    async def _store(self, route: str, ident, response: httpx.Response, synced_at: float = None):
+        await self.collection.update_one({'_id': self.entry_id(route, ident)}, {'$set': {
+            'route': route,
+            'ident': ident,
+            'body': response.text,
+            'content_type': response.headers.get('content-type', 'application/json'),
+            'version': catalog_version(response),
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'synced_at': synced_at or time.time(),
+        }}, upsert=True)
+
+    async def _get(self, route: str, ident, fetch):
+        try:
+            doc = await self.collection.find_one({'_id': self.entry_id(route, ident)})
+        except PyMongoError:
+            self.counters['errors'] += 1
+            doc = None
+
+        if doc is not None and time.time() - doc['synced_at'] <= settings.CATALOG_MIRROR_MAX_STALENESS:
+            self.counters['hits'] += 1
+            return self._build_response(doc, 'mirror')
+
+        self.counters['stale' if doc is not None else 'misses'] += 1
+        try:
+            response = await fetch()
+        except HTTPException as exc:
+            if doc is None or exc.status_code < 500:
+                raise
+            self.counters['stale_served'] += 1
+            return self._build_response(doc, 'mirror-stale')
+        try:
+            await self._store(route, ident, response)
+        except PyMongoError:
+            self.counters['errors'] += 1
+        return response
+
+    async def cached_version(self, route: str, ident='', request: Request = None) -> Optional[str]:
+        """
+        The cached_version function returns the catalog version of a fresh mirror entry without loading its body.
+
+        :param self: Represent the instance of the class
+        :param route: str: One of the route names
+        :param ident: The channel or podcast id
+        :param request: Request: Unused; kept for the same signature as CatalogCache
+        :return: The version, or None when the entry is missing or stale
+        """
+        try:
+            doc = await self.collection.find_one({'_id': self.entry_id(route, ident)},
+                                                 {'version': 1, 'synced_at': 1})
+        except PyMongoError:
+            return None
+        if doc is None or time.time() - doc['synced_at'] > settings.CATALOG_MIRROR_MAX_STALENESS:
+            return None
+        return doc['version']
+
+    async def get_channels(self, request: Request):
+        return await self._get(CHANNELS, '', lambda: self.upstream.get_channels(request=request))
+
+    async def get_channels_items(self, request: Request, channel_id: int):
+        return await self._get(
+            CHANNEL_ITEMS, channel_id,
+            lambda: self.upstream.get_channels_items(request=request, channel_id=channel_id))
+
+    async def get_single_item(self, request: Request, podcast_id: int):
+        return await self._get(
+            PODCAST, podcast_id,
+            lambda: self.upstream.get_single_item(request=request, podcast_id=podcast_id))
+
+    async def get_items(self, request: Request, podcast_ids: list):
+        """
+        The get_items function answers a batch read from the mirror, asking upstream only for the podcasts
+        the mirror does not have fresh.
+
+        :return: A response whose body is the list of found podcasts, like the upstream batch endpoint
+        """
+        fresh_after = time.time() - settings.CATALOG_MIRROR_MAX_STALENESS
+        found = {}
+        try:
+            async for doc in self.collection.find({'_id': {'$in': [self.entry_id(PODCAST, podcast_id)
+                                                                   for podcast_id in podcast_ids]},
+                                                   'synced_at': {'$gte': fresh_after}}):
+                found[doc['ident']] = orjson.loads(doc['body'])
+        except PyMongoError:
+            self.counters['errors'] += 1
+        self.counters['hits'] += len(found)
+
+        missing = [podcast_id for podcast_id in podcast_ids if podcast_id not in found]
+        if missing:
+            self.counters['misses'] += len(missing)
+            response = await self.upstream.get_items(request=request, podcast_ids=missing)
+            for item in orjson.loads(response.content):
+                found[item['id']] = item
+        return httpx.Response(
+            status_code=200,
+            content=orjson.dumps([found[podcast_id] for podcast_id in podcast_ids if podcast_id in found]),
+            headers={'content-type': 'application/json', 'x-cache': 'mirror' if not missing else 'mirror-partial'},
+        )
+
+    async def _sync_entry(self, route: str, ident, url: str, stats: dict, started: float) -> Optional[dict]:
+        """
+        The _sync_entry function revalidates one mirror entry against upstream with a conditional GET.
+
+        :return: The current entry (None when upstream no longer has it), with a changed flag
+        """
+        entry_id = self.entry_id(route, ident)
+        doc = await self.collection.find_one({'_id': entry_id})
+        headers = {}
+        if doc is not None and doc.get('etag'):
+            headers['if-none-match'] = doc['etag']
+        if doc is not None and doc.get('last_modified'):
+            headers['if-modified-since'] = doc['last_modified']
+
+        try:
+            response = await self.django_client.fetch(url, f'mirror_{route}', headers=headers)
+        except HTTPException as exc:
+            if exc.status_code == status.HTTP_404_NOT_FOUND:
+                await self.collection.delete_one({'_id': entry_id})
+                stats['deleted'] += 1
+                return None
+            stats['errors'] += 1
+            return doc and {**doc, 'changed': False}
+        stats['fetched'] += 1
+
+        if response.status_code == status.HTTP_304_NOT_MODIFIED or (
+                doc is not None and doc['version'] == catalog_version(response)):
+            stats['not_modified'] += 1
+            await self.collection.update_one({'_id': entry_id}, {'$set': {'synced_at': started}})
+            return {**doc, 'changed': False}
+
+        await self._store(route, ident, response, synced_at=started)
+        stats['updated'] += 1
+        return {'body': response.text, 'changed': True}
+
+    async def _list_all(self, url: str, endpoint: str, params: dict = None) -> list:
+        """
+        Fetches a list endpoint and follows its pagination, returning every entry of every page.
+        """
+        entries = []
+        response = await self.django_client.fetch(url, endpoint, params=params)
+        while True:
+            data = orjson.loads(response.content)
+            if not isinstance(data, dict):
+                return entries + data
+            entries.extend(data.get('results') or [])
+            if not data.get('next'):
+                return entries
+            response = await self.django_client.fetch(data['next'], endpoint)
+
+    async def _channel_ids(self, channels: dict, stats: dict) -> list:
+        data = orjson.loads(channels['body'])
+        if isinstance(data, dict):
+            # Paginated upstream: the mirrored body is its first page, so walk all of them for the ids.
+            try:
+                data = await self._list_all(self.django_client.channels_list_url, 'mirror_channels')
+            except HTTPException:
+                stats['errors'] += 1
+                data = data.get('results') or []
+        return [channel['id'] for channel in data]
+
+    async def _changed_channel_ids(self, cursor: float) -> list:
+        since = datetime.datetime.utcfromtimestamp(cursor).isoformat() + 'Z'
+        changed = await self._list_all(self.django_client.channels_list_url, 'mirror_channels',
+                                       params={settings.CATALOG_MIRROR_MODIFIED_SINCE_PARAM: since})
+        return [channel['id'] for channel in changed]
+
+    async def _gather_limited(self, coroutines: list) -> list:
+        semaphore = asyncio.Semaphore(settings.CATALOG_MIRROR_SYNC_CONCURRENCY)
+
+        async def limited(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*(limited(coroutine) for coroutine in coroutines))
+
+    async def sync_once(self, full: bool = None) -> dict:
+        """
+        The sync_once function runs one sync pass.
+
+        :param self: Represent the instance of the class
+        :param full: bool: Force a full sweep (True) or an incremental pass (False); chosen automatically when None
+        :return: The counters of the pass
+        """
+        async with self._sync_lock:
+            started = time.time()
+            state = await self.collection.find_one({'_id': STATE_ID}) or {}
+            if full is None:
+                full = (not settings.CATALOG_MIRROR_MODIFIED_SINCE_PARAM or not state.get('cursor')
+                        or started - state.get('full_sweep_at', 0) >= settings.CATALOG_MIRROR_FULL_SWEEP_INTERVAL)
+            stats = {'full': full, 'fetched': 0, 'not_modified': 0, 'updated': 0, 'deleted': 0, 'errors': 0}
+
+            channels = await self._sync_entry(CHANNELS, '', self.django_client.channels_list_url, stats, started)
+            if channels is None:
+                raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Channel list unavailable")
+            channel_ids = await self._channel_ids(channels, stats)
+
+            targets, changed = channel_ids, set()
+            if not full:
+                try:
+                    changed = set(await self._changed_channel_ids(state['cursor'] - CURSOR_OVERLAP))
+                    mirrored = {doc['ident'] async for doc in self.collection.find({'route': CHANNEL_ITEMS},
+                                                                                   {'ident': 1})}
+                    targets = [channel_id for channel_id in channel_ids
+                               if channel_id in changed or channel_id not in mirrored]
+                except HTTPException:
+                    # Upstream does not support the modified-since query (or it failed): sweep everything.
+                    full = stats['full'] = True
+
+            channel_docs = await self._gather_limited([
+                self._sync_entry(CHANNEL_ITEMS, channel_id, f'{self.django_client.channels_list_url}{channel_id}/',
+                                 stats, started)
+                for channel_id in targets
+            ])
+            podcast_ids = []
+            for channel_id, doc in zip(targets, channel_docs):
+                # A channel upstream reports as modified may have modified podcasts even if its item list is not.
+                if doc is not None and (full or doc['changed'] or channel_id in changed):
+                    podcast_ids.extend(item['id'] for item in orjson.loads(doc['body']).get('items') or [])
+            await self._gather_limited([
+                self._sync_entry(PODCAST, podcast_id, f'{self.django_client.podcast_url}{podcast_id}/', stats,
+                                 started)
+                for podcast_id in dict.fromkeys(podcast_ids)
+            ])
+
+            update = {'cursor': started}
+            if full:
+                update['full_sweep_at'] = started
+                if not stats['errors']:
+                    # Everything upstream still lists was touched by this pass.
+                    result = await self.collection.delete_many({'route': {'$exists': True},
+                                                                'synced_at': {'$lt': started}})
+                    stats['deleted'] += result.deleted_count
+            stats['duration'] = round(time.time() - started, 3)
+            await self.collection.update_one({'_id': STATE_ID}, {'$set': {**update, 'last_pass': stats}}, upsert=True)
+            self.counters['passes'] += 1
+            self.last_pass = stats
+            return stats
+
+    async def _acquire_lease(self) -> bool:
+        now = time.time()
+        try:
+            await self.collection.find_one_and_update(
+                {'_id': LEASE_ID, '$or': [{'expires_at': {'$lt': now}}, {'owner': self.owner}]},
+                {'$set': {'owner': self.owner, 'expires_at': now + settings.CATALOG_MIRROR_SYNC_INTERVAL * 3}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                if await self._acquire_lease():
+                    await self.sync_once()
+            except (HTTPException, PyMongoError):
+                self.counters['pass_errors'] += 1
+            except Exception:
+                # An unexpected upstream payload must not end the sync task for the life of the worker.
+                self.counters['pass_errors'] += 1
+                logger.exception('Catalog mirror sync pass failed')
+            await asyncio.sleep(settings.CATALOG_MIRROR_SYNC_INTERVAL)
+
+    def start(self):
+        if settings.CATALOG_MIRROR_MAX_STALENESS <= settings.CATALOG_MIRROR_FULL_SWEEP_INTERVAL:
+            logger.warning('CATALOG_MIRROR_MAX_STALENESS (%ss) does not exceed CATALOG_MIRROR_FULL_SWEEP_INTERVAL '
+                           '(%ss): entries skipped by incremental passes turn stale before the next sweep',
+                           settings.CATALOG_MIRROR_MAX_STALENESS, settings.CATALOG_MIRROR_FULL_SWEEP_INTERVAL)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {**self.counters, 'last_pass': self.last_pass}
+
+
+@lru_cache
+def get_catalog_mirror():
+    return CatalogMirror(get_mongo_db(), get_django_client(), get_catalog_cache())
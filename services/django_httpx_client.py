@@ -1,33 +1,300 @@
-from fastapi import Request, HTTPException
+import asyncio
+import time
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import Request, HTTPException, status
 from config.config import settings
 import httpx
 
+from services.resilience import CircuitBreaker, LatencyWindow, RetryBudget, backoff_delay, CLOSED
+from utils.metrics import (upstream_circuit_rejections_total, upstream_hedged_requests_total,
+                           upstream_request_duration_seconds, upstream_requests_total, upstream_retries_total)
+from utils.profiling import span
+
+RETRYABLE_STATUS_CODES = (status.HTTP_502_BAD_GATEWAY, status.HTTP_503_SERVICE_UNAVAILABLE,
+                          status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+class UpstreamError(HTTPException):
+    """
+    HTTPException raised for a failed upstream call.
+
+    retryable tells whether the same GET may be sent again; failure tells whether the call counts against
+    the endpoint's circuit breaker (4xx answers and local pool exhaustion do not).
+    """
+
+    def __init__(self, status_code: int, detail: str, retryable: bool = False, failure: bool = True):
+        super().__init__(status_code=status_code, detail=detail)
+        self.retryable = retryable
+        self.failure = failure
+
 
 class DjangoClient:
-    channels_list_url = settings.CHANNEL_LIST_URL
-    podcast_url = settings.PODCAST_URL
-
-    async def _send_request(self, url: str, request: Request):
-        headers = {'correlation-id': request.state.correlation_id}
-        async with httpx.AsyncClient(headers=headers) as client:
-            try:
-                response = await client.get(url)
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        """
+        The __init__ function sets up the client without opening any connection.
+        The shared httpx.AsyncClient is created by startup() inside the app lifespan.
+
+        :param self: Represent the instance of the class
+        :param transport: Optional transport used instead of the default connection pool (e.g. httpx.MockTransport)
+        """
+        self.channels_list_url = settings.CHANNEL_LIST_URL
+        self.podcast_url = settings.PODCAST_URL
+        self.podcast_batch_url = settings.PODCAST_BATCH_URL
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._in_flight = 0
+        self._requests_total = 0
+        self.breakers: dict = {}
+        self.latencies: dict = {}
+        self.retry_budget = RetryBudget(settings.UPSTREAM_RETRY_BUDGET_RATIO,
+                                        settings.UPSTREAM_RETRY_BUDGET_MIN_PER_SECOND)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+            read=settings.UPSTREAM_READ_TIMEOUT,
+            write=settings.UPSTREAM_WRITE_TIMEOUT,
+            pool=settings.UPSTREAM_POOL_TIMEOUT,
+        )
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=settings.UPSTREAM_HTTP2,
+                                 transport=self._transport)
+
+    async def startup(self):
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+
+    async def warm_up(self):
+        """
+        The warm_up function opens a keep-alive connection to the upstream host, so the first request a worker
+        serves does not pay for the TCP (and TLS) handshake. Any HTTP status will do; only a connection
+        failure raises.
+
+        :param self: Represent the instance of the class
+        """
+        await self.client.head(self.channels_list_url)
+
+    async def shutdown(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    def pool_stats(self) -> dict:
+        """
+        The pool_stats function reports how the shared connection pool is being used.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the configured limits and the current connection counts
+        """
+        stats = {
+            'max_connections': settings.UPSTREAM_MAX_CONNECTIONS,
+            'max_keepalive_connections': settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            'keepalive_expiry': settings.UPSTREAM_KEEPALIVE_EXPIRY,
+            'http2': settings.UPSTREAM_HTTP2,
+            'in_flight_requests': self._in_flight,
+            'requests_total': self._requests_total,
+            'connections': 0,
+            'idle_connections': 0,
+            'active_connections': 0,
+            'queued_requests': 0,
+        }
+        pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+        if pool is not None:
+            connections = list(getattr(pool, 'connections', []))
+            idle = sum(1 for connection in connections if connection.is_idle())
+            stats['connections'] = len(connections)
+            stats['idle_connections'] = idle
+            stats['active_connections'] = len(connections) - idle
+            stats['queued_requests'] = max(len(getattr(pool, '_requests', [])) - stats['active_connections'], 0)
+        return stats
+
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                failure_threshold=settings.UPSTREAM_BREAKER_FAILURE_THRESHOLD,
+                recovery_timeout=settings.UPSTREAM_BREAKER_RECOVERY_TIMEOUT,
+                half_open_max_calls=settings.UPSTREAM_BREAKER_HALF_OPEN_MAX_CALLS,
+            )
+            self.latencies[endpoint] = LatencyWindow()
+        return breaker
+
+    async def _get_once(self, url: str, headers: dict, endpoint: str) -> httpx.Response:
+        breaker = self.breakers[endpoint]
+        self._in_flight += 1
+        self._requests_total += 1
+        outcome = 'error'
+        start = time.perf_counter()
+        try:
+            response = await self.client.get(url, headers=headers)
+            outcome = str(response.status_code)
+            if response.status_code != status.HTTP_304_NOT_MODIFIED:
                 response.raise_for_status()
-                return response
-            except httpx.HTTPStatusError as exc:
-                raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
+            breaker.record_success()
+            self.latencies[endpoint].add(time.perf_counter() - start)
+            return response
+        except httpx.HTTPStatusError as exc:
+            server_error = exc.response.status_code >= 500
+            error = UpstreamError(exc.response.status_code, exc.response.text,
+                                  retryable=exc.response.status_code in RETRYABLE_STATUS_CODES, failure=server_error)
+        except httpx.PoolTimeout:
+            outcome = 'pool_timeout'
+            error = UpstreamError(status.HTTP_503_SERVICE_UNAVAILABLE, "Upstream connection pool exhausted",
+                                  failure=False)
+        except httpx.TimeoutException:
+            outcome = 'timeout'
+            error = UpstreamError(status.HTTP_504_GATEWAY_TIMEOUT, "Upstream service timed out", retryable=True)
+        except httpx.RequestError:
+            outcome = 'connection_error'
+            error = UpstreamError(status.HTTP_502_BAD_GATEWAY, "Upstream service unavailable", retryable=True)
+        finally:
+            self._in_flight -= 1
+            upstream_request_duration_seconds.observe(endpoint, value=time.perf_counter() - start)
+            upstream_requests_total.inc(endpoint, outcome)
+
+        if error.failure:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise error
+
+    def _hedge_delay(self, endpoint: str) -> Optional[float]:
+        latencies = self.latencies[endpoint]
+        if (not settings.UPSTREAM_HEDGE_ENABLED or self.breakers[endpoint].state != CLOSED
+                or len(latencies) < settings.UPSTREAM_HEDGE_MIN_SAMPLES):
+            return None
+        return max(latencies.percentile(settings.UPSTREAM_HEDGE_PERCENTILE), settings.UPSTREAM_HEDGE_MIN_DELAY)
+
+    async def _hedged_get(self, url: str, headers: dict, endpoint: str) -> httpx.Response:
+        """
+        The _hedged_get function sends the GET and, if it has not answered within the endpoint's recent
+        UPSTREAM_HEDGE_PERCENTILE latency, sends a second copy and returns whichever answers first.
+        Hedges are paid from the retry budget, so they cannot multiply the load on a slow upstream.
+
+        :return: The response of the first attempt that succeeds (or fails with a non-retryable error)
+        """
+        delay = self._hedge_delay(endpoint)
+        if delay is None:
+            return await self._get_once(url, headers, endpoint)
+
+        primary = asyncio.create_task(self._get_once(url, headers, endpoint))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done or not self.retry_budget.try_withdraw():
+            return await primary
+
+        hedge = asyncio.create_task(self._get_once(url, headers, endpoint))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None or not getattr(error, 'retryable', False) or not pending:
+                        upstream_hedged_requests_total.inc(endpoint, 'primary' if task is primary else 'hedge')
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _send_request(self, url: str, request: Optional[Request], endpoint: str, headers: dict = None):
+        """
+        The _send_request function GETs an upstream URL through the endpoint's circuit breaker.
+        Transient failures (connection errors, timeouts, 502/503/504) are retried up to
+        UPSTREAM_RETRY_MAX_ATTEMPTS times with jittered exponential backoff, as long as the retry budget and
+        UPSTREAM_BUDGET allow it. An open circuit fails fast with 503 so callers can fall back to the cache.
+
+        :param self: Represent the instance of the class
+        :param url: str: The upstream URL
+        :param request: Optional[Request]: The incoming request, for the correlation id; None for background calls
+        :param endpoint: str: Name of the upstream endpoint used for metrics and the breaker
+        :param headers: dict: Extra request headers, e.g. conditional GET validators
+        :return: The upstream response
+        """
+        headers = dict(headers or {})
+        if request is not None:
+            headers['correlation-id'] = request.state.correlation_id
+        with span('upstream', endpoint):
+            breaker = self._breaker(endpoint)
+            deadline = time.monotonic() + settings.UPSTREAM_BUDGET
+            self.retry_budget.deposit()
+            attempt = 0
+            while True:
+                if not breaker.allow():
+                    upstream_circuit_rejections_total.inc(endpoint)
+                    raise UpstreamError(status.HTTP_503_SERVICE_UNAVAILABLE, "Upstream circuit open")
+                try:
+                    return await self._hedged_get(url, headers, endpoint)
+                except UpstreamError as exc:
+                    if not exc.retryable or attempt >= settings.UPSTREAM_RETRY_MAX_ATTEMPTS:
+                        raise
+                    attempt += 1
+                    delay = backoff_delay(attempt, settings.UPSTREAM_RETRY_BASE_DELAY,
+                                          settings.UPSTREAM_RETRY_MAX_DELAY)
+                    if time.monotonic() + delay >= deadline or not self.retry_budget.try_withdraw():
+                        raise
+                    upstream_retries_total.inc(endpoint)
+                    await asyncio.sleep(delay)
+
+    async def fetch(self, url: str, endpoint: str, headers: dict = None, params: dict = None) -> httpx.Response:
+        """
+        The fetch function GETs an upstream URL outside of any incoming request (e.g. for the catalog mirror sync),
+        with the same breaker, retries and budget as the request path. A 304 answer is returned, not raised.
+
+        :param self: Represent the instance of the class
+        :param url: str: The upstream URL
+        :param endpoint: str: Name of the upstream endpoint used for metrics and the breaker
+        :param headers: dict: Extra request headers
+        :param params: dict: Query parameters added to the URL
+        :return: The upstream response
+        """
+        if params:
+            url = str(httpx.URL(url).copy_merge_params(params))
+        return await self._send_request(url, None, endpoint, headers)
+
+    def resilience_stats(self) -> dict:
+        return {
+            'breakers': {endpoint: breaker.stats() for endpoint, breaker in self.breakers.items()},
+            'retry_budget': self.retry_budget.stats(),
+            'latency_p95': {endpoint: window.percentile(0.95) for endpoint, window in self.latencies.items()},
+        }
+
+    async def cached_version(self, route: str, ident='', request: Request = None) -> Optional[str]:
+        # Without the catalog cache the version is only known once the response has been fetched.
+        return None
 
     async def get_channels(self, request: Request):
-        return await self._send_request(self.channels_list_url, request)
+        return await self._send_request(self.channels_list_url, request, 'channels')
 
     async def get_channels_items(self, request: Request, channel_id: int):
         url = f"{self.channels_list_url}{channel_id}/"
-        return await self._send_request(url, request)
+        return await self._send_request(url, request, 'channel_items')
 
     async def get_single_item(self, request: Request, podcast_id: int):
         url = f"{self.podcast_url}{podcast_id}/"
-        return await self._send_request(url, request)
+        return await self._send_request(url, request, 'podcast')
+
+    async def get_items(self, request: Request, podcast_ids: list):
+        url = f"{self.podcast_batch_url}?ids={','.join(str(podcast_id) for podcast_id in podcast_ids)}"
+        return await self._send_request(url, request, 'podcast_batch')
 
 
+@lru_cache
 def get_django_client():
-    return DjangoClient()
\ No newline at end of file
+    return DjangoClient()
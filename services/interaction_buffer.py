@@ -0,0 +1,141 @@
+import asyncio
+import time
+from functools import lru_cache
+from typing import Optional
+
+from config.config import settings
+from schemas.interaction import BaseInteractionSchema
+from services.interaction_store import get_interaction_store
+from services.interaction_versions import get_interaction_versions
+from services.user_index import get_user_index
+
+
+class InteractionWriteBuffer:
+    """
+    Write-behind buffer for likes and bookmarks (adds and removals).
+
+    Both actions are idempotent set/unset operations, so only the last change per
+    (podcast_id, user_id, action_type) has to reach Mongo: a burst of clicks is coalesced in memory and
+    written with one bulk_write once INTERACTION_WRITE_BEHIND_BATCH_SIZE changes are pending or the
+    oldest pending change is INTERACTION_WRITE_BEHIND_MAX_LAG seconds old. Comments never go through here.
+    The interaction versions are bumped again once a batch is written, since other workers only see the
+    changes from then on, and the changes are applied to the user index again, since a rebuild that ran
+    while they were pending read Mongo without them.
+    """
+
+    def __init__(self, interaction_store, batch_size: int, max_lag: float, max_pending: int,
+                 interaction_versions=None, user_index=None):
+        self.interaction_store = interaction_store
+        self.interaction_versions = interaction_versions
+        self.user_index = user_index
+        self.batch_size = batch_size
+        self.max_lag = max_lag
+        self.max_pending = max_pending
+        self._pending: dict = {}
+        self._oldest: Optional[float] = None
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {'submitted': 0, 'coalesced': 0, 'written': 0, 'flushes': 0, 'flush_errors': 0}
+
+    async def submit(self, user_id, interaction: BaseInteractionSchema, add: bool):
+        """
+        The submit function queues a like/bookmark change and returns without waiting for Mongo.
+        When max_pending changes are already waiting, it flushes first so memory stays bounded.
+
+        :param self: Represent the instance of the class
+        :param user_id: The user interacting with the podcast
+        :param interaction: BaseInteractionSchema: The like or bookmark to add or remove
+        :param add: bool: True to add the action, False to remove it
+        """
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+        key = (interaction.podcast_id, user_id, interaction.action_type.value)
+        if key in self._pending:
+            self.counters['coalesced'] += 1
+            del self._pending[key]
+        self._pending[key] = (interaction.channel_id, add)
+        self.counters['submitted'] += 1
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending_state(self, user_id, podcast_id: int, action_type: str) -> Optional[bool]:
+        """
+        The pending_state function returns the not yet written state of an action, so this worker can
+        answer reads with its own writes.
+
+        :return: True or False for a pending add or removal, None when nothing is pending
+        """
+        change = self._pending.get((podcast_id, user_id, action_type))
+        return None if change is None else change[1]
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending, self._oldest = self._pending, {}, None
+            changes = [(user_id, channel_id, podcast_id, action_type, add)
+                       for (podcast_id, user_id, action_type), (channel_id, add) in batch.items()]
+            try:
+                await self.interaction_store.apply_actions(changes)
+            except BaseException:
+                self.counters['flush_errors'] += 1
+                # Put the batch back unless a newer change for the same key arrived meanwhile.
+                for key, change in batch.items():
+                    self._pending.setdefault(key, change)
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+                raise
+            self.counters['flushes'] += 1
+            self.counters['written'] += len(changes)
+            if self.user_index is not None and settings.USER_INDEX_ENABLED:
+                await self.user_index.apply(
+                    (user_id, podcast_id, action_type, add) for user_id, _, podcast_id, action_type, add in changes)
+            if self.interaction_versions is not None:
+                await self.interaction_versions.bump(
+                    (channel_id, podcast_id) for _, channel_id, podcast_id, _, _ in changes)
+
+    async def _run(self):
+        while True:
+            timeout = self.max_lag
+            if self._oldest is not None:
+                timeout = max(self._oldest + self.max_lag - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(min(self.max_lag, 1.0))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        lag = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+        return {**self.counters, 'pending': len(self._pending), 'current_lag': lag, 'max_lag': self.max_lag}
+
+
+@lru_cache
+def get_interaction_buffer():
+    return InteractionWriteBuffer(
+        get_interaction_store(),
+        batch_size=settings.INTERACTION_WRITE_BEHIND_BATCH_SIZE,
+        max_lag=settings.INTERACTION_WRITE_BEHIND_MAX_LAG,
+        max_pending=settings.INTERACTION_WRITE_BEHIND_MAX_PENDING,
+        interaction_versions=get_interaction_versions(),
+        user_index=get_user_index(),
+    )
@@ -0,0 +1,678 @@
+import asyncio
+import datetime
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, DeleteMany, DeleteOne, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from config.config import settings
+from db.mongo_db import get_mongo_db
+from schemas.interaction import ActionTypeEnum, BaseInteractionSchema, BulkOperationEnum, InteractionSchema
+from utils.profiling import traced
+
+ACTIONS_COLLECTION = 'podcast_interactions'
+COMMENTS_COLLECTION = 'podcast_comments'
+COUNTERS_COLLECTION = 'podcast_counters'
+LEGACY_COLLECTION = 'interaction'
+LEGACY_ACTION_TYPES = (ActionTypeEnum.like.value, ActionTypeEnum.book_mark.value)
+LEGACY_CLAIM_POLL_INTERVAL = 0.05
+DUPLICATE_KEY_ERROR = 11000
+
+COUNTER_FIELDS = {
+    ActionTypeEnum.like.value: 'likes_count',
+    ActionTypeEnum.book_mark.value: 'bookmarks_count',
+    ActionTypeEnum.comment.value: 'comments_count',
+}
+
+RECORDED = 'recorded'
+EXISTS = 'exists'
+REMOVED = 'removed'
+NOT_FOUND = 'not_found'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class InteractionStore:
+    """
+    Storage of user interactions with podcasts.
+
+    Likes and bookmarks are one small document per (podcast_id, user_id, action_type) in
+    podcast_interactions, comments are one document each in podcast_comments. Reads only touch the
+    documents of the requested podcasts, so their cost follows the page size instead of the channel's
+    popularity. podcast_counters keeps one document per podcast with the number of likes, bookmarks and
+    comments; it is bumped with $inc only after a write actually inserted or deleted something.
+
+    While the legacy one-document-per-channel collection still has documents (see db.migrate_interactions),
+    every read and write first migrates the legacy channels it touches, so no request sees a channel
+    half-moved or writes next to records that are still in the legacy layout.
+    """
+
+    def __init__(self, mongo_db):
+        self.mongo_db = mongo_db
+        self.actions = mongo_db[ACTIONS_COLLECTION]
+        self.comments = mongo_db[COMMENTS_COLLECTION]
+        self.counters = mongo_db[COUNTERS_COLLECTION]
+        self.legacy = mongo_db[LEGACY_COLLECTION]
+        self._legacy_done = False
+        self._legacy_checked_at = None
+        self._migrated_channels = set()
+        self._migrated_podcasts = set()
+        self._migrated_users = set()
+
+    async def create_indexes(self):
+        await self.actions.create_indexes([
+            IndexModel([('podcast_id', ASCENDING), ('user_id', ASCENDING), ('action_type', ASCENDING)],
+                       unique=True, name='podcast_user_action'),
+            IndexModel([('user_id', ASCENDING), ('action_type', ASCENDING), ('podcast_id', ASCENDING)],
+                       name='user_action_podcast'),
+            IndexModel([('user_id', ASCENDING), ('channel_id', ASCENDING)], name='user_channel'),
+        ])
+        await self.comments.create_indexes([
+            IndexModel([('podcast_id', ASCENDING), ('_id', DESCENDING)], name='podcast_newest'),
+            IndexModel([('user_id', ASCENDING), ('podcast_id', ASCENDING)], name='user_podcast'),
+            IndexModel([('legacy_id', ASCENDING)], unique=True, sparse=True, name='legacy_id'),
+        ])
+        await self.counters.create_indexes([
+            IndexModel([('channel_id', ASCENDING)], name='channel'),
+        ])
+
+    @staticmethod
+    def action_key(user_id, podcast_id: int, action_type: str) -> dict:
+        return {'podcast_id': podcast_id, 'user_id': user_id, 'action_type': action_type}
+
+    @staticmethod
+    def legacy_writes(legacy_doc: dict, now: datetime.datetime) -> tuple:
+        """
+        The legacy_writes function turns one legacy channel document, ``{"<podcast_id>": {"like": [...],
+        "book_mark": [...], "comment": [...]}}`` keyed by channel_id, into upserts for the new collections.
+
+        :param legacy_doc: dict: The legacy interaction document of a channel
+        :param now: datetime.datetime: Timestamp stored on the created records
+        :return: A tuple of (action writes, comment writes), each a list of (podcast_id, action_type, write)
+        """
+        channel_id = legacy_doc['_id']
+        action_writes, comment_writes = [], []
+        for podcast_key, podcast_doc in legacy_doc.items():
+            if podcast_key.startswith('_') or not isinstance(podcast_doc, dict):
+                continue
+            podcast_id = int(podcast_key)
+            for action_type in LEGACY_ACTION_TYPES:
+                for entry in podcast_doc.get(action_type, []):
+                    action_writes.append((podcast_id, action_type, UpdateOne(
+                        InteractionStore.action_key(entry['user_id'], podcast_id, action_type),
+                        {'$setOnInsert': {'channel_id': channel_id, 'created_at': now}},
+                        upsert=True,
+                    )))
+            for index, entry in enumerate(podcast_doc.get(ActionTypeEnum.comment.value, [])):
+                comment_writes.append((podcast_id, ActionTypeEnum.comment.value, UpdateOne(
+                    {'legacy_id': f'{channel_id}:{podcast_id}:{index}'},
+                    {'$setOnInsert': {
+                        'channel_id': channel_id,
+                        'podcast_id': podcast_id,
+                        'user_id': entry['user_id'],
+                        'content': entry.get('content', ''),
+                        'created_at': now,
+                    }},
+                    upsert=True,
+                )))
+        return action_writes, comment_writes
+
+    @staticmethod
+    async def _upsert(collection, writes: list) -> set:
+        """
+        Runs the upserts of a legacy document and returns the positions of the ones that inserted.
+        """
+        if not writes:
+            return set()
+        try:
+            result = await collection.bulk_write([write for *_, write in writes], ordered=False)
+            return set(result.upserted_ids)
+        except BulkWriteError as exc:
+            # Two upserts of the same key may race on the unique index; the record exists either way.
+            if any(error['code'] != DUPLICATE_KEY_ERROR for error in exc.details['writeErrors']):
+                raise
+            return {item['index'] for item in exc.details.get('upserted', [])}
+
+    async def migrate_legacy_channel(self, channel_id: int, wait: bool = True) -> bool:
+        """
+        The migrate_legacy_channel function moves the legacy document of one channel into the new collections.
+
+        The document is claimed first, so only one process copies it at a time and a record removed after
+        the copy cannot be copied back by a second migrator. The records are upserted, the counters are
+        bumped for the ones that were really inserted, then the document is deleted. A claim older than
+        LEGACY_MIGRATION_CLAIM_TIMEOUT is taken over, so a migrator that died does not block the channel.
+
+        :param self: Represent the instance of the class
+        :param channel_id: int: The channel to migrate
+        :param wait: bool: Wait while another process holds the channel instead of giving up
+        :return: True when the channel has no legacy document left, False when another process holds it
+        """
+        claim = ObjectId()
+        while True:
+            now = datetime.datetime.utcnow()
+            expired = now - datetime.timedelta(seconds=settings.LEGACY_MIGRATION_CLAIM_TIMEOUT)
+            legacy_doc = await self.legacy.find_one_and_update(
+                {'_id': channel_id, '$or': [{'_claimed_at': {'$exists': False}}, {'_claimed_at': {'$lt': expired}}]},
+                {'$set': {'_claim': claim, '_claimed_at': now}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if legacy_doc is not None:
+                break
+            if await self.legacy.find_one({'_id': channel_id}, {'_id': 1}) is None:
+                return True
+            if not wait:
+                return False
+            await asyncio.sleep(LEGACY_CLAIM_POLL_INTERVAL)
+
+        deltas = {}
+        for collection, writes in zip((self.actions, self.comments), self.legacy_writes(legacy_doc, now)):
+            for position in await self._upsert(collection, writes):
+                podcast_id, action_type, _ = writes[position]
+                self._add_delta(deltas, podcast_id, channel_id, action_type, 1)
+        await self._increment(deltas)
+        await self.legacy.delete_one({'_id': channel_id, '_claim': claim})
+        return True
+
+    async def _legacy_pending(self) -> bool:
+        if self._legacy_done:
+            return False
+        now = asyncio.get_running_loop().time()
+        interval = settings.LEGACY_MIGRATION_CHECK_INTERVAL
+        if self._legacy_checked_at is not None and now - self._legacy_checked_at < interval:
+            return True
+        self._legacy_checked_at = now
+        if await self.legacy.find_one({}, {'_id': 1}) is None:
+            # Nothing is written to the legacy layout any more, so once empty it stays empty.
+            self._legacy_done = True
+            self._migrated_channels.clear()
+            self._migrated_podcasts.clear()
+            self._migrated_users.clear()
+        return not self._legacy_done
+
+    async def _migrate_legacy(self, channel_ids: Iterable[int] = (), podcast_ids: Iterable[int] = (),
+                              user_id=None):
+        """
+        The _migrate_legacy function migrates the legacy channels that hold data of the given channels,
+        podcasts or user before a request reads or writes them. Channels, podcasts and users found migrated
+        are remembered, and the whole check stops once the legacy collection is empty.
+
+        The legacy layout is keyed by channel, so finding the channels of podcasts or of a user scans the
+        legacy collection; the scans shrink as the migration progresses and end with it.
+        """
+        if not await self._legacy_pending():
+            return
+        channel_ids = {channel_id for channel_id in channel_ids if channel_id not in self._migrated_channels}
+        podcast_ids = [podcast_id for podcast_id in podcast_ids if podcast_id not in self._migrated_podcasts]
+        scan_user = user_id is not None and user_id not in self._migrated_users
+        if not channel_ids and not podcast_ids and not scan_user:
+            return
+
+        candidates = []
+        if channel_ids:
+            candidates.append(self.legacy.find({'_id': {'$in': list(channel_ids)}}, {'_id': 1}).to_list(length=None))
+        if podcast_ids:
+            candidates.append(self.legacy.find({'$or': [{str(podcast_id): {'$exists': True}}
+                                                        for podcast_id in podcast_ids]},
+                                               {'_id': 1}).to_list(length=None))
+        if scan_user:
+            candidates.append(self.legacy.aggregate([
+                {'$project': {'podcasts': {'$objectToArray': '$$ROOT'}}},
+                {'$match': {'$or': [{f'podcasts.v.{action_type}.user_id': user_id}
+                                    for action_type in COUNTER_FIELDS]}},
+                {'$project': {'_id': 1}},
+            ]).to_list(length=None))
+        legacy_channels = {doc['_id'] for docs in await asyncio.gather(*candidates) for doc in docs}
+
+        # Shielded, so a request that gives up does not leave a claimed channel behind until the claim expires.
+        await asyncio.shield(asyncio.gather(*(self.migrate_legacy_channel(channel_id)
+                                              for channel_id in legacy_channels)))
+        self._migrated_channels.update(channel_ids | legacy_channels)
+        self._migrated_podcasts.update(podcast_ids)
+        if scan_user:
+            self._migrated_users.add(user_id)
+
+    @traced('mongo')
+    async def annotations(self, user_id, podcast_ids: Iterable[int] = None, channel_id: int = None) -> dict:
+        """
+        The annotations function computes the per-user flags and the counters of podcasts in Mongo.
+        One aggregation matches the user's actions and, through $unionWith, picks up the podcasts'
+        counter documents, so only one small document per podcast crosses the wire. The podcasts are
+        selected either by id (a page of items) or by channel, which lets the caller start the lookup
+        before it knows which podcasts the channel has.
+
+        :param self: Represent the instance of the class
+        :param user_id: The calling user
+        :param podcast_ids: Iterable[int]: The podcasts on the current page
+        :param channel_id: int: Annotate every podcast of the channel instead
+        :return: A dictionary mapping podcast_id to its liked and bookmarked flags and its counts
+        """
+        if channel_id is not None:
+            await self._migrate_legacy(channel_ids=[channel_id])
+            actions_scope, counters_scope = {'channel_id': channel_id}, {'channel_id': channel_id}
+        else:
+            podcast_ids = list(podcast_ids)
+            await self._migrate_legacy(podcast_ids=podcast_ids)
+            actions_scope, counters_scope = {'podcast_id': {'$in': podcast_ids}}, {'_id': {'$in': podcast_ids}}
+        counter_fields = {field: {'$ifNull': [f'${action_type}', 0]} for action_type, field in COUNTER_FIELDS.items()}
+        pipeline = [
+            {'$match': {'user_id': user_id, **actions_scope}},
+            {'$group': {
+                '_id': '$podcast_id',
+                'liked': {'$max': {'$eq': ['$action_type', ActionTypeEnum.like.value]}},
+                'bookmarked': {'$max': {'$eq': ['$action_type', ActionTypeEnum.book_mark.value]}},
+            }},
+            {'$unionWith': {'coll': COUNTERS_COLLECTION, 'pipeline': [
+                {'$match': counters_scope},
+                {'$project': counter_fields},
+            ]}},
+            {'$group': {
+                '_id': '$_id',
+                'liked': {'$max': '$liked'},
+                'bookmarked': {'$max': '$bookmarked'},
+                **{field: {'$sum': f'${field}'} for field in COUNTER_FIELDS.values()},
+            }},
+        ]
+        annotations = {}
+        async for doc in self.actions.aggregate(pipeline):
+            annotations[doc['_id']] = {
+                'liked': bool(doc.get('liked')),
+                'bookmarked': bool(doc.get('bookmarked')),
+                **{field: max(doc.get(field, 0), 0) for field in COUNTER_FIELDS.values()},
+            }
+        return annotations
+
+    @traced('mongo')
+    async def counts(self, podcast_ids: Iterable[int] = None, channel_id: int = None) -> dict:
+        """
+        The counts function reads the like, bookmark and comment counters of podcasts, selected by id or by channel.
+
+        :param self: Represent the instance of the class
+        :param podcast_ids: Iterable[int]: The podcasts on the current page
+        :param channel_id: int: Read the counters of every podcast of the channel instead
+        :return: A dictionary mapping podcast_id to its counts
+        """
+        if channel_id is not None:
+            await self._migrate_legacy(channel_ids=[channel_id])
+            scope = {'channel_id': channel_id}
+        else:
+            podcast_ids = list(podcast_ids)
+            await self._migrate_legacy(podcast_ids=podcast_ids)
+            scope = {'_id': {'$in': podcast_ids}}
+        counts = {}
+        async for doc in self.counters.find(scope):
+            counts[doc['_id']] = {field: max(doc.get(action_type, 0), 0)
+                                  for action_type, field in COUNTER_FIELDS.items()}
+        return counts
+
+    @traced('mongo')
+    async def user_actions(self, user_id, action_types: Iterable[str]) -> list:
+        """
+        The user_actions function lists the likes and/or bookmarks of a user, using the user_action_podcast index.
+
+        :param self: Represent the instance of the class
+        :param user_id: The user whose actions are listed
+        :param action_types: Iterable[str]: The action types to list
+        :return: A list of (podcast_id, action_type, created_at) tuples
+        """
+        await self._migrate_legacy(user_id=user_id)
+        cursor = self.actions.find({'user_id': user_id, 'action_type': {'$in': list(action_types)}},
+                                   {'_id': 0, 'podcast_id': 1, 'action_type': 1, 'created_at': 1})
+        return [(doc['podcast_id'], doc['action_type'], doc.get('created_at')) async for doc in cursor]
+
+    async def _increment(self, deltas: dict):
+        """
+        Applies {(podcast_id, channel_id): {action_type: amount}} to the counters with one bulk_write.
+        """
+        operations = []
+        for (podcast_id, channel_id), amounts in deltas.items():
+            amounts = {action_type: amount for action_type, amount in amounts.items() if amount}
+            if amounts:
+                operations.append(UpdateOne({'_id': podcast_id},
+                                            {'$inc': amounts, '$setOnInsert': {'channel_id': channel_id}},
+                                            upsert=True))
+        if operations:
+            await self.counters.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def _add_delta(deltas: dict, podcast_id: int, channel_id: int, action_type: str, amount: int):
+        amounts = deltas.setdefault((podcast_id, channel_id), {})
+        amounts[action_type] = amounts.get(action_type, 0) + amount
+
+    @staticmethod
+    def _comment_view(doc: dict) -> dict:
+        return {
+            'id': str(doc['_id']),
+            'user_id': doc['user_id'],
+            'content': doc.get('content', ''),
+            'created_at': doc.get('created_at'),
+        }
+
+    @traced('mongo')
+    async def latest_comments(self, podcast_ids: Iterable[int], limit: int) -> dict:
+        """
+        The latest_comments function returns a short preview of the newest comments of each podcast.
+        Every podcast is read with its own limited query on the (podcast_id, _id) index, so the cost
+        does not depend on how many comments a podcast has.
+
+        :param self: Represent the instance of the class
+        :param podcast_ids: Iterable[int]: The podcasts on the current page
+        :param limit: int: Number of comments per podcast
+        :return: A dictionary mapping podcast_id to its newest comments
+        """
+        podcast_ids = list(podcast_ids)
+        await self._migrate_legacy(podcast_ids=podcast_ids)
+        previews = await asyncio.gather(*(
+            self.comments.find({'podcast_id': podcast_id}).sort('_id', DESCENDING).limit(limit).to_list(length=limit)
+            for podcast_id in podcast_ids
+        ))
+        return {
+            podcast_id: [self._comment_view(doc) for doc in docs]
+            for podcast_id, docs in zip(podcast_ids, previews)
+        }
+
+    @traced('mongo')
+    async def list_comments(self, podcast_id: int, limit: int, before: Optional[ObjectId] = None):
+        """
+        The list_comments function returns one page of a podcast's comments, newest first.
+        Pages are keyed on _id (keyset pagination), so deep pages cost the same as the first one.
+
+        :param self: Represent the instance of the class
+        :param podcast_id: int: The podcast whose comments are listed
+        :param limit: int: The page size
+        :param before: ObjectId: The id of the last comment of the previous page
+        :return: A tuple of (comments, id of the last returned comment or None when there are no more)
+        """
+        await self._migrate_legacy(podcast_ids=[podcast_id])
+        query = {'podcast_id': podcast_id}
+        if before is not None:
+            query['_id'] = {'$lt': before}
+        docs = await self.comments.find(query).sort('_id', DESCENDING).limit(limit + 1).to_list(length=limit + 1)
+        has_more = len(docs) > limit
+        comments = [self._comment_view(doc) for doc in docs[:limit]]
+        next_cursor = comments[-1]['id'] if has_more else None
+        return comments, next_cursor
+
+    @traced('mongo')
+    async def add(self, user_id, interaction: InteractionSchema) -> bool:
+        """
+        The add function records an interaction of the user.
+
+        :param self: Represent the instance of the class
+        :param user_id: The user interacting with the podcast
+        :param interaction: InteractionSchema: The interaction to record
+        :return: False when a like/bookmark already existed, True otherwise
+        """
+        await self._migrate_legacy(channel_ids=[interaction.channel_id])
+        now = datetime.datetime.utcnow()
+        if interaction.action_type == ActionTypeEnum.comment:
+            await self.comments.insert_one({
+                'channel_id': interaction.channel_id,
+                'podcast_id': interaction.podcast_id,
+                'user_id': user_id,
+                'content': interaction.content,
+                'created_at': now,
+            })
+            recorded = True
+        else:
+            result = await self.actions.update_one(
+                self.action_key(user_id, interaction.podcast_id, interaction.action_type.value),
+                {'$setOnInsert': {'channel_id': interaction.channel_id, 'created_at': now}},
+                upsert=True,
+            )
+            recorded = result.upserted_id is not None
+
+        if recorded:
+            await self._increment({(interaction.podcast_id, interaction.channel_id): {
+                interaction.action_type.value: 1}})
+        return recorded
+
+    @traced('mongo')
+    async def remove(self, user_id, interaction: BaseInteractionSchema) -> bool:
+        await self._migrate_legacy(channel_ids=[interaction.channel_id])
+        if interaction.action_type == ActionTypeEnum.comment:
+            result = await self.comments.delete_many({'podcast_id': interaction.podcast_id, 'user_id': user_id})
+        else:
+            result = await self.actions.delete_one(
+                self.action_key(user_id, interaction.podcast_id, interaction.action_type.value))
+        if result.deleted_count:
+            await self._increment({(interaction.podcast_id, interaction.channel_id): {
+                interaction.action_type.value: -result.deleted_count}})
+        return result.deleted_count > 0
+
+    @traced('mongo')
+    async def apply_actions(self, changes: list):
+        """
+        The apply_actions function writes a batch of like/bookmark changes with one unordered bulk_write.
+        Removals are checked against the stored records first, so the counters only move for the
+        records that were really inserted or deleted.
+
+        :param self: Represent the instance of the class
+        :param changes: list: (user_id, channel_id, podcast_id, action_type, add) tuples, at most one per key
+        :return: The BulkWriteResult, or None for an empty batch
+        """
+        if not changes:
+            return None
+        await self._migrate_legacy(channel_ids=[channel_id for _, channel_id, *_ in changes])
+        now = datetime.datetime.utcnow()
+        removals = [self.action_key(user_id, podcast_id, action_type)
+                    for user_id, _, podcast_id, action_type, add in changes if not add]
+        existing = set()
+        if removals:
+            async for doc in self.actions.find({'$or': removals}, {'_id': 0, 'podcast_id': 1, 'user_id': 1,
+                                                                   'action_type': 1}):
+                existing.add((doc['podcast_id'], doc['user_id'], doc['action_type']))
+
+        operations = []
+        for user_id, channel_id, podcast_id, action_type, add in changes:
+            key = self.action_key(user_id, podcast_id, action_type)
+            if add:
+                operations.append(UpdateOne(key, {'$setOnInsert': {'channel_id': channel_id, 'created_at': now}},
+                                            upsert=True))
+            else:
+                operations.append(DeleteOne(key))
+
+        error = None
+        try:
+            result = await self.actions.bulk_write(operations, ordered=False)
+            upserted = set(result.upserted_ids)
+            failed = set()
+        except BulkWriteError as exc:
+            error, result = exc, None
+            upserted = {item['index'] for item in exc.details.get('upserted', [])}
+            failed = {item['index'] for item in exc.details['writeErrors']}
+
+        deltas = {}
+        for index, (user_id, channel_id, podcast_id, action_type, add) in enumerate(changes):
+            if add and index in upserted:
+                self._add_delta(deltas, podcast_id, channel_id, action_type, 1)
+            elif not add and index not in failed and (podcast_id, user_id, action_type) in existing:
+                self._add_delta(deltas, podcast_id, channel_id, action_type, -1)
+        await self._increment(deltas)
+        if error is not None:
+            raise error
+        return result
+
+    async def _existing_state(self, user_id, operations: list):
+        podcast_ids = list({operation.podcast_id for operation in operations})
+        actions = set()
+        if any(operation.action_type != ActionTypeEnum.comment for operation in operations):
+            async for doc in self.actions.find({'user_id': user_id, 'podcast_id': {'$in': podcast_ids}},
+                                               {'_id': 0, 'podcast_id': 1, 'action_type': 1}):
+                actions.add((doc['podcast_id'], doc['action_type']))
+        comment_counts = {}
+        if any(operation.action_type == ActionTypeEnum.comment and operation.op == BulkOperationEnum.remove
+               for operation in operations):
+            async for doc in self.comments.aggregate([
+                {'$match': {'user_id': user_id, 'podcast_id': {'$in': podcast_ids}}},
+                {'$group': {'_id': '$podcast_id', 'count': {'$sum': 1}}},
+            ]):
+                comment_counts[doc['_id']] = doc['count']
+        return actions, comment_counts
+
+    @staticmethod
+    def _batches(writes: list, ordered: bool) -> list:
+        """
+        Groups (request index, collection, write) triples into bulk_write batches. A BulkWriteResult only
+        counts deletions per call, so a deletion always ends its batch and its count is exactly what it
+        removed. With ordered=True a new batch also starts whenever the collection changes, so the writes
+        run in the order of the request; otherwise the inserts and upserts go in one batch per collection.
+        """
+        batches = []
+        open_batches = {}
+        for index, collection, write in writes:
+            deletion = isinstance(write, (DeleteOne, DeleteMany))
+            if ordered:
+                batch = batches[-1] if batches and batches[-1][0] is collection and not batches[-1][2] else None
+            else:
+                batch = None if deletion else open_batches.get(id(collection))
+            if batch is None:
+                batch = [collection, [], False]
+                batches.append(batch)
+                if not ordered and not deletion:
+                    open_batches[id(collection)] = batch
+            batch[1].append((index, write))
+            batch[2] = deletion
+        return [(collection, batch_writes) for collection, batch_writes, _ in batches]
+
+    @staticmethod
+    async def _execute(collection, writes: list, ordered: bool) -> tuple:
+        """
+        Runs one bulk_write of (request index, write) pairs.
+
+        An ordered batch stops at its first failed write, so only the writes before it count as applied.
+        When the whole call fails (network error, timeout), every write of the batch is reported failed.
+
+        :return: A tuple of (request indexes of the applied writes, {request index: error message} of the
+                 failed ones, request indexes of the upserts that inserted, number of deleted documents)
+        """
+        try:
+            result = await collection.bulk_write([write for _, write in writes], ordered=ordered)
+            return ([index for index, _ in writes], {}, {writes[position][0] for position in result.upserted_ids},
+                    result.deleted_count)
+        except BulkWriteError as exc:
+            errors = {error['index']: error.get('errmsg', '') for error in exc.details['writeErrors']}
+            attempted = writes[:min(errors) + 1] if ordered and errors else writes
+            return ([index for position, (index, _) in enumerate(attempted) if position not in errors],
+                    {writes[position][0]: message for position, message in errors.items()},
+                    {writes[item['index']][0] for item in exc.details.get('upserted', [])},
+                    exc.details.get('nRemoved', 0))
+        except PyMongoError as exc:
+            return [], {index: str(exc) for index, _ in writes}, set(), 0
+
+    @traced('mongo')
+    async def bulk(self, user_id, operations: list, ordered: bool = True) -> list:
+        """
+        The bulk function applies a list of add/remove operations of one user.
+
+        The current state of the touched podcasts is read once, so adds of actions that already exist and
+        removals of nothing are answered without a write. The outcome of every write comes from its result:
+        an add is RECORDED only when its upsert inserted and a removal is REMOVED only when it deleted
+        something, so concurrent requests never count the same change twice. With ordered=True the batches
+        run in the order of the request and the operations after the first failed write are skipped;
+        otherwise they run concurrently. The counters are bumped for the writes that were applied, even when
+        a later batch fails.
+
+        :param self: Represent the instance of the class
+        :param user_id: The user the operations belong to
+        :param operations: list: BulkInteractionOperationSchema items
+        :param ordered: bool: Stop at the first failed write
+        :return: One outcome (RECORDED, EXISTS, REMOVED, NOT_FOUND, FAILED or SKIPPED) per operation
+        """
+        await self._migrate_legacy(channel_ids=[operation.channel_id for operation in operations])
+        now = datetime.datetime.utcnow()
+        actions, comment_counts = await self._existing_state(user_id, operations)
+        outcomes = []
+        writes = []
+        for index, operation in enumerate(operations):
+            add = operation.op == BulkOperationEnum.add
+            if operation.action_type == ActionTypeEnum.comment:
+                if add:
+                    writes.append((index, self.comments, InsertOne({
+                        'channel_id': operation.channel_id,
+                        'podcast_id': operation.podcast_id,
+                        'user_id': user_id,
+                        'content': operation.content,
+                        'created_at': now,
+                    })))
+                    comment_counts[operation.podcast_id] = comment_counts.get(operation.podcast_id, 0) + 1
+                    outcomes.append(RECORDED)
+                elif comment_counts.get(operation.podcast_id):
+                    writes.append((index, self.comments, DeleteMany({'podcast_id': operation.podcast_id,
+                                                                     'user_id': user_id})))
+                    comment_counts.pop(operation.podcast_id)
+                    outcomes.append(REMOVED)
+                else:
+                    outcomes.append(NOT_FOUND)
+                continue
+
+            state_key = (operation.podcast_id, operation.action_type.value)
+            key = self.action_key(user_id, operation.podcast_id, operation.action_type.value)
+            if add and state_key in actions:
+                outcomes.append(EXISTS)
+            elif add:
+                writes.append((index, self.actions, UpdateOne(
+                    key, {'$setOnInsert': {'channel_id': operation.channel_id, 'created_at': now}}, upsert=True)))
+                actions.add(state_key)
+                outcomes.append(RECORDED)
+            elif state_key in actions:
+                writes.append((index, self.actions, DeleteOne(key)))
+                actions.discard(state_key)
+                outcomes.append(REMOVED)
+            else:
+                outcomes.append(NOT_FOUND)
+
+        failures = {}
+        deltas = {}
+
+        def apply(batch: list, applied: list, batch_failures: dict, upserted: set, deleted: int):
+            last_index, last_write = batch[-1]
+            for index in applied:
+                operation = operations[index]
+                if index == last_index and isinstance(last_write, (DeleteOne, DeleteMany)):
+                    amount = -deleted
+                elif operation.action_type == ActionTypeEnum.comment or index in upserted:
+                    amount = 1
+                else:
+                    amount = 0
+                if amount:
+                    self._add_delta(deltas, operation.podcast_id, operation.channel_id,
+                                    operation.action_type.value, amount)
+                elif outcomes[index] == RECORDED:
+                    outcomes[index] = EXISTS
+                else:
+                    outcomes[index] = NOT_FOUND
+            failures.update(batch_failures)
+
+        try:
+            batches = self._batches(writes, ordered)
+            if ordered:
+                for collection, batch in batches:
+                    apply(batch, *await self._execute(collection, batch, ordered))
+                    if failures:
+                        break
+            else:
+                results = await asyncio.gather(*(self._execute(collection, batch, ordered)
+                                                 for collection, batch in batches), return_exceptions=True)
+                for (_, batch), result in zip(batches, results):
+                    if not isinstance(result, BaseException):
+                        apply(batch, *result)
+                error = next((result for result in results if isinstance(result, BaseException)), None)
+                if error is not None:
+                    raise error
+        finally:
+            await self._increment(deltas)
+
+        stop_at = min(failures) if ordered and failures else len(operations)
+        for index in range(len(operations)):
+            if index in failures:
+                outcomes[index] = FAILED
+            elif index > stop_at:
+                outcomes[index] = SKIPPED
+        return outcomes
+
+
+@lru_cache
+def get_interaction_store():
+    return InteractionStore(get_mongo_db())
@@ -0,0 +1,118 @@
+import logging
+import time
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from fastapi import Request
+
+from redis.exceptions import RedisError
+
+from config.config import settings
+from db.redis_db import get_redis_client, prefetched_read
+
+KEY_PREFIX = 'interaction_version'
+# Set by a worker whose bump failed: while it exists, no worker builds ETags from the versions.
+UNCONFIRMED_KEY = f'{KEY_PREFIX}:unconfirmed'
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class InteractionVersions:
+    """
+    Redis counters bumped on every interaction write, one per channel and one per podcast.
+
+    They are part of the ETags of channel and podcast reads: a like, bookmark or comment changes the
+    counters and the writer's flags in those responses, so it must change their ETag as well. The keys
+    never expire; a lost key restarts from zero, which only costs clients one extra full response.
+
+    A bump that fails leaves the version unchanged, so a matching ETag would get a stale 304 from any
+    worker. The failing worker therefore sets UNCONFIRMED_KEY for INTERACTION_VERSION_UNCONFIRMED_TTL seconds,
+    read together with every version, which turns 304s off in all workers, and keeps the keys it could not
+    bump. It builds no ETag from those keys, retries them with its next bumps and reads (at least every half
+    TTL while it serves reads), and renews the flag on every failed retry. When Redis rejects the flag too,
+    the other workers usually cannot read the versions either and send full responses; a worker cut off
+    from Redis alone, with the others still reaching it, is the case this does not cover.
+    """
+
+    def __init__(self, redis_db):
+        self.redis_db = redis_db
+        self._unconfirmed = set()
+        self._retried_at = 0.0
+
+    @staticmethod
+    def channel_key(channel_id: int) -> str:
+        return f'{KEY_PREFIX}:channel:{channel_id}'
+
+    @staticmethod
+    def podcast_key(podcast_id: int) -> str:
+        return f'{KEY_PREFIX}:podcast:{podcast_id}'
+
+    @staticmethod
+    def version_read(key: str) -> tuple:
+        """
+        The version_read function returns the Redis read of a version, which also fetches UNCONFIRMED_KEY.
+        """
+        return 'MGET', key, UNCONFIRMED_KEY
+
+    async def bump(self, changes: Iterable[tuple]):
+        """
+        The bump function increments the versions of the channels and podcasts touched by writes.
+
+        :param self: Represent the instance of the class
+        :param changes: Iterable[tuple]: (channel_id, podcast_id) pairs of the written interactions
+        """
+        keys = set(self._unconfirmed)
+        for channel_id, podcast_id in changes:
+            keys.add(self.channel_key(channel_id))
+            keys.add(self.podcast_key(podcast_id))
+        if not keys:
+            return
+        self._retried_at = time.monotonic()
+        try:
+            async with self.redis_db.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.incr(key)
+                await pipe.execute()
+        except RedisError as exc:
+            if not keys <= self._unconfirmed:
+                logger.warning('Interaction version bump failed, not serving 304s for %d keys until a retry '
+                               'succeeds: %s', len(keys - self._unconfirmed), exc)
+            self._unconfirmed |= keys
+            try:
+                await self.redis_db.set(UNCONFIRMED_KEY, '1', ex=settings.INTERACTION_VERSION_UNCONFIRMED_TTL)
+            except RedisError:
+                pass
+            return
+        self._unconfirmed -= keys
+
+    async def _get(self, key: str, request: Optional[Request]) -> Optional[str]:
+        retry_due = time.monotonic() - self._retried_at >= settings.INTERACTION_VERSION_UNCONFIRMED_TTL / 2
+        if self._unconfirmed and (key in self._unconfirmed or retry_due):
+            await self.bump(())
+            if key in self._unconfirmed:
+                return None
+            # A value prefetched for this request was read before the retried bump.
+            request = None
+        try:
+            version, unconfirmed = await prefetched_read(self.redis_db, request, *self.version_read(key))
+        except RedisError:
+            return None
+        if unconfirmed is not None:
+            return None
+        return version or '0'
+
+    async def channel(self, channel_id: int, request: Request = None) -> Optional[str]:
+        """
+        The channel function reads the current version of a channel's interactions.
+
+        :return: The version, or None when Redis is unavailable and no ETag can be built
+        """
+        return await self._get(self.channel_key(channel_id), request)
+
+    async def podcast(self, podcast_id: int, request: Request = None) -> Optional[str]:
+        return await self._get(self.podcast_key(podcast_id), request)
+
+
+@lru_cache
+def get_interaction_versions():
+    return InteractionVersions(get_redis_client())
@@ -0,0 +1,69 @@
+from typing import Optional
+
+from fastapi import Request
+
+from config.config import settings
+from db.redis_db import RedisPrefetch
+from services.catalog_cache import CatalogCache, CHANNEL_ITEMS, PODCAST
+from services.interaction_versions import InteractionVersions
+from services.user_index import UserInteractionIndex, INDEXED_ACTIONS
+
+
+def _user_index_plan(user_id, podcast_ids: tuple = ()) -> list:
+    if not settings.USER_INDEX_ENABLED or not user_id:
+        return []
+    plan = [('EXISTS', UserInteractionIndex.built_key(user_id))]
+    if podcast_ids:
+        plan.extend(('ZMSCORE', UserInteractionIndex.set_key(user_id, action_type), *podcast_ids)
+                    for action_type in INDEXED_ACTIONS)
+    return plan
+
+
+def _channel_items_plan(path_params: dict, user_id) -> list:
+    channel_id = path_params['channel_id']
+    plan = [InteractionVersions.version_read(InteractionVersions.channel_key(channel_id))]
+    if settings.CATALOG_CACHE_ENABLED and not settings.CATALOG_MIRROR_ENABLED:
+        plan.append(('HGETALL', CatalogCache.cache_key(CHANNEL_ITEMS, channel_id)))
+    # The channel's podcast ids are only known once its items are loaded, so only the marker is read here.
+    return plan + _user_index_plan(user_id)
+
+
+def _podcast_plan(path_params: dict, user_id) -> list:
+    podcast_id = path_params['podcast_id']
+    plan = [InteractionVersions.version_read(InteractionVersions.podcast_key(podcast_id))]
+    if settings.CATALOG_CACHE_ENABLED and not settings.CATALOG_MIRROR_ENABLED:
+        plan.append(('HGETALL', CatalogCache.cache_key(PODCAST, podcast_id)))
+    try:
+        podcast_ids = (int(podcast_id),)
+    except ValueError:
+        podcast_ids = ()
+    return plan + _user_index_plan(user_id, podcast_ids)
+
+
+# The Redis reads each authenticated route makes, keyed by route path.
+ROUTE_PLANS = {
+    '/api/v1/channels/{channel_id}': _channel_items_plan,
+    '/api/v1/podcasts/{podcast_id}': _podcast_plan,
+}
+
+
+def prepare_prefetch(request: Request, redis_db, user_id=None) -> Optional[RedisPrefetch]:
+    """
+    The prepare_prefetch function attaches a RedisPrefetch to the request, filled with the reads its route makes.
+    The caller adds its own reads (the token key) and executes it.
+
+    :param request: Request: The incoming request, already routed
+    :param redis_db: The redis client
+    :param user_id: The authenticated user, for the reads of their interaction index
+    :return: The prefetch, not executed yet, or None when REDIS_PREFETCH_ENABLED is off
+    """
+    if not settings.REDIS_PREFETCH_ENABLED:
+        return None
+    prefetch = RedisPrefetch(redis_db)
+    route = request.scope.get('route')
+    plan = ROUTE_PLANS.get(getattr(route, 'path', None))
+    if plan is not None:
+        for read in plan(request.path_params, user_id):
+            prefetch.add(*read)
+    request.state.redis_prefetch = prefetch
+    return prefetch
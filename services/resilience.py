@@ -0,0 +1,149 @@
+import bisect
+import random
+import time
+from collections import deque
+from typing import Optional
+
+from utils.metrics import upstream_circuit_state
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one upstream endpoint.
+
+    It opens after failure_threshold consecutive failures and then rejects calls right away for
+    recovery_timeout seconds. After that it lets half_open_max_calls probe calls through: one success closes
+    it again, one failure re-opens it. Probes that never report back (e.g. cancelled hedges) are forgotten
+    after another recovery_timeout so the breaker cannot get stuck half-open.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float, half_open_max_calls: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self._failures = 0
+        self._changed_at = time.monotonic()
+        self._probes = 0
+        self.counters = {'rejected': 0, 'opened': 0}
+        upstream_circuit_state.set(name, value=STATE_VALUES[CLOSED])
+
+    def _transition(self, state: str):
+        self.state = state
+        self._changed_at = time.monotonic()
+        self._probes = 0
+        if state == OPEN:
+            self.counters['opened'] += 1
+        upstream_circuit_state.set(self.name, value=STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == OPEN and now - self._changed_at >= self.recovery_timeout:
+            self._transition(HALF_OPEN)
+        elif self.state == HALF_OPEN and now - self._changed_at >= self.recovery_timeout:
+            self._changed_at, self._probes = now, 0
+
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        self.counters['rejected'] += 1
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        if self.state != CLOSED:
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+            self._transition(OPEN)
+
+    def stats(self) -> dict:
+        return {'state': self.state, 'consecutive_failures': self._failures,
+                'seconds_in_state': time.monotonic() - self._changed_at, **self.counters}
+
+
+class RetryBudget:
+    """
+    Caps retries (and hedged requests) at a fraction of the regular traffic.
+
+    Every request deposits ratio tokens and every retry withdraws one, so a struggling upstream sees at most
+    (1 + ratio) times the normal load instead of a retry storm. min_per_second tokens are added over time so
+    a quiet endpoint can still retry.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float = None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens if max_tokens is not None else max(10.0, min_per_second * 10)
+        self._tokens = self.max_tokens
+        self._refilled_at = time.monotonic()
+        self.counters = {'deposits': 0, 'withdrawn': 0, 'exhausted': 0}
+
+    def _refill(self, amount: float):
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def deposit(self):
+        self.counters['deposits'] += 1
+        self._refill(self.ratio)
+
+    def try_withdraw(self) -> bool:
+        now = time.monotonic()
+        self._refill((now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            self.counters['withdrawn'] += 1
+            return True
+        self.counters['exhausted'] += 1
+        return False
+
+    def stats(self) -> dict:
+        return {'tokens': round(self._tokens, 2), 'max_tokens': self.max_tokens, **self.counters}
+
+
+class LatencyWindow:
+    """
+    The latencies of the last size successful calls, kept sorted to read percentiles cheaply.
+    """
+
+    def __init__(self, size: int = 200):
+        self._recent = deque(maxlen=size)
+        self._sorted = []
+
+    def add(self, latency: float):
+        if len(self._recent) == self._recent.maxlen:
+            oldest = self._recent[0]
+            del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+        self._recent.append(latency)
+        bisect.insort(self._sorted, latency)
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self._sorted:
+            return None
+        return self._sorted[min(len(self._sorted) - 1, int(len(self._sorted) * fraction))]
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    The backoff_delay function returns an exponential backoff delay with full jitter.
+
+    :param attempt: int: The retry number, starting at 1
+    :param base: float: Delay ceiling of the first retry
+    :param cap: float: Largest delay ceiling
+    :return: A random delay in seconds
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
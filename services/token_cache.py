@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from redis.exceptions import RedisError
+
+from config.config import settings
+from db.redis_db import get_redis_client
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of access tokens that already passed signature verification and the Redis check.
+
+    An entry lives until the token's exp or for TOKEN_CACHE_MAX_STALENESS seconds, whichever comes first,
+    so a revoked token is accepted for at most that long even if the revocation message is lost.
+    Revocations published on TOKEN_REVOCATION_CHANNEL drop the entries of the jti right away.
+    """
+
+    def __init__(self, max_size: int, max_staleness: float):
+        self.max_size = max_size
+        self.max_staleness = max_staleness
+        self._entries: OrderedDict = OrderedDict()
+        self._tokens_by_jti: dict = {}
+        self.counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, token: str) -> Optional[dict]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.counters['misses'] += 1
+            return None
+        payload, expires_at = entry
+        if expires_at <= time.monotonic():
+            self.counters['expired'] += 1
+            self._discard(token)
+            return None
+        self._entries.move_to_end(token)
+        self.counters['hits'] += 1
+        return payload
+
+    def put(self, token: str, payload: dict):
+        lifetime = self.max_staleness
+        exp = payload.get('exp')
+        if isinstance(exp, (int, float)):
+            lifetime = min(lifetime, exp - time.time())
+        if lifetime <= 0:
+            return
+
+        self._discard(token)
+        self._entries[token] = (payload, time.monotonic() + lifetime)
+        self._tokens_by_jti.setdefault(payload.get('jti'), set()).add(token)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.counters['evictions'] += 1
+
+    def _discard(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        jti = entry[0].get('jti')
+        tokens = self._tokens_by_jti.get(jti)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_jti[jti]
+
+    def invalidate_jti(self, jti: str):
+        for token in list(self._tokens_by_jti.get(jti, ())):
+            self._discard(token)
+            self.counters['invalidations'] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_jti.clear()
+
+    def stats(self) -> dict:
+        lookups = self.counters['hits'] + self.counters['misses'] + self.counters['expired']
+        return {
+            **self.counters,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'max_staleness': self.max_staleness,
+            'hit_ratio': self.counters['hits'] / lookups if lookups else 0.0,
+        }
+
+
+async def publish_revocation(redis, jti: str):
+    """
+    The publish_revocation function tells every worker to forget the cached validation of a jti.
+    Call it right after deleting the token's user_{id} || {jti} key.
+
+    :param redis: The redis client
+    :param jti: str: The jti of the revoked token
+    """
+    await redis.publish(settings.TOKEN_REVOCATION_CHANNEL, jti)
+
+
+async def listen_for_revocations(redis, cache: TokenCache):
+    """
+    The listen_for_revocations function drops cached tokens as revocations arrive on the pub/sub channel.
+    Revocations may be missed while the subscription is down, so the whole cache is cleared every time
+    the listener (re)connects.
+
+    :param redis: The redis client
+    :param cache: TokenCache: The cache to invalidate
+    """
+    backoff = 0.5
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(settings.TOKEN_REVOCATION_CHANNEL)
+            cache.clear()
+            backoff = 0.5
+            while True:
+                # A bounded wait instead of listen(): a blocking read would trip REDIS_SOCKET_TIMEOUT
+                # on a quiet channel and force a reconnect (and a cache clear) every time.
+                message = await pubsub.get_message(timeout=1.0)
+                if message is not None and message['type'] == 'message':
+                    cache.invalidate_jti(message['data'])
+        except RedisError:
+            cache.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+        finally:
+            await pubsub.close()
+
+
+@lru_cache
+def get_token_cache():
+    return TokenCache(settings.TOKEN_CACHE_MAX_SIZE, settings.TOKEN_CACHE_MAX_STALENESS)
+
+
+def start_revocation_listener() -> Optional[asyncio.Task]:
+    if not settings.TOKEN_CACHE_ENABLED:
+        return None
+    return asyncio.create_task(listen_for_revocations(get_redis_client(), get_token_cache()))
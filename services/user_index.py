@@ -0,0 +1,263 @@
+import asyncio
+import datetime
+import time
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from fastapi import Request
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError, WatchError
+
+from config.config import settings
+from db.redis_db import get_redis_client, get_request_prefetch, prefetched_read, MISSING
+from schemas.interaction import ActionTypeEnum
+from services.interaction_store import get_interaction_store
+
+KEY_PREFIX = 'user_index'
+FLAGS = {ActionTypeEnum.like.value: 'liked', ActionTypeEnum.book_mark.value: 'bookmarked'}
+INDEXED_ACTIONS = tuple(FLAGS)
+REBUILD_ATTEMPTS = 3
+
+
+class UserInteractionIndex:
+    """
+    Per-user index of the liked and bookmarked podcasts, kept in Redis next to podcast_interactions.
+
+    Each action type of a user is a sorted set of podcast ids scored by the time of the action, so the flags
+    of a page are one ZMSCORE per set and "my likes" pages are score ranges. The index is only trusted once
+    the user's built marker exists: writes update it right after the Mongo write, and a rebuild replaces it
+    with the user's documents from Mongo. A rebuild WATCHes the user's write counter, which every write
+    increments, so a write landing between the Mongo read and the replacement makes it start over instead
+    of being lost. All keys of a user expire together USER_INDEX_TTL seconds after the last write or rebuild.
+    """
+
+    def __init__(self, redis_db, interaction_store, ttl: int):
+        self.redis_db = redis_db
+        self.interaction_store = interaction_store
+        self.ttl = ttl
+        self.counters = {'hits': 0, 'misses': 0, 'rebuilds': 0, 'rebuild_conflicts': 0, 'rebuild_errors': 0,
+                         'write_errors': 0}
+        self._rebuilding = {}
+        self._tasks = set()
+
+    @staticmethod
+    def set_key(user_id, action_type: str) -> str:
+        return f'{KEY_PREFIX}:{user_id}:{action_type}'
+
+    @staticmethod
+    def built_key(user_id) -> str:
+        return f'{KEY_PREFIX}:{user_id}:built'
+
+    @staticmethod
+    def writes_key(user_id) -> str:
+        return f'{KEY_PREFIX}:{user_id}:writes'
+
+    def _expire(self, pipe, user_id):
+        for action_type in INDEXED_ACTIONS:
+            pipe.expire(self.set_key(user_id, action_type), self.ttl)
+        pipe.expire(self.built_key(user_id), self.ttl)
+        pipe.expire(self.writes_key(user_id), self.ttl)
+
+    async def apply(self, changes: Iterable[tuple]):
+        """
+        The apply function records like/bookmark changes that were written to Mongo; comments are ignored.
+        If Redis fails halfway, the built markers of the users are dropped so their next read rebuilds.
+
+        :param self: Represent the instance of the class
+        :param changes: Iterable[tuple]: (user_id, podcast_id, action_type, add) tuples
+        """
+        changes = [change for change in changes if change[2] in FLAGS]
+        if not changes:
+            return
+        now = time.time()
+        users = {user_id for user_id, _, _, _ in changes}
+        try:
+            async with self.redis_db.pipeline(transaction=True) as pipe:
+                for user_id, podcast_id, action_type, add in changes:
+                    if add:
+                        pipe.zadd(self.set_key(user_id, action_type), {podcast_id: now}, nx=True)
+                    else:
+                        pipe.zrem(self.set_key(user_id, action_type), podcast_id)
+                for user_id in users:
+                    pipe.incr(self.writes_key(user_id))
+                    self._expire(pipe, user_id)
+                await pipe.execute()
+        except RedisError:
+            self.counters['write_errors'] += 1
+            try:
+                await self.redis_db.delete(*(self.built_key(user_id) for user_id in users))
+            except RedisError:
+                pass
+
+    async def rebuild(self, user_id) -> bool:
+        """
+        The rebuild function replaces the index of a user with the likes and bookmarks stored in Mongo.
+
+        :param self: Represent the instance of the class
+        :param user_id: The user whose index is rebuilt
+        :return: True when the index was rebuilt, False when Redis or Mongo failed or writes kept racing it
+        """
+        for _ in range(REBUILD_ATTEMPTS):
+            try:
+                async with self.redis_db.pipeline(transaction=True) as pipe:
+                    await pipe.watch(self.writes_key(user_id))
+                    actions = await self.interaction_store.user_actions(user_id, INDEXED_ACTIONS)
+                    members = {action_type: {} for action_type in INDEXED_ACTIONS}
+                    for podcast_id, action_type, created_at in actions:
+                        members[action_type][podcast_id] = (
+                            created_at.replace(tzinfo=datetime.timezone.utc).timestamp() if created_at else 0)
+
+                    pipe.multi()
+                    pipe.delete(*(self.set_key(user_id, action_type) for action_type in INDEXED_ACTIONS))
+                    for action_type, scores in members.items():
+                        if scores:
+                            pipe.zadd(self.set_key(user_id, action_type), scores)
+                    pipe.set(self.built_key(user_id), 1)
+                    self._expire(pipe, user_id)
+                    await pipe.execute()
+                self.counters['rebuilds'] += 1
+                return True
+            except WatchError:
+                self.counters['rebuild_conflicts'] += 1
+            except (RedisError, PyMongoError):
+                self.counters['rebuild_errors'] += 1
+                return False
+        return False
+
+    def _start_rebuild(self, user_id) -> asyncio.Task:
+        task = self._rebuilding.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self.rebuild(user_id))
+            self._rebuilding[user_id] = task
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: self._rebuilding.pop(user_id, None))
+        return task
+
+    async def ensure_built(self, user_id, request: Request = None) -> bool:
+        """
+        The ensure_built function waits until the index of a user is usable, rebuilding it when needed.
+        Concurrent callers for the same user share one rebuild.
+
+        :return: False when the index cannot be built right now
+        """
+        if await self.is_built(user_id, request):
+            return True
+        return await asyncio.shield(self._start_rebuild(user_id))
+
+    async def is_built(self, user_id, request: Request = None) -> bool:
+        try:
+            return bool(await prefetched_read(self.redis_db, request, 'EXISTS', self.built_key(user_id)))
+        except RedisError:
+            return False
+
+    async def ready(self, user_id, request: Request = None) -> bool:
+        """
+        The ready function tells whether the index of a user can be read now. When it cannot, a rebuild is
+        started in the background and the caller reads Mongo this time.
+
+        :param self: Represent the instance of the class
+        :param user_id: The calling user
+        :param request: Request: The request whose prefetched reads may hold the built marker
+        :return: True when the index is built
+        """
+        if await self.is_built(user_id, request):
+            self.counters['hits'] += 1
+            return True
+        self.counters['misses'] += 1
+        self._start_rebuild(user_id)
+        return False
+
+    async def flags(self, user_id, podcast_ids: Iterable[int], request: Request = None) -> Optional[dict]:
+        """
+        The flags function reads whether the user liked and bookmarked each podcast, with one ZMSCORE per action
+        type (taken from the request's prefetched reads when they are there).
+
+        :param self: Represent the instance of the class
+        :param user_id: The calling user
+        :param podcast_ids: Iterable[int]: The podcasts on the current page
+        :param request: Request: The request whose prefetched reads may hold the lookups
+        :return: A dictionary mapping podcast_id to its liked and bookmarked flags, or None when Redis failed
+        """
+        podcast_ids = list(podcast_ids)
+        if not podcast_ids:
+            return {}
+        reads = [('ZMSCORE', self.set_key(user_id, action_type), *podcast_ids) for action_type in INDEXED_ACTIONS]
+        prefetch = get_request_prefetch(request)
+        replies = [prefetch.get(*read) if prefetch is not None else MISSING for read in reads]
+        if any(reply is MISSING for reply in replies):
+            try:
+                async with self.redis_db.pipeline(transaction=False) as pipe:
+                    for read in reads:
+                        pipe.execute_command(*read)
+                    replies = await pipe.execute()
+            except RedisError:
+                return None
+
+        flags = {podcast_id: {} for podcast_id in podcast_ids}
+        for action_type, scores in zip(INDEXED_ACTIONS, replies):
+            for podcast_id, score in zip(podcast_ids, scores):
+                flags[podcast_id][FLAGS[action_type]] = score is not None
+        return flags
+
+    async def page(self, user_id, action_type: str, limit: int, cursor: Optional[str] = None):
+        """
+        The page function returns one page of the podcasts a user liked or bookmarked, newest first.
+        The cursor holds the score and id of the last returned podcast; podcasts with the same score are
+        ordered by id the way Redis orders them, so none is skipped or repeated.
+
+        :param self: Represent the instance of the class
+        :param user_id: The user whose podcasts are listed
+        :param action_type: str: like or book_mark
+        :param limit: int: The page size
+        :param cursor: Optional[str]: The next_cursor of the previous page
+        :return: A tuple of (items, cursor of the next page or None when there are no more)
+        :raises ValueError: When the cursor is malformed
+        """
+        key = self.set_key(user_id, action_type)
+        if cursor:
+            last_score, last_member = cursor.split(':', 1)
+            last_score = float(last_score)
+            ties = await self.redis_db.zcount(key, last_score, last_score)
+            rows = await self.redis_db.zrevrangebyscore(key, last_score, '-inf', start=0, num=limit + 1 + ties,
+                                                        withscores=True)
+            rows = [(member, score) for member, score in rows if score != last_score or member < last_member]
+        else:
+            rows = await self.redis_db.zrevrangebyscore(key, '+inf', '-inf', start=0, num=limit + 1,
+                                                        withscores=True)
+
+        items = [{'podcast_id': int(member), 'created_at': datetime.datetime.utcfromtimestamp(score)}
+                 for member, score in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            member, score = rows[limit - 1]
+            next_cursor = f'{score!r}:{member}'
+        return items, next_cursor
+
+    async def purge(self) -> int:
+        deleted = 0
+        batch = []
+        async for key in self.redis_db.scan_iter(match=f'{KEY_PREFIX}:*', count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                deleted += await self.redis_db.delete(*batch)
+                batch = []
+        if batch:
+            deleted += await self.redis_db.delete(*batch)
+        return deleted
+
+    def stats(self) -> dict:
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {**self.counters, 'rebuilding': len(self._rebuilding),
+                'hit_ratio': self.counters['hits'] / lookups if lookups else 0.0}
+
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+@lru_cache
+def get_user_index():
+    return UserInteractionIndex(get_redis_client(), get_interaction_store(), settings.USER_INDEX_TTL)
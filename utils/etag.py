@@ -0,0 +1,33 @@
+import hashlib
+from typing import Optional
+
+
+def content_version(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def build_etag(*parts) -> str:
+    """
+    The build_etag function derives a strong ETag from the versions a response was built from.
+
+    :param parts: The catalog version, interaction versions and anything else the body depends on
+    :return: The quoted ETag value
+    """
+    return '"' + content_version('|'.join(str(part) for part in parts).encode()) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    The etag_matches function checks an If-None-Match header against the current ETag.
+    If-None-Match uses the weak comparison, so a W/ prefix sent back by a proxy still matches.
+
+    :param if_none_match: Optional[str]: The If-None-Match header of the request
+    :param etag: str: The ETag of the current representation
+    :return: True when the client already holds the current representation
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (candidate.strip() for candidate in if_none_match.split(','))
+    return any(candidate.removeprefix('W/') == etag for candidate in candidates)
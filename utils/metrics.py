@@ -0,0 +1,347 @@
+import bisect
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from config.config import settings
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = 'metrics.lock'
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _merge_metrics(merged: dict, metrics: dict, include_gauges: bool):
+    """
+    Adds the metrics of one snapshot to merged: counter and gauge values are summed, histogram buckets,
+    sums and counts are added up.
+    """
+    for name, metric in metrics.items():
+        if metric['kind'] == 'gauge' and not include_gauges:
+            continue
+        target = merged.setdefault(name, {**metric, 'values': []})
+        values = dict((tuple(key), value) for key, value in target['values'])
+        for key, value in metric['values']:
+            key = tuple(key)
+            if key not in values:
+                values[key] = value
+            elif metric['kind'] == 'histogram':
+                current = values[key]
+                values[key] = [[a + b for a, b in zip(current[0], value[0])],
+                               current[1] + value[1], current[2] + value[2]]
+            else:
+                values[key] = values[key] + value
+        target['values'] = [[list(key), value] for key, value in values.items()]
+
+
+def _read_json(path: str):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(tmp_path, path)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'kind': self.kind, 'labels': list(self.label_names),
+                    'values': [[list(key), value] for key, value in self._values.items()]}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'kind': self.kind, 'labels': list(self.label_names), 'buckets': list(self.buckets),
+                    'values': [[list(key), [list(state[0]), state[1], state[2]]] for key, state in self._values.items()]}
+
+
+class MetricsRegistry:
+    """
+    In-process registry of counters, gauges and histograms rendered in the Prometheus text format.
+
+    Every metric is updated under its own lock, since pymongo reports command timings from motor's
+    worker threads. With several uvicorn workers each process only sees its own requests, so when
+    multiprocess_dir is set every worker dumps its snapshot there (periodically and before serving a
+    scrape) and render() merges the snapshots of all workers; unless given, the directory is read from
+    METRICS_MULTIPROC_DIR on first use. When a worker has exited, its counters and histograms are folded
+    into one archive file and its snapshot is deleted, so totals never go backwards and the directory does
+    not grow with restarts; its gauges are dropped. A worker whose pid was used before archives the
+    snapshot left under that pid before it writes its own.
+    """
+
+    def __init__(self, multiprocess_dir: str = None):
+        self._multiprocess_dir = multiprocess_dir
+        self._metrics: dict = {}
+        self._pid = None
+        self._token = None
+
+    @property
+    def multiprocess_dir(self) -> str:
+        if self._multiprocess_dir is None:
+            return settings.METRICS_MULTIPROC_DIR
+        return self._multiprocess_dir
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def snapshot(self) -> dict:
+        return {
+            name: {**metric.snapshot(), 'help': metric.documentation}
+            for name, metric in self._metrics.items()
+        }
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiprocess_dir, f'metrics_{pid}.json')
+
+    def write_snapshot(self):
+        if not self.multiprocess_dir:
+            return
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        pid = os.getpid()
+        path = self._snapshot_path(pid)
+        if self._pid != pid:
+            # The first snapshot of this process: a file under its pid was left by an exited process.
+            self._pid, self._token = pid, uuid.uuid4().hex
+            if os.path.exists(path):
+                with self._directory_lock():
+                    self._archive([path])
+        _write_json(path, {'pid': pid, 'token': self._token, 'metrics': self.snapshot()})
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @contextmanager
+    def _directory_lock(self):
+        with open(os.path.join(self.multiprocess_dir, LOCK_FILE), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _archive(self, paths: list):
+        """
+        Folds the counters and histograms of exited workers' snapshots into the archive, then deletes the
+        snapshots. Must run under _directory_lock. The archive remembers which snapshots it holds, so a
+        snapshot whose deletion did not happen is not counted twice.
+        """
+        archive_path = os.path.join(self.multiprocess_dir, ARCHIVE_FILE)
+        archive = _read_json(archive_path) or {'metrics': {}, 'folded': []}
+        folded = {identity for identity in archive['folded']
+                  if os.path.exists(self._snapshot_path(int(identity.split(':', 1)[0])))}
+        archived = []
+        for path in paths:
+            snapshot = _read_json(path)
+            if snapshot is None:
+                # Already archived by another worker.
+                continue
+            identity = f"{snapshot['pid']}:{snapshot.get('token')}"
+            if identity not in folded:
+                _merge_metrics(archive['metrics'], snapshot['metrics'], include_gauges=False)
+                folded.add(identity)
+            archived.append(path)
+        archive['folded'] = sorted(folded)
+        _write_json(archive_path, archive)
+        for path in archived:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _collect(self) -> dict:
+        if not self.multiprocess_dir:
+            return self.snapshot()
+
+        self.write_snapshot()
+        snapshots, dead = [], []
+        for path in glob.glob(os.path.join(self.multiprocess_dir, 'metrics_*.json')):
+            snapshot = _read_json(path)
+            if snapshot is None:
+                continue
+            if self._is_alive(snapshot['pid']):
+                snapshots.append(snapshot)
+            else:
+                dead.append(path)
+        if dead:
+            with self._directory_lock():
+                self._archive(dead)
+
+        merged: dict = {}
+        archive = _read_json(os.path.join(self.multiprocess_dir, ARCHIVE_FILE))
+        if archive is not None:
+            _merge_metrics(merged, archive['metrics'], include_gauges=False)
+        for snapshot in snapshots:
+            _merge_metrics(merged, snapshot['metrics'], include_gauges=True)
+        return merged
+
+    def render(self) -> str:
+        lines = []
+        for name, metric in sorted(self._collect().items()):
+            lines.append(f'# HELP {name} {metric["help"]}')
+            lines.append(f'# TYPE {name} {metric["kind"]}')
+            label_names = tuple(metric['labels'])
+            for key, value in metric['values']:
+                key = tuple(key)
+                if metric['kind'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(label_names, key)} {_format_value(value)}')
+                    continue
+                bucket_counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(metric['buckets']) + [float('inf')], bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(label_names, key, f'le="{_format_value(bound)}"')
+                    lines.append(f'{name}_bucket{labels} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(label_names, key)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(label_names, key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    'http_requests_total', 'HTTP requests served.', ('method', 'route', 'status'))
+http_request_duration_seconds = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency per route template.', ('method', 'route'))
+http_requests_in_flight = registry.gauge(
+    'http_requests_in_flight', 'HTTP requests being served.', ('method',))
+admission_limit = registry.gauge(
+    'admission_limit', 'Adaptive concurrency limit of the admission controller.')
+admission_in_flight = registry.gauge(
+    'admission_in_flight', 'Admitted requests in flight per route class.', ('route_class',))
+admission_queue_seconds = registry.histogram(
+    'admission_queue_seconds', 'Time requests waited in the admission queue.', ('route_class',))
+admission_rejections_total = registry.counter(
+    'admission_rejections_total', 'Requests shed by the admission controller.', ('route_class', 'reason'))
+upstream_requests_total = registry.counter(
+    'upstream_requests_total', 'Requests sent to the Django catalog service by outcome.', ('endpoint', 'outcome'))
+upstream_request_duration_seconds = registry.histogram(
+    'upstream_request_duration_seconds', 'Django catalog request latency.', ('endpoint',))
+upstream_circuit_state = registry.gauge(
+    'upstream_circuit_state', 'Circuit breaker state per upstream endpoint (0 closed, 1 half-open, 2 open); '
+    'summed over the workers when several are running.', ('endpoint',))
+upstream_circuit_rejections_total = registry.counter(
+    'upstream_circuit_rejections_total', 'Upstream calls rejected by an open circuit breaker.', ('endpoint',))
+upstream_retries_total = registry.counter(
+    'upstream_retries_total', 'Upstream calls retried after a transient failure.', ('endpoint',))
+upstream_hedged_requests_total = registry.counter(
+    'upstream_hedged_requests_total', 'Hedged upstream requests by the attempt that answered first.',
+    ('endpoint', 'winner'))
+mongo_command_duration_seconds = registry.histogram(
+    'mongo_command_duration_seconds', 'MongoDB command latency.', ('command', 'collection'))
+mongo_command_failures_total = registry.counter(
+    'mongo_command_failures_total', 'Failed MongoDB commands.', ('command', 'collection'))
+redis_command_duration_seconds = registry.histogram(
+    'redis_command_duration_seconds', 'Redis command latency; pipelines are timed as one PIPELINE command.',
+    ('command',))
+
+worker_startup_seconds = registry.gauge(
+    'worker_startup_seconds', 'Seconds from worker process start until it was ready to serve.', ('pid',))
+worker_resident_memory_bytes = registry.gauge(
+    'worker_resident_memory_bytes', 'Resident memory of the worker process.', ('pid',))
+worker_max_resident_memory_bytes = registry.gauge(
+    'worker_max_resident_memory_bytes', 'Peak resident memory of the worker process.', ('pid',))
+
+
+def get_metrics_registry():
+    return registry
@@ -0,0 +1,385 @@
+import asyncio
+import collections
+import functools
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
+
+from config.config import settings
+
+PROFILE_HEADER = b'x-profile'
+ADMIN_KEY_HEADER = b'x-admin-key'
+PROFILE_ID_HEADER = b'x-profile-id'
+HEADER = 'header'
+SAMPLE = 'sample'
+WAITING = '[waiting]'
+TRUNCATED = '[truncated]'
+
+_current_profile: ContextVar = ContextVar('current_profile', default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _first_attribute(obj, names: tuple):
+    for name in names:
+        value = getattr(obj, name, None)
+        if value is not None:
+            return value
+    return None
+
+
+def _coroutine_frames(coro) -> list:
+    # Follows what each coroutine (or generator-based coroutine) is awaiting, down to the innermost one.
+    frames = []
+    while coro is not None:
+        frame = _first_attribute(coro, ('cr_frame', 'gi_frame', 'ag_frame'))
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = _first_attribute(coro, ('cr_await', 'gi_yieldfrom', 'ag_await'))
+    return frames
+
+
+class Profile:
+    """
+    What was recorded for one request: the spans (auth, upstream, mongo, redis, serialization) and the stack
+    samples, counted per collapsed stack. A sample is the running stack when one of the request's tasks held
+    the event loop, or the coroutine stack of the request, ending in [waiting], when it was suspended; the
+    stacks are therefore wall-clock, and the spans tell which I/O the waiting went to.
+    """
+
+    def __init__(self, trigger: str, method: str, path: str, max_stacks: int, max_spans: int):
+        self.id = uuid.uuid4().hex[:16]
+        self.pid = os.getpid()
+        self.trigger = trigger
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status: Optional[int] = None
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.max_stacks = max_stacks
+        self.max_spans = max_spans
+        self.spans: list = []
+        self.dropped_spans = 0
+        self.stacks: dict = {}
+        self.samples = 0
+        self.tasks: set = set()
+        self.root: Optional[asyncio.Task] = None
+
+    def add_span(self, name: str, start: float, end: float, detail: str = ''):
+        if len(self.spans) >= self.max_spans:
+            self.dropped_spans += 1
+            return
+        self.spans.append((name, detail, start - self._start, end - start))
+
+    def add_sample(self, stack: str):
+        self.samples += 1
+        if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+            stack = TRUNCATED
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def finish(self, status: Optional[int], route: Optional[str]):
+        self.duration = time.perf_counter() - self._start
+        self.status = status
+        self.route = route
+        self.tasks = set()
+        self.root = None
+
+    def span_totals(self) -> dict:
+        totals: dict = {}
+        for name, _, _, duration in self.spans:
+            total = totals.setdefault(name, {'count': 0, 'seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] += duration
+        return totals
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'pid': self.pid,
+            'trigger': self.trigger,
+            'method': self.method,
+            'path': self.path,
+            'route': self.route,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'samples': self.samples,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.summary(),
+            'span_totals': self.span_totals(),
+            'spans': [{'name': name, 'detail': detail, 'offset': offset, 'duration': duration}
+                      for name, detail, offset, duration in self.spans],
+            'dropped_spans': self.dropped_spans,
+        }
+
+    def collapsed(self) -> str:
+        """
+        The collapsed function renders the samples in the collapsed-stack format ("root;caller;callee count"),
+        which flamegraph.pl, speedscope and most flamegraph tools read.
+
+        :param self: Represent the instance of the class
+        :return: One line per distinct stack
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+
+class Profiler:
+    """
+    On-demand profiler of individual requests, kept in a ring of the last PROFILING_RING_SIZE profiles.
+
+    A request is profiled when it sends X-Profile: 1 together with the admin key in X-Admin-Key, or when it
+    is picked at PROFILING_SAMPLE_RATE. While at least one request is profiled, a sampler thread reads the
+    event loop's stack every PROFILING_SAMPLE_INTERVAL seconds, and a task factory marks the tasks the
+    profiled requests create, so samples are only counted for the request whose code was running. Nothing
+    of this runs while no request is profiled: an unprofiled request only pays for the trigger check and
+    for span() finding no profile in its context. Each worker keeps its own ring.
+    """
+
+    def __init__(self, ring_size: int, sample_rate: float, interval: float, max_stacks: int, max_spans: int):
+        self.profiles = collections.deque(maxlen=ring_size)
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_spans = max_spans
+        self.counters = {'profiled': 0, 'requested': 0, 'sampled': 0, 'samples': 0}
+        self._active: dict = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._previous_factory = None
+
+    def trigger(self, scope) -> Optional[str]:
+        """
+        The trigger function decides whether a request is profiled.
+
+        :param self: Represent the instance of the class
+        :param scope: The ASGI scope of the request
+        :return: header or sample when the request is profiled, otherwise None
+        """
+        if self.sample_rate and random.random() < self.sample_rate:
+            return SAMPLE
+        requested = admin_key = None
+        for name, value in scope['headers']:
+            if name == PROFILE_HEADER:
+                requested = value
+            elif name == ADMIN_KEY_HEADER:
+                admin_key = value
+        if requested not in (b'1', b'true') or not admin_key or not settings.ADMIN_API_KEY:
+            return None
+        if not hmac.compare_digest(admin_key, settings.ADMIN_API_KEY.encode()):
+            return None
+        return HEADER
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.tasks.add(task)
+        return task
+
+    def start(self, trigger: str, scope) -> Profile:
+        profile = Profile(trigger, scope['method'], scope['path'], self.max_stacks, self.max_spans)
+        profile.root = asyncio.current_task()
+        if profile.root is not None:
+            profile.tasks.add(profile.root)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._active:
+                self._loop, self._loop_thread_id = loop, threading.get_ident()
+                self._previous_factory = loop.get_task_factory()
+                loop.set_task_factory(self._task_factory)
+            self._active[profile.id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+                self._thread.start()
+        self.counters['profiled'] += 1
+        self.counters['requested' if trigger == HEADER else 'sampled'] += 1
+        return profile
+
+    def finish(self, profile: Profile, status: Optional[int], route: Optional[str]):
+        with self._lock:
+            self._active.pop(profile.id, None)
+            if not self._active:
+                self._loop.set_task_factory(self._previous_factory)
+                self._previous_factory = None
+            profile.finish(status, route)
+        self.profiles.append(profile)
+
+    def _stack(self, frame, task: asyncio.Task) -> str:
+        # Only the frames of the task's coroutine: the event loop below it is the same for every sample.
+        top = getattr(task.get_coro(), 'cr_frame', None)
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            if frame is top:
+                break
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                running = asyncio.current_task(self._loop)
+                frame = sys._current_frames().get(self._loop_thread_id)
+                for profile in self._active.values():
+                    try:
+                        if running is not None and running in profile.tasks:
+                            stack = self._stack(frame, running)
+                        elif profile.root is not None:
+                            frames = _coroutine_frames(profile.root.get_coro())
+                            stack = ';'.join([_frame_name(frame) for frame in frames] + [WAITING])
+                        else:
+                            continue
+                    except (AttributeError, ValueError):
+                        continue
+                    profile.add_sample(stack)
+                    self.counters['samples'] += 1
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        for profile in self.profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def clear(self) -> int:
+        cleared = len(self.profiles)
+        self.profiles.clear()
+        return cleared
+
+    def stats(self) -> dict:
+        return {**self.counters, 'active': len(self._active), 'stored': len(self.profiles),
+                'ring_size': self.profiles.maxlen, 'sample_rate': self.sample_rate, 'interval': self.interval}
+
+
+class span:
+    """
+    Times a block of a profiled request under a name (auth, upstream, mongo, redis, serialization):
+
+        with span('upstream', endpoint):
+            ...
+
+    Outside a profiled request it only looks up the context variable.
+    """
+
+    __slots__ = ('name', 'detail', 'profile', 'start')
+
+    def __init__(self, name: str, detail: str = ''):
+        self.name = name
+        self.detail = detail
+        self.profile = _current_profile.get()
+
+    def __enter__(self):
+        if self.profile is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.add_span(self.name, self.start, time.perf_counter(), self.detail)
+
+
+def add_span(name: str, start: float, end: float, detail: str = ''):
+    """
+    The add_span function records an already timed block as a span of the current profiled request, if any.
+
+    :param name: str: The span name
+    :param start: float: time.perf_counter() at the start of the block
+    :param end: float: time.perf_counter() at its end
+    :param detail: str: What exactly ran, e.g. the Redis command
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_span(name, start, end, detail)
+
+
+def traced(name: str):
+    """
+    The traced function decorates a coroutine function so every call is a span of a profiled request,
+    with the function name as the detail.
+
+    :param name: str: The span name
+    :return: The decorator
+    """
+    def decorator(func):
+        detail = func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                profile.add_span(name, start, time.perf_counter(), detail)
+        return wrapper
+    return decorator
+
+
+class ProfilingMiddleware:
+    """
+    Raw ASGI middleware profiling the requests the profiler picks; the others go straight through.
+    A profiled response carries the id of its profile in X-Profile-Id.
+    """
+
+    def __init__(self, app, profiler: 'Profiler' = None):
+        self.app = app
+        self.profiler = profiler or get_profiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        trigger = self.profiler.trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start(trigger, scope)
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message = {**message, 'headers': [*message.get('headers', []),
+                                                  (PROFILE_ID_HEADER, profile.id.encode())]}
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            self.profiler.finish(profile, status_code or 500, getattr(scope.get('route'), 'path', None))
+
+
+@lru_cache
+def get_profiler():
+    return Profiler(settings.PROFILING_RING_SIZE, settings.PROFILING_SAMPLE_RATE, settings.PROFILING_SAMPLE_INTERVAL,
+                    settings.PROFILING_MAX_STACKS, settings.PROFILING_MAX_SPANS)
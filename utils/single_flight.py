@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that ask for the same key into one in-flight execution.
+
+    The first caller for a key starts the work as its own task; callers arriving while it runs await
+    the same task instead of repeating the work. The task is shielded, so one cancelled caller does
+    not cancel the work for the others, while an exception (or cancellation of the work itself) is
+    raised to every caller. The shared result is returned as is, so callers must not mutate it.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.counters = {'calls': 0, 'executions': 0, 'deduplicated': 0}
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # Mark the exception as retrieved in case every caller was cancelled meanwhile.
+            future.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        The do function runs fn once for all the concurrent callers of the same key.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: Identifies the work, e.g. the upstream URL or the Mongo document id
+        :param fn: Callable: Zero-argument coroutine function doing the actual work
+        :return: The result of fn
+        """
+        self.counters['calls'] += 1
+        future = self._calls.get(key)
+        if future is None:
+            self.counters['executions'] += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.counters['deduplicated'] += 1
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {**self.counters, 'in_flight': len(self._calls)}
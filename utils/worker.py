@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import resource
+import sys
+import time
+from functools import lru_cache
+from typing import Optional
+
+from utils.metrics import worker_max_resident_memory_bytes, worker_resident_memory_bytes, worker_startup_seconds
+
+logger = logging.getLogger('uvicorn.error')
+
+STARTING = 'starting'
+READY = 'ready'
+DRAINING = 'draining'
+
+
+def process_start_time() -> float:
+    """
+    The process_start_time function returns when the current process started, as a Unix timestamp, so the
+    startup time includes the interpreter start and the imports. Outside Linux it falls back to now.
+
+    :return: The start time of the process
+    """
+    try:
+        with open('/proc/self/stat') as stat_file:
+            # The command name in parentheses may contain spaces; starttime is the 20th field after it.
+            start_ticks = int(stat_file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as stat_file:
+            boot_time = next(int(line.split()[1]) for line in stat_file if line.startswith('btime'))
+        return boot_time + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+def memory_usage() -> dict:
+    """
+    The memory_usage function reads the current and peak resident memory of the process.
+
+    :return: A dictionary with rss_bytes (None outside Linux) and max_rss_bytes
+    """
+    rss = None
+    try:
+        with open('/proc/self/statm') as statm_file:
+            rss = int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return {'rss_bytes': rss, 'max_rss_bytes': max_rss if sys.platform == 'darwin' else max_rss * 1024}
+
+
+class WorkerState:
+    """
+    Lifecycle of one server worker: starting until the app lifespan has created and warmed up its clients,
+    ready while it serves, and draining from the moment it is asked to stop (a readiness probe then fails,
+    so load balancers stop routing to it while it finishes the requests it has).
+
+    It also keeps what the worker reports about itself: how long it took to become ready, what the warm-up
+    of each backend cost, and its resident memory.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started_at = process_start_time()
+        self.ready_at: Optional[float] = None
+        self.status = STARTING
+        self.warmup: dict = {}
+        self.event_loop: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == READY
+
+    @property
+    def draining(self) -> bool:
+        return self.status == DRAINING
+
+    @property
+    def startup_seconds(self) -> Optional[float]:
+        return self.ready_at - self.started_at if self.ready_at is not None else None
+
+    async def warm_up(self, checks: dict, timeout: float) -> dict:
+        """
+        The warm_up function runs the warm-up of every backend concurrently, each limited to timeout seconds.
+        A failed warm-up is recorded and logged, but does not stop the worker from starting: every backend
+        already has its own fallback when it is down.
+
+        :param self: Represent the instance of the class
+        :param checks: dict: Maps a backend name to a coroutine function opening its connections
+        :param timeout: float: The seconds each warm-up may take
+        :return: A dictionary mapping each backend to its outcome and duration
+        """
+        async def run(name, check):
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(check(), timeout=timeout)
+                result = {'ok': True}
+            except Exception as exc:
+                result = {'ok': False, 'error': f'{type(exc).__name__}: {exc}'}
+                logger.warning('Warm-up of %s failed: %s', name, result['error'])
+            result['seconds'] = round(time.perf_counter() - start, 4)
+            self.warmup[name] = result
+
+        await asyncio.gather(*(run(name, check) for name, check in checks.items()))
+        return self.warmup
+
+    def mark_ready(self):
+        self.ready_at = time.time()
+        self.status = READY
+        self.event_loop = type(asyncio.get_running_loop()).__module__
+        worker_startup_seconds.set(str(self.pid), value=self.startup_seconds)
+        memory = self.update_metrics()
+        logger.info('Worker %s ready in %.2fs (event loop %s, rss %.1f MiB, warm-up %s)',
+                    self.pid, self.startup_seconds, self.event_loop,
+                    (memory['rss_bytes'] or memory['max_rss_bytes']) / 2 ** 20,
+                    {name: result['ok'] for name, result in self.warmup.items()})
+
+    def mark_draining(self):
+        if self.status != DRAINING:
+            self.status = DRAINING
+            logger.info('Worker %s draining', self.pid)
+
+    def update_metrics(self) -> dict:
+        memory = memory_usage()
+        if memory['rss_bytes'] is not None:
+            worker_resident_memory_bytes.set(str(self.pid), value=memory['rss_bytes'])
+        worker_max_resident_memory_bytes.set(str(self.pid), value=memory['max_rss_bytes'])
+        return memory
+
+    def stats(self) -> dict:
+        return {
+            'pid': self.pid,
+            'status': self.status,
+            'startup_seconds': self.startup_seconds,
+            'event_loop': self.event_loop,
+            'uptime_seconds': time.time() - self.started_at,
+            'warmup': self.warmup,
+            **memory_usage(),
+        }
+
+
+@lru_cache
+def get_worker_state():
+    return WorkerState()